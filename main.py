@@ -14,6 +14,13 @@ from stella.api.routes import (
     create_face_router,
     create_session_router
 )
+from stella.agent.stock_cache import close_http_client
+from stella.agent.context_cache import get_context_cache
+from stella.agent.speech_processor import session_state, session_store
+from stella.agent.session_identity import session_identities
+from stella.agent.turn_log import close_turn_log
+from stella.agent.cassette import get_cassette
+from stella.agent.metrics import metrics
 
 # Configuração da aplicação FastAPI
 app = FastAPI(
@@ -39,6 +46,21 @@ app.include_router(create_speech_router())
 app.include_router(create_face_router())
 app.include_router(create_session_router())
 
+@app.on_event("shutdown")
+async def shutdown():
+    """Libera conexões compartilhadas ao encerrar o servidor"""
+    await close_http_client()
+    await session_store.close()
+    await session_identities.close()
+    close_turn_log()
+    session_state.close()
+    context_cache = get_context_cache()
+    if context_cache is not None:
+        await context_cache.close()
+    cassette = get_cassette()
+    if cassette is not None:
+        cassette.close()
+
 @app.get("/", tags=["Status"])
 async def root():
     """
@@ -65,6 +87,16 @@ async def root():
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/metrics", tags=["Status"])
+async def get_metrics():
+    """
+    Métricas internas do agente (tokens, latência, caches)
+    
+    Returns:
+        Dict com contadores, gauges e distribuições
+    """
+    return metrics.snapshot()
+
 if __name__ == "__main__":
     import uvicorn
     
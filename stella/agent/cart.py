@@ -0,0 +1,142 @@
+"""
+Carrinho de retirada pendente por sessão
+
+Cada withdraw_request validado (itens já resolvidos contra o estoque) vira o
+carrinho da sessão. Uma confirmação simples ("sim, confirmo") publica o
+carrinho localmente, sem nova ida ao LLM; só edições ("troca para 3") vão ao
+modelo, que recebe o carrinho atual no prompt.
+
+O carrinho guarda apenas itens resolvidos e com estoque suficiente, e é
+descartado quando o usuário cancela ("não", "pode cancelar") ou quando o turno
+sai do fluxo de retirada (dúvida, consulta de estoque, saudação...).
+"""
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+from stella.agent.text_utils import tokenize
+from stella.agent.offline_parser import NUMBER_WORDS
+
+AFFIRMATIVES = {"sim", "confirmo", "confirma", "confirmado", "confirmar", "pode", "isso", "ok", "okay", "certo", "claro", "exato", "fechado", "beleza", "perfeito"}
+# Palavras que podem acompanhar uma confirmação sem mudar o pedido
+CONFIRMATION_FILLERS = {
+    "stella", "por", "favor", "mesmo", "ser", "mandar", "manda", "seguir", "segue", "pra", "mim",
+    "e", "eu", "a", "o", "retirada", "pedido", "tudo", "certinho", "obrigado", "obrigada", "ta", "esta",
+}
+NEGATIVES = {"nao", "cancela", "cancelar", "cancelo", "cancele", "cancelado", "desisto", "desistir", "esquece", "esqueca", "deixa"}
+# Palavras que podem acompanhar um cancelamento ("não quero mais", "deixa pra lá")
+CANCELLATION_FILLERS = CONFIRMATION_FILLERS | {"quero", "mais", "nada", "la", "pode", "agora", "isso"}
+
+# Intenções que mantêm o carrinho pendente
+WITHDRAW_INTENTIONS = {"withdraw_request", "withdraw_confirm"}
+
+
+_AFFIRMATIVE_FORMS = {t for w in AFFIRMATIVES for t in tokenize(w)}
+_CONFIRMATION_FORMS = _AFFIRMATIVE_FORMS | {t for w in CONFIRMATION_FILLERS for t in tokenize(w)}
+_NEGATIVE_FORMS = {t for w in NEGATIVES for t in tokenize(w)}
+_CANCELLATION_FORMS = _NEGATIVE_FORMS | {t for w in CANCELLATION_FILLERS for t in tokenize(w)}
+
+
+def is_confirmation(utterance: str) -> bool:
+    """
+    A fala é apenas uma confirmação (sem edição, negação ou quantidade)?
+
+    'sim, confirmo' e 'pode mandar' são; 'sim, mas troca para 3' e 'não' não são.
+    """
+    tokens = tokenize(utterance)
+    if not tokens or any(t.isdigit() or t in NUMBER_WORDS for t in tokens):
+        return False
+    return all(t in _CONFIRMATION_FORMS for t in tokens) and any(t in _AFFIRMATIVE_FORMS for t in tokens)
+
+
+def is_cancellation(utterance: str) -> bool:
+    """
+    A fala apenas recusa/cancela o pedido pendente?
+
+    'não', 'pode cancelar' e 'deixa pra lá' são; 'não, quero 3' e 'não, a luva' não são.
+    """
+    tokens = tokenize(utterance)
+    if not tokens or any(t.isdigit() or t in NUMBER_WORDS for t in tokens):
+        return False
+    return all(t in _CANCELLATION_FORMS for t in tokens) and any(t in _NEGATIVE_FORMS for t in tokens)
+
+
+@dataclass
+class WithdrawalCart:
+    """Itens de um pedido de retirada aguardando confirmação"""
+    items: List[Dict[str, Any]] = field(default_factory=list)  # {'productName', 'quantity'}
+    updated_at: float = field(default_factory=time.time)
+
+    @property
+    def product_names(self) -> List[str]:
+        return [it["productName"] for it in self.items]
+
+    def matches(self, items: List[Dict[str, Any]]) -> bool:
+        """Mesmos produtos e quantidades (itens já resolvidos contra o estoque)"""
+        def normalized(entries):
+            return sorted((it["productName"], int(it.get("quantity", 0))) for it in entries)
+        return normalized(self.items) == normalized(items)
+
+    def describe(self, stock: Optional[Dict[str, Any]] = None) -> str:
+        """'5 Seringa 10ml, 2 Luva' (nomes do estoque quando disponíveis)"""
+        stock = stock or {}
+        return ", ".join(
+            f"{it['quantity']} {(stock.get(it['productName']) or {}).get('name') or it['productName']}"
+            for it in self.items
+        )
+
+
+class CartStore:
+    """Carrinhos por session_id"""
+
+    def __init__(self):
+        self._carts: Dict[str, WithdrawalCart] = {}
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._carts
+
+    def get(self, session_id: str) -> Optional[WithdrawalCart]:
+        return self._carts.get(session_id)
+
+    def set(self, session_id: str, items: List[Dict[str, Any]]) -> Optional[WithdrawalCart]:
+        """
+        Substitui o carrinho da sessão pelos itens do último pedido validado
+
+        Sem itens confirmáveis o carrinho é descartado (retorna None).
+        """
+        items = [
+            {"productName": it["productName"], "quantity": int(it.get("quantity", 0))}
+            for it in items if int(it.get("quantity", 0)) > 0
+        ]
+        if not items:
+            self._carts.pop(session_id, None)
+            return None
+        cart = WithdrawalCart(items=items)
+        self._carts[session_id] = cart
+        return cart
+
+    def pop(self, session_id: str) -> Optional[WithdrawalCart]:
+        return self._carts.pop(session_id, None)
+
+    def clear_unless_withdraw(self, session_id: str, intention: Optional[str]) -> bool:
+        """Descarta o carrinho quando o turno saiu do fluxo de retirada; True se havia carrinho"""
+        if intention in WITHDRAW_INTENTIONS:
+            return False
+        return self._carts.pop(session_id, None) is not None
+
+    def restore(self, session_id: str, data: Optional[Dict[str, Any]]):
+        """Recarrega o carrinho serializado (None = sessão sem carrinho)"""
+        if data is None:
+            self._carts.pop(session_id, None)
+            return
+        self._carts[session_id] = WithdrawalCart(items=data["items"], updated_at=data.get("updated_at", time.time()))
+
+    def to_dict(self, session_id: str) -> Optional[Dict[str, Any]]:
+        cart = self._carts.get(session_id)
+        return None if cart is None else {"items": cart.items, "updated_at": cart.updated_at}
+
+    def pending_names(self, session_id: str) -> List[str]:
+        cart = self._carts.get(session_id)
+        return cart.product_names if cart else []
+
+
+carts = CartStore()
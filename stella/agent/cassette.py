@@ -0,0 +1,382 @@
+"""
+Cassetes de gravação/reprodução das interações com o LLM e o inventário
+
+Para otimizar a montagem do prompt e o pós-processamento é preciso repetir
+exatamente as mesmas entradas, mas cada execução do command_interpreter ia ao
+Gemini e à API de inventário. Aqui:
+
+- record: cada chamada ao modelo (mensagens enviadas, texto bruto, latência,
+  tempos dos pedaços do stream, uso de tokens), cada leitura do estoque e cada
+  turno (fala, resultado final, tempo) são anexados a um arquivo JSONL
+  (compactado com gzip se o nome terminar em .gz: cada entrada é um membro
+  gzip completo, então o arquivo é legível mesmo sem close())
+- replay: as respostas do modelo saem do cassete (casadas pelo hash das
+  mensagens; na falta de nova gravação para a mesma chave, repete a última),
+  o estoque é o gravado no turno e nenhuma retirada é publicada. Com
+  `replay_latency`, as latências originais são reproduzidas
+
+Benchmark de regressão (reexecuta os turnos gravados e compara os resultados):
+    python -m stella.agent.cassette bench caminho/do/cassete.jsonl [--latency]
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Sequence
+from loguru import logger
+from stella.agent.metrics import metrics
+from stella.agent.stock_cache import StockSnapshot
+from stella.config.settings import get_settings
+
+DEFAULT_CASSETTE_PATH = Path(__file__).parent.parent / "data" / "cassettes" / "stella.jsonl"
+
+
+class CassetteMiss(LookupError):
+    """Chamada ao modelo sem gravação correspondente no cassete"""
+
+
+def contents_key(contents: Any) -> str:
+    """Chave estável das mensagens enviadas ao modelo"""
+    raw = json.dumps(contents, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def _open(path: Path, mode: str):
+    if path.suffix == ".gz":
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _read_lines(path: Path) -> List[str]:
+    """Linhas do cassete; um final truncado (processo encerrado no meio da escrita) é ignorado"""
+    lines = []
+    try:
+        with _open(path, "r") as f:
+            for line in f:
+                lines.append(line)
+    except (EOFError, gzip.BadGzipFile) as e:
+        logger.warning(f"Cassete {path.name} termina truncado, usando as entradas completas: {e}")
+    return lines
+
+
+def _usage_dict(response: Any) -> Optional[Dict[str, int]]:
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None
+    return {
+        "prompt_token_count": getattr(usage, "prompt_token_count", 0) or 0,
+        "cached_content_token_count": getattr(usage, "cached_content_token_count", 0) or 0,
+    }
+
+
+class Cassette:
+    """Arquivo de interações gravadas (modo 'record' ou 'replay')"""
+
+    def __init__(self, path: Path, mode: str, replay_latency: bool = False):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Modo de cassete inválido: {mode}")
+        self.path = path
+        self.mode = mode
+        self.replay_latency = replay_latency
+        self.turns: List[Dict[str, Any]] = []
+        self._llm: Dict[str, Deque[Dict[str, Any]]] = defaultdict(deque)
+        self._last_llm: Dict[str, Dict[str, Any]] = {}
+        self._snapshots: Dict[str, Dict[str, Any]] = {}  # versão -> itens
+        self._stock_calls: Deque[Dict[str, Any]] = deque()
+        self._recorded_versions: set = set()
+        self._last_version = ""
+        self._turn_version: Optional[str] = None
+        self._file = None  # Aberto na primeira gravação
+        if mode == "replay":
+            self._load()
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    # ------------------------------------------------------------------ gravação
+
+    def _write(self, entry: Dict[str, Any]):
+        """Anexa a entrada ao cassete; falhas são registradas e nunca interrompem o turno"""
+        try:
+            line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"), default=str) + "\n"
+            if self.path.suffix == ".gz":
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                # Um membro gzip por entrada: cada escrita fecha o próprio trailer
+                with gzip.open(self.path, "ab") as f:
+                    f.write(line.encode("utf-8"))
+                return
+            if self._file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = _open(self.path, "a")
+            self._file.write(line)
+            self._file.flush()
+        except Exception as e:
+            logger.warning(f"Não foi possível gravar no cassete {self.path.name}: {e}")
+            metrics.inc("cassette.write_errors")
+
+    def record_llm(self, contents: Any, text: str, latency_ms: float,
+                   chunk_offsets_ms: Optional[List[float]] = None, chunks: Optional[List[str]] = None,
+                   usage: Optional[Dict[str, int]] = None):
+        entry = {
+            "kind": "llm",
+            "key": contents_key(contents),
+            "contents": contents,
+            "text": text,
+            "latency_ms": round(latency_ms, 2),
+        }
+        if chunks is not None:
+            entry["chunks"] = chunks
+            entry["chunk_offsets_ms"] = [round(t, 2) for t in chunk_offsets_ms or []]
+        if usage is not None:
+            entry["usage"] = usage
+        self._write(entry)
+        metrics.inc("cassette.recorded_llm")
+
+    def record_stock(self, snapshot: StockSnapshot, latency_ms: float):
+        entry = {"kind": "stock", "version": snapshot.version, "latency_ms": round(latency_ms, 2)}
+        if snapshot.version not in self._recorded_versions:
+            # Itens só na primeira leitura de cada versão
+            self._recorded_versions.add(snapshot.version)
+            entry["items"] = snapshot.items
+        self._last_version = snapshot.version
+        self._write(entry)
+
+    def record_turn(self, session_id: str, utterance: str, result: Any, elapsed_ms: float):
+        self._write({
+            "kind": "turn",
+            "session_id": session_id,
+            "utterance": utterance,
+            "result": result,
+            "stock_version": self._last_version,
+            "elapsed_ms": round(elapsed_ms, 2),
+        })
+
+    # --------------------------------------------------------------- reprodução
+
+    def _load(self):
+        if not self.path.exists():
+            raise FileNotFoundError(f"Cassete não encontrado: {self.path}")
+        for line in _read_lines(self.path):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Linha incompleta no fim do arquivo
+            kind = entry.get("kind")
+            if kind == "llm":
+                self._llm[entry["key"]].append(entry)
+            elif kind == "stock":
+                if "items" in entry:
+                    self._snapshots[entry["version"]] = entry["items"]
+                self._stock_calls.append(entry)
+            elif kind == "turn":
+                self.turns.append(entry)
+        logger.info(
+            f"📼 Cassete carregado | {len(self.turns)} turnos | "
+            f"{sum(len(v) for v in self._llm.values())} chamadas ao LLM | {len(self._snapshots)} versões de estoque"
+        )
+
+    def begin_turn(self, turn: Dict[str, Any]):
+        """Reprodução por turno (benchmark): o estoque passa a ser o gravado naquele turno"""
+        self._turn_version = turn.get("stock_version") or None
+
+    async def _sleep(self, ms: float):
+        if self.replay_latency and ms > 0:
+            await asyncio.sleep(ms / 1000)
+
+    async def replay_llm(self, contents: Any, stream: bool = False) -> Any:
+        key = contents_key(contents)
+        queue = self._llm.get(key)
+        if queue:
+            entry = queue.popleft()
+            self._last_llm[key] = entry
+        elif key in self._last_llm:
+            entry = self._last_llm[key]  # ex: tentativa de hedge da mesma chamada
+        else:
+            metrics.inc("cassette.misses")
+            raise CassetteMiss(f"Chamada ao LLM sem gravação no cassete (chave {key})")
+        metrics.inc("cassette.replayed_llm")
+
+        usage = SimpleNamespace(**entry["usage"]) if entry.get("usage") else None
+        if not stream:
+            await self._sleep(entry.get("latency_ms", 0))
+            return SimpleNamespace(text=entry["text"], usage_metadata=usage)
+        chunks = entry.get("chunks") or [entry["text"]]
+        offsets = entry.get("chunk_offsets_ms") or [entry.get("latency_ms", 0)] * len(chunks)
+        return self._replay_chunks(chunks, offsets, usage)
+
+    async def _replay_chunks(self, chunks: List[str], offsets: List[float], usage: Any) -> AsyncIterator[Any]:
+        previous = 0.0
+        for n, (text, offset) in enumerate(zip(chunks, offsets)):
+            await self._sleep(offset - previous)
+            previous = offset
+            yield SimpleNamespace(text=text, usage_metadata=usage if n == len(chunks) - 1 else None)
+
+    async def replay_stock(self) -> StockSnapshot:
+        # Leituras na ordem gravada (a última se repete); no benchmark a versão é a do turno
+        entry = self._stock_calls.popleft() if len(self._stock_calls) > 1 else (
+            self._stock_calls[0] if self._stock_calls else {"version": "", "latency_ms": 0}
+        )
+        version = entry["version"]
+        if self._turn_version is not None and self._turn_version in self._snapshots:
+            version = self._turn_version
+        await self._sleep(entry.get("latency_ms", 0))
+        return StockSnapshot(items=self._snapshots.get(version, {}), version=version, fetched_at=time.time())
+
+    # ------------------------------------------------------------------- ganchos
+
+    def wrap_model(self, model: Any) -> "CassetteModel":
+        return CassetteModel(model, self)
+
+    async def intercept_stock(self, fetch: Callable[[], Awaitable[StockSnapshot]]) -> StockSnapshot:
+        """Interceptador de stock_cache.get_stock_snapshot"""
+        if self.replaying:
+            return await self.replay_stock()
+        started = time.perf_counter()
+        snapshot = await fetch()
+        self.record_stock(snapshot, (time.perf_counter() - started) * 1000)
+        return snapshot
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class CassetteModel:
+    """Modelo que grava as chamadas ao modelo real ou as reproduz do cassete"""
+
+    def __init__(self, inner: Any, cassette: Cassette):
+        self.inner = inner
+        self.cassette = cassette
+
+    async def generate_content_async(self, contents: Any, stream: bool = False, **kwargs):
+        if self.cassette.replaying:
+            return await self.cassette.replay_llm(contents, stream)
+        started = time.perf_counter()
+        if not stream:
+            response = await self.inner.generate_content_async(contents, **kwargs)
+            self.cassette.record_llm(
+                contents, response.text, (time.perf_counter() - started) * 1000, usage=_usage_dict(response)
+            )
+            return response
+        response = await self.inner.generate_content_async(contents, stream=True, **kwargs)
+        return self._record_stream(contents, response, started)
+
+    async def _record_stream(self, contents: Any, response: Any, started: float) -> AsyncIterator[Any]:
+        chunks: List[str] = []
+        offsets: List[float] = []
+        last_chunk = None
+        async for chunk in response:
+            last_chunk = chunk
+            try:
+                chunks.append(chunk.text)
+                offsets.append((time.perf_counter() - started) * 1000)
+            except ValueError:
+                pass  # pedaço sem texto (ex: apenas metadados)
+            yield chunk
+        self.cassette.record_llm(
+            contents, "".join(chunks), (time.perf_counter() - started) * 1000,
+            chunk_offsets_ms=offsets, chunks=chunks, usage=_usage_dict(last_chunk)
+        )
+
+
+_cassette: Optional[Cassette] = None
+
+
+def configure_cassette() -> Optional[Cassette]:
+    """Abre o cassete conforme a seção cassette (mode: off | record | replay)"""
+    global _cassette
+    settings = get_settings()
+    mode = settings.get('cassette.mode', 'off')
+    if mode in (None, 'off'):
+        _cassette = None
+        return None
+    path = settings.get('cassette.path')
+    _cassette = Cassette(
+        Path(path) if path else DEFAULT_CASSETTE_PATH,
+        mode,
+        replay_latency=settings.get('cassette.replay_latency', False)
+    )
+    logger.info(f"📼 Cassete em modo {mode}: {_cassette.path}")
+    return _cassette
+
+
+def get_cassette() -> Optional[Cassette]:
+    return _cassette
+
+
+async def _bench(turns: List[Dict[str, Any]], cassette: Cassette) -> int:
+    from stella.agent.speech_processor import command_interpreter
+
+    mismatches = 0
+    elapsed: List[float] = []
+    for n, turn in enumerate(turns):
+        cassette.begin_turn(turn)
+        started = time.perf_counter()
+        result = await command_interpreter(turn["utterance"], turn["session_id"])
+        elapsed.append((time.perf_counter() - started) * 1000)
+        expected = json.dumps(turn["result"], sort_keys=True, ensure_ascii=False, default=str)
+        actual = json.dumps(result, sort_keys=True, ensure_ascii=False, default=str)
+        if actual != expected:
+            mismatches += 1
+            print(f"❌ Turno {n} ({turn['session_id']}): \"{turn['utterance']}\"")
+            print(f"   gravado: {expected}")
+            print(f"   atual:   {actual}")
+
+    ordered = sorted(elapsed)
+    recorded = sum(t.get("elapsed_ms", 0) for t in turns)
+    print(f"\nTurnos: {len(turns)} | iguais: {len(turns) - mismatches} | diferentes: {mismatches}")
+    if ordered:
+        print(
+            f"Tempo total: {sum(elapsed):.1f} ms (gravado: {recorded:.1f} ms) | "
+            f"p50: {ordered[len(ordered) // 2]:.1f} ms | máx: {ordered[-1]:.1f} ms"
+        )
+    print(f"Chamadas ao LLM sem gravação: {int(metrics.counter('cassette.misses'))}")
+    return mismatches
+
+
+def _bench_command(args):
+    settings = get_settings()
+    settings.set('cassette.mode', 'replay')
+    settings.set('cassette.path', args.path)
+    settings.set('cassette.replay_latency', args.latency)
+    # Turnos iguais na gravação e na reprodução: sem caches entre execuções nem hedge
+    settings.set('response_cache.enabled', False)
+    settings.set('llm.hedge_enabled', False)
+    settings.set('sessions.backend', 'memory')
+
+    import stella.agent.speech_processor  # noqa: F401 (abre o cassete e instala os ganchos)
+    cassette = get_cassette()
+    turns = cassette.turns[:args.limit] if args.limit else cassette.turns
+    mismatches = asyncio.run(_bench(turns, cassette))
+    raise SystemExit(1 if mismatches else 0)
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(description="Cassetes de gravação/reprodução da Stella")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    bench = sub.add_parser("bench", help="Reexecuta os turnos gravados e compara os resultados")
+    bench.add_argument("path")
+    bench.add_argument("--latency", action="store_true", help="Reproduz as latências originais")
+    bench.add_argument("--limit", type=int, default=0, help="Máximo de turnos (0 = todos)")
+    bench.set_defaults(func=_bench_command)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
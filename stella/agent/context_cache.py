@@ -0,0 +1,240 @@
+"""
+Cache de contexto do Gemini: instrução de sistema + catálogo de estoque
+
+A instrução de sistema e o catálogo mudam raramente, mas iam inteiros em todo
+turno. Aqui eles são registrados uma vez por versão do snapshot de estoque
+como um prefixo em cache (CachedContent do Gemini); os turnos apenas
+referenciam esse cache. Quando o hash do snapshot muda, um novo cache é criado
+e o anterior é apagado.
+
+Backends:
+- GeminiContextCacheBackend: google.generativeai.caching.CachedContent
+- LocalContextCacheBackend: substituto local (testes/desenvolvimento) que
+  injeta o prefixo nas mensagens e simula a contagem de tokens em cache
+"""
+import asyncio
+import datetime
+import time
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+from loguru import logger
+from stella.agent.metrics import metrics
+from stella.agent.stock_cache import StockSnapshot
+from stella.agent.stock_context import format_stock_for_prompt
+from stella.agent.text_utils import estimate_tokens
+from stella.config.settings import get_settings
+
+
+def catalog_prefix(snapshot: StockSnapshot) -> str:
+    """Texto do catálogo registrado no cache"""
+    return (
+        f"ESTOQUE ATUAL (versão {snapshot.version}):\n"
+        f"{format_stock_for_prompt(snapshot.items)}"
+    )
+
+
+@dataclass
+class CachedContext:
+    """Prefixo em cache para uma versão do snapshot"""
+    version: str
+    model: Any              # modelo que referencia o cache (mesma interface do GenerativeModel)
+    handle: Any             # objeto do backend (para apagar)
+    cached_tokens: int
+    created_at: float
+
+
+class LocalContextCacheBackend:
+    """Substituto local: o "cache" é o prefixo injetado antes do histórico"""
+
+    def __init__(self, base_model: Any):
+        self.base_model = base_model
+
+    def create(self, model_id: str, system_instruction: str, prefix: str,
+               ttl_seconds: float, generation_config: Optional[Dict[str, Any]] = None) -> Any:
+        return SimpleNamespace(prefix=prefix, tokens=estimate_tokens(system_instruction) + estimate_tokens(prefix))
+
+    def model_for(self, handle: Any, generation_config: Optional[Dict[str, Any]] = None) -> Any:
+        return _PrefixedModel(self.base_model, handle)
+
+    def delete(self, handle: Any):
+        pass
+
+
+class _PrefixedModel:
+    """Modelo que envia o prefixo em cache antes das mensagens do turno"""
+
+    def __init__(self, base_model: Any, handle: Any):
+        self.base_model = base_model
+        self.handle = handle
+
+    def _contents(self, contents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [{"role": "user", "parts": [self.handle.prefix]}] + list(contents)
+
+    async def generate_content_async(self, contents: List[Dict[str, Any]], **kwargs):
+        response = await self.base_model.generate_content_async(self._contents(contents), **kwargs)
+        if getattr(response, "usage_metadata", None) is None and not kwargs.get("stream"):
+            # Simula a contagem do Gemini: o prefixo é cobrado como token em cache
+            turn_tokens = sum(estimate_tokens(str(p)) for c in contents for p in c.get("parts", []))
+            try:
+                response.usage_metadata = SimpleNamespace(
+                    prompt_token_count=self.handle.tokens + turn_tokens,
+                    cached_content_token_count=self.handle.tokens,
+                )
+            except AttributeError:
+                pass
+        return response
+
+    def generate_content(self, contents: List[Dict[str, Any]], **kwargs):
+        return self.base_model.generate_content(self._contents(contents), **kwargs)
+
+
+class GeminiContextCacheBackend:
+    """Cache de contexto real da API do Gemini"""
+
+    def create(self, model_id: str, system_instruction: str, prefix: str,
+               ttl_seconds: float, generation_config: Optional[Dict[str, Any]] = None) -> Any:
+        from google.generativeai import caching
+        return caching.CachedContent.create(
+            model=model_id if model_id.startswith("models/") else f"models/{model_id}",
+            display_name="stella-catalog",
+            system_instruction=system_instruction,
+            contents=[{"role": "user", "parts": [prefix]}],
+            ttl=datetime.timedelta(seconds=ttl_seconds),
+        )
+
+    def model_for(self, handle: Any, generation_config: Optional[Dict[str, Any]] = None) -> Any:
+        import google.generativeai as genai
+        return genai.GenerativeModel.from_cached_content(cached_content=handle, generation_config=generation_config)
+
+    def delete(self, handle: Any):
+        handle.delete()
+
+
+class ContextCacheManager:
+    """Mantém um prefixo em cache por versão do snapshot de estoque"""
+
+    def __init__(
+        self,
+        backend: Any,
+        model_id: str,
+        system_instruction: str,
+        generation_config: Optional[Dict[str, Any]] = None,
+        ttl_seconds: float = 3600,
+        min_tokens: int = 1024
+    ):
+        self.backend = backend
+        self.model_id = model_id
+        self.system_instruction = system_instruction
+        self.generation_config = generation_config
+        self.ttl_seconds = ttl_seconds
+        self.min_tokens = min_tokens
+        self._current: Optional[CachedContext] = None
+        self._failed_version: Optional[str] = None
+        self._lock = asyncio.Lock()
+
+    def _usable(self, version: str) -> bool:
+        current = self._current
+        # Renova um pouco antes do TTL do servidor expirar
+        return (
+            current is not None
+            and current.version == version
+            and time.time() - current.created_at < self.ttl_seconds * 0.9
+        )
+
+    async def get(self, snapshot: StockSnapshot) -> Optional[CachedContext]:
+        """
+        Contexto em cache para o snapshot, criando-o se a versão mudou
+
+        Returns:
+            CachedContext ou None (catálogo pequeno demais, ou falha ao criar o cache)
+        """
+        if not snapshot.version or snapshot.version == self._failed_version:
+            return None
+        if self._usable(snapshot.version):
+            return self._current
+
+        async with self._lock:
+            if self._usable(snapshot.version):
+                return self._current
+            prefix = catalog_prefix(snapshot)
+            tokens = estimate_tokens(self.system_instruction) + estimate_tokens(prefix)
+            if tokens < self.min_tokens:
+                logger.debug(f"Catálogo pequeno para cache de contexto (~{tokens} tokens)")
+                self._failed_version = snapshot.version
+                return None
+            try:
+                handle = await asyncio.to_thread(
+                    self.backend.create, self.model_id, self.system_instruction, prefix,
+                    self.ttl_seconds, self.generation_config
+                )
+                model = self.backend.model_for(handle, self.generation_config)
+            except Exception as e:
+                logger.warning(f"Não foi possível criar cache de contexto: {e}")
+                metrics.inc("context_cache.create_failed")
+                self._failed_version = snapshot.version
+                return None
+
+            previous = self._current
+            self._current = CachedContext(snapshot.version, model, handle, tokens, time.time())
+            metrics.inc("context_cache.created")
+            metrics.set_gauge("context_cache.prefix_tokens", tokens)
+            logger.info(f"🧠 Cache de contexto criado | versão {snapshot.version} | ~{tokens} tokens")
+            if previous is not None:
+                await self._delete(previous)
+            return self._current
+
+    async def _delete(self, context: CachedContext):
+        try:
+            await asyncio.to_thread(self.backend.delete, context.handle)
+        except Exception as e:
+            logger.debug(f"Falha ao apagar cache de contexto antigo: {e}")
+
+    async def close(self):
+        """Apaga o cache atual (desligamento)"""
+        if self._current is not None:
+            await self._delete(self._current)
+            self._current = None
+
+
+_manager: Optional[ContextCacheManager] = None
+
+
+def configure_context_cache(
+    base_model: Any,
+    model_id: str,
+    system_instruction: str,
+    generation_config: Optional[Dict[str, Any]] = None,
+    provider: Any = None
+) -> Optional[ContextCacheManager]:
+    """
+    Cria o gerenciador conforme a seção llm.context_cache
+
+    O backend 'local' força o substituto local; caso contrário vale o backend
+    do provedor do LLM (Gemini por padrão).
+    """
+    global _manager
+    settings = get_settings()
+    if not settings.get('llm.context_cache_enabled', False):
+        _manager = None
+        return None
+    backend_name = settings.get('llm.context_cache_backend', 'gemini')
+    if backend_name == 'local':
+        backend = LocalContextCacheBackend(base_model)
+    elif provider is not None:
+        backend = provider.context_cache_backend(base_model)
+    else:
+        backend = GeminiContextCacheBackend()
+    _manager = ContextCacheManager(
+        backend,
+        model_id,
+        system_instruction,
+        generation_config,
+        ttl_seconds=settings.get('llm.context_cache_ttl_seconds', 3600),
+        min_tokens=settings.get('llm.context_cache_min_tokens', 1024)
+    )
+    return _manager
+
+
+def get_context_cache() -> Optional[ContextCacheManager]:
+    return _manager
@@ -0,0 +1,130 @@
+"""
+Histórico de conversa gerenciado pela Stella
+
+O ChatSession do Gemini guarda cada prompt inteiro, então cada turno carregava
+uma cópia do estoque para sempre (turno N reenviava N estoques). Aqui o
+histórico guarda só a fala do usuário e a resposta JSON compacta da Stella; o
+estoque atual entra apenas no prompt do turno corrente. Quando o histórico
+passa do orçamento de tokens, os turnos mais antigos viram um resumo curto.
+"""
+import json
+from typing import Any, Callable, Dict, List, Optional
+from stella.agent.text_utils import estimate_tokens
+
+
+def compact_response(resultado: Dict[str, Any]) -> str:
+    """JSON compacto da resposta da Stella, como é guardado no histórico"""
+    compact = {
+        "intention": resultado.get("intention"),
+        "response": resultado.get("response"),
+        "stella_analysis": resultado.get("stella_analysis"),
+    }
+    if resultado.get("items"):
+        compact["items"] = resultado.get("items")
+    return json.dumps(compact, ensure_ascii=False, separators=(",", ":"))
+
+
+class ConversationHistory:
+    """Histórico compacto de uma sessão (falas do usuário e respostas JSON da Stella)"""
+
+    # Custo fixo aproximado de cada mensagem guardada (dict + strings), em bytes
+    MESSAGE_OVERHEAD_BYTES = 120
+
+    def __init__(self, token_budget: int = 1500, keep_recent_turns: int = 4, summary_max_chars: int = 1200,
+                 max_turns: Optional[int] = None, on_resize: Optional[Callable[[int], None]] = None):
+        self.token_budget = token_budget
+        self.keep_recent_turns = keep_recent_turns
+        self.summary_max_chars = summary_max_chars
+        self.max_turns = max_turns  # teto de turnos mantidos na íntegra (além do orçamento de tokens)
+        self.on_resize = on_resize  # recebe a variação de approx_bytes (ex: orçamento de memória do SessionStore)
+        self.turns: List[Dict[str, str]] = []  # {"role": "user"|"model", "text": ...}
+        self.summary = ""
+        self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self.turns)
+
+    def add_exchange(self, utterance: str, resultado: Dict[str, Any]):
+        """Registra um turno completo (fala + resposta) e compacta se necessário"""
+        self.turns.append({"role": "user", "text": utterance})
+        self.turns.append({"role": "model", "text": compact_response(resultado)})
+        self._compact()
+        self._resized()
+
+    def approx_bytes(self) -> int:
+        """Memória aproximada ocupada pelo histórico"""
+        return self._bytes
+
+    def _resized(self):
+        size = len(self.summary.encode("utf-8")) + sum(
+            len(t["text"].encode("utf-8")) + self.MESSAGE_OVERHEAD_BYTES for t in self.turns
+        )
+        delta, self._bytes = size - self._bytes, size
+        if delta and self.on_resize is not None:
+            self.on_resize(delta)
+
+    def estimated_tokens(self) -> int:
+        return estimate_tokens(self.summary) + sum(estimate_tokens(t["text"]) for t in self.turns)
+
+    def _compact(self):
+        """Move os turnos mais antigos para o resumo enquanto o orçamento for excedido"""
+        min_messages = self.keep_recent_turns * 2
+        max_messages = None if self.max_turns is None else max(self.max_turns, self.keep_recent_turns) * 2
+        while len(self.turns) > min_messages and (
+            self.estimated_tokens() > self.token_budget
+            or (max_messages is not None and len(self.turns) > max_messages)
+        ):
+            user_msg = self.turns.pop(0)
+            model_msg = self.turns.pop(0) if self.turns and self.turns[0]["role"] == "model" else None
+            self.summary = self._append_summary(user_msg, model_msg)
+
+    def _append_summary(self, user_msg: Dict[str, str], model_msg: Optional[Dict[str, str]]) -> str:
+        line = f"- Usuário: {user_msg['text']}"
+        if model_msg is not None:
+            try:
+                data = json.loads(model_msg["text"])
+                line += f" | Stella: {data.get('intention')}"
+                if data.get("items"):
+                    itens = ", ".join(
+                        f"{it.get('productName')} x{it.get('quantity')}" for it in data["items"]
+                    )
+                    line += f" ({itens})"
+            except (json.JSONDecodeError, AttributeError):
+                line += f" | Stella: {model_msg['text'][:80]}"
+        summary = f"{self.summary}\n{line}".strip()
+        if len(summary) > self.summary_max_chars:
+            # Mantém o final (mais recente) do resumo
+            summary = summary[-self.summary_max_chars:]
+            summary = summary[summary.find("\n") + 1:] if "\n" in summary else summary
+        return summary
+
+    def build_contents(self, prompt: str) -> List[Dict[str, Any]]:
+        """
+        Monta o conteúdo da requisição ao Gemini: histórico compacto + prompt do turno
+
+        Args:
+            prompt: Prompt do turno atual (inclui o estoque atual)
+
+        Returns:
+            Lista de mensagens no formato {"role", "parts"}
+        """
+        contents = [{"role": t["role"], "parts": [t["text"]]} for t in self.turns]
+        if self.summary:
+            prompt = f"RESUMO DA CONVERSA ANTERIOR:\n{self.summary}\n\n{prompt}"
+        contents.append({"role": "user", "parts": [prompt]})
+        return contents
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Forma compacta e serializável (backends de estado de sessão)"""
+        return {"summary": self.summary, "turns": [[t["role"], t["text"]] for t in self.turns]}
+
+    def load_dict(self, data: Dict[str, Any]):
+        """Substitui o conteúdo pelo estado serializado por to_dict"""
+        self.summary = data.get("summary") or ""
+        self.turns = [{"role": role, "text": text} for role, text in data.get("turns") or []]
+        self._resized()
+
+    def clear(self):
+        self.turns.clear()
+        self.summary = ""
+        self._resized()
@@ -0,0 +1,231 @@
+"""
+Processamento idempotente de falas por (session_id, correlation_id)
+
+Quando o quiosque repete um /speech/process após uma falha de rede, a mesma
+fala virava um segundo turno completo (nova chamada ao LLM) e podia até
+publicar um segundo withdraw_confirm no RabbitMQ. Aqui:
+- uma repetição que chega com o turno original ainda em andamento aguarda o
+  mesmo resultado (single-flight)
+- uma repetição após o fim recebe o resultado guardado, dentro do TTL
+- falhas não são guardadas: a próxima tentativa processa de novo (inclusive
+  turnos que terminam com a resposta de erro de processamento, ver `cacheable`)
+
+Os mapas locais valem só para o processo. Com vários workers, o registro
+também vai para o backend de sessões compartilhado (sessions.backend sqlite ou
+redis): a requisição é marcada como em andamento com set-if-absent e prazo
+curto, renovado enquanto o turno roda, e o resultado fica guardado pelo TTL.
+O registro só vence se o worker cair; um retry que cai em outro worker aguarda
+(até o orçamento de um turno) ou reaproveita esse resultado em vez de processar
+(e publicar) de novo. Os mapas locais continuam como caminho rápido.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from loguru import logger
+from stella.agent.metrics import metrics
+from stella.config.settings import get_settings
+
+
+class IdempotentTurns:
+    """Single-flight + replay com TTL de resultados por chave"""
+
+    def __init__(self, ttl_seconds: float = 300, max_entries: int = 2048,
+                 backend: Any = None, in_flight_ttl_seconds: float = 30, max_wait_seconds: float = 60):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.backend = backend if backend is not None and backend.shared else None
+        self.in_flight_ttl_seconds = in_flight_ttl_seconds  # prazo do registro em andamento, renovado durante o turno
+        self.max_wait_seconds = max_wait_seconds  # espera por um turno em andamento em outro worker
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self._done: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()  # chave -> (expira_em, resultado)
+
+    def _replay(self, key: Hashable) -> Tuple[bool, Any]:
+        entry = self._done.get(key)
+        if entry is None:
+            return False, None
+        expires_at, result = entry
+        if time.monotonic() >= expires_at:
+            del self._done[key]
+            return False, None
+        return True, result
+
+    def _remember(self, key: Hashable, result: Any):
+        self._done[key] = (time.monotonic() + self.ttl_seconds, result)
+        self._done.move_to_end(key)
+        while len(self._done) > self.max_entries:
+            self._done.popitem(last=False)
+
+    async def run(
+        self,
+        key: Optional[Hashable],
+        factory: Callable[[], Awaitable[Any]],
+        cacheable: Optional[Callable[[Any], bool]] = None
+    ) -> Any:
+        """
+        Executa o turno uma única vez por chave
+
+        Args:
+            key: (session_id, correlation_id); None desativa a deduplicação
+            factory: Cria o processamento do turno
+            cacheable: Diz se o resultado pode ser reenviado; resultados recusados
+                (ex: resposta de erro de processamento) valem só para quem já
+                aguardava o turno, e a próxima tentativa processa de novo
+
+        Returns:
+            Resultado do turno (original, compartilhado ou repetido)
+        """
+        if key is None:
+            return await factory()
+
+        found, result = self._replay(key)
+        if found:
+            metrics.inc("idempotency.replayed")
+            logger.info(f"🔁 Requisição repetida, reenviando resultado | {key}")
+            return result
+
+        future = self._in_flight.get(key)
+        if future is not None:
+            metrics.inc("idempotency.joined")
+            logger.info(f"🔁 Requisição repetida, aguardando processamento em andamento | {key}")
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await self._run_shared(key, factory, cacheable)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Evita aviso de exceção não lida quando não há repetição aguardando
+            future.exception()
+            raise
+        else:
+            if cacheable is None or cacheable(result):
+                self._remember(key, result)
+            else:
+                metrics.inc("idempotency.not_cached")
+            future.set_result(result)
+            return result
+        finally:
+            self._in_flight.pop(key, None)
+
+    async def _run_shared(
+        self,
+        key: Hashable,
+        factory: Callable[[], Awaitable[Any]],
+        cacheable: Optional[Callable[[Any], bool]] = None
+    ) -> Any:
+        """
+        Executa o turno com o registro no backend compartilhado
+
+        Quem registra primeiro (set-if-absent) processa e renova o registro
+        enquanto o turno roda; os demais workers aguardam o resultado por até
+        max_wait_seconds. Sem renovação (worker que caiu) o registro vence após
+        in_flight_ttl_seconds, e então outro worker assume.
+        """
+        if self.backend is None:
+            return await factory()
+
+        shared_key = ":".join(str(part) for part in key) if isinstance(key, tuple) else str(key)
+        deadline = time.monotonic() + self.max_wait_seconds
+        delay = 0.05
+        while True:
+            try:
+                claimed = await asyncio.to_thread(self.backend.claim_request, shared_key, self.in_flight_ttl_seconds)
+                if claimed:
+                    break
+                exists, result = await asyncio.to_thread(self.backend.load_request, shared_key)
+            except Exception as e:
+                logger.warning(f"Falha no registro de idempotência compartilhado: {e}")
+                metrics.inc("idempotency.backend_errors")
+                return await factory()
+            if result is not None:
+                metrics.inc("idempotency.replayed_shared")
+                logger.info(f"🔁 Requisição repetida (outro worker), reenviando resultado | {key}")
+                return result
+            if not exists:
+                continue  # O processamento do outro worker falhou: tenta registrar de novo
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Requisição {key} em processamento em outro worker")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+        keeper = asyncio.create_task(self._keep_claim(key, shared_key))
+        try:
+            result = await factory()
+        except BaseException:
+            # Falhas não são guardadas: libera o registro para a próxima tentativa
+            await self._release_shared(shared_key)
+            raise
+        finally:
+            keeper.cancel()
+
+        if cacheable is not None and not cacheable(result):
+            await self._release_shared(shared_key)
+            return result
+        try:
+            stored = await asyncio.to_thread(self.backend.finish_request, shared_key, result, self.ttl_seconds)
+        except Exception as e:
+            logger.warning(f"Falha ao gravar resultado no registro de idempotência: {e}")
+            metrics.inc("idempotency.backend_errors")
+            return result
+        if not stored:
+            logger.warning(f"⚠️ Registro de idempotência de {key} venceu durante o turno, resultado não guardado")
+            metrics.inc("idempotency.result_dropped")
+        return result
+
+    async def _keep_claim(self, key: Hashable, shared_key: str):
+        """Renova o registro em andamento enquanto o turno roda (o prazo só vence se o worker cair)"""
+        interval = max(self.in_flight_ttl_seconds / 3, 0.05)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                renewed = await asyncio.to_thread(self.backend.renew_request, shared_key, self.in_flight_ttl_seconds)
+            except Exception as e:
+                logger.warning(f"Falha ao renovar registro de idempotência: {e}")
+                metrics.inc("idempotency.backend_errors")
+                continue
+            if not renewed:
+                logger.warning(f"⚠️ Registro de idempotência de {key} perdido durante o turno")
+                metrics.inc("idempotency.claim_lost")
+                return
+
+    async def _release_shared(self, shared_key: str):
+        try:
+            await asyncio.to_thread(self.backend.release_request, shared_key)
+        except Exception as e:
+            logger.warning(f"Falha ao liberar registro de idempotência: {e}")
+            metrics.inc("idempotency.backend_errors")
+
+
+_turns: Optional[IdempotentTurns] = None
+
+
+def turn_budget_seconds() -> float:
+    """Pior caso de um turno: espera pelo lock da sessão, LLM, inventário e identidade especulativa"""
+    settings = get_settings()
+    return (
+        settings.get('sessions.lock_wait_seconds', 20)
+        + settings.get('llm.request_timeout_seconds', 15)
+        + settings.get('inventory.request_timeout_seconds', 10)
+        + settings.get('speculative_auth.resolve_timeout_seconds', 5)
+    )
+
+
+def get_idempotent_turns() -> IdempotentTurns:
+    global _turns
+    if _turns is None:
+        # Mesmo backend do estado das sessões (memory: só o mapa local)
+        from stella.agent.speech_processor import session_state
+        settings = get_settings()
+        _turns = IdempotentTurns(
+            ttl_seconds=settings.get('idempotency.ttl_seconds', 300),
+            max_entries=settings.get('idempotency.max_entries', 2048),
+            backend=session_state.backend,
+            in_flight_ttl_seconds=settings.get('idempotency.in_flight_ttl_seconds', 30),
+            max_wait_seconds=turn_budget_seconds() + settings.get('idempotency.in_flight_ttl_seconds', 30)
+        )
+    return _turns
@@ -0,0 +1,307 @@
+"""
+Classificador local de intenções triviais
+
+Saudações, despedidas e agradecimentos não precisam de uma ida ao Gemini.
+Este módulo treina, a partir do log de turnos interpretados pelo LLM
+(ver turn_log), uma regressão logística multinomial em NumPy sobre
+n-gramas de caracteres (hashing trick). Com confiança acima do limite, a
+Stella responde localmente com um template; caso contrário, segue para o LLM.
+
+Treino e avaliação:
+    python -m stella.agent.intent_classifier train [--log ARQUIVO] [--out MODELO]
+    python -m stella.agent.intent_classifier predict "bom dia stella"
+"""
+import argparse
+import zlib
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from loguru import logger
+from stella.agent.metrics import metrics
+from stella.agent.text_utils import fold_accents
+from stella.agent.turn_log import DEFAULT_TURN_LOG_PATH, read_turns
+from stella.config.settings import get_settings
+
+DEFAULT_MODEL_PATH = Path(__file__).parent.parent / "data" / "intent_model.npz"
+
+# Respostas locais por rótulo (no mesmo contrato de StellaSpeechResponse)
+TEMPLATES: Dict[str, Dict[str, Any]] = {
+    "greeting": {
+        "intention": "normal",
+        "items": [],
+        "response": "Olá! Sou a Stella, assistente de almoxarifado dos laboratórios DASA. Como posso ajudar?",
+        "stella_analysis": "greeting",
+    },
+    "farewell": {
+        "intention": "normal",
+        "items": [],
+        "response": "Até logo! Sempre que precisar, é só me chamar.",
+        "stella_analysis": "farewell",
+    },
+}
+
+
+def label_from_turn(turn: Dict[str, Any]) -> Optional[str]:
+    """Rótulo de treino derivado da interpretação do LLM"""
+    analysis = turn.get("stella_analysis")
+    if analysis in ("greeting", "farewell"):
+        return analysis
+    if turn.get("intention") == "withdraw_confirm":
+        return "confirm"
+    return turn.get("intention")
+
+
+class IntentClassifier:
+    """Regressão logística multinomial sobre n-gramas de caracteres com hashing"""
+
+    def __init__(self, labels: Sequence[str], dims: int = 4096, ngram_range: Tuple[int, int] = (2, 4)):
+        self.labels = list(labels)
+        self.dims = dims
+        self.ngram_range = ngram_range
+        self.weights = np.zeros((dims, len(self.labels)), dtype=np.float32)
+        self.bias = np.zeros(len(self.labels), dtype=np.float32)
+
+    def _sparse_features(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Índices e pesos (normalizados L2) dos n-gramas de caracteres de um texto"""
+        padded = f" {' '.join(fold_accents(text).split())} "
+        lo, hi = self.ngram_range
+        counts: Counter = Counter(
+            zlib.crc32(padded[i:i + n].encode("utf-8")) % self.dims
+            for n in range(lo, hi + 1)
+            for i in range(len(padded) - n + 1)
+        )
+        indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        norm = np.linalg.norm(values)
+        return indices, (values / norm if norm > 0 else values)
+
+    def _densify(self, sparse: Sequence[Tuple[np.ndarray, np.ndarray]]) -> np.ndarray:
+        X = np.zeros((len(sparse), self.dims), dtype=np.float32)
+        for row, (indices, values) in enumerate(sparse):
+            X[row, indices] = values
+        return X
+
+    def featurize(self, texts: Sequence[str]) -> np.ndarray:
+        """Vetores normalizados (L2) de n-gramas de caracteres"""
+        return self._densify([self._sparse_features(text) for text in texts])
+
+    def predict_proba(self, texts: Sequence[str]) -> np.ndarray:
+        logits = self.featurize(texts) @ self.weights + self.bias
+        logits -= logits.max(axis=1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """Rótulo mais provável e sua probabilidade"""
+        proba = self.predict_proba([text])[0]
+        idx = int(np.argmax(proba))
+        return self.labels[idx], float(proba[idx])
+
+    def fit(self, texts: Sequence[str], labels: Sequence[str], epochs: int = 100, lr: float = 2.0,
+            l2: float = 1e-4, batch_size: int = 256, seed: int = 0):
+        """Treina por gradiente descendente em mini-lotes (entropia cruzada + L2)"""
+        rng = np.random.default_rng(seed)
+        # Features esparsas pré-computadas; só os mini-lotes viram matrizes densas
+        sparse = [self._sparse_features(text) for text in texts]
+        label_idx = {label: i for i, label in enumerate(self.labels)}
+        y = np.array([label_idx[label] for label in labels])
+        Y = np.eye(len(self.labels), dtype=np.float32)[y]
+
+        for _ in range(epochs):
+            order = rng.permutation(len(sparse))
+            for start in range(0, len(sparse), batch_size):
+                batch = order[start:start + batch_size]
+                X_batch = self._densify([sparse[i] for i in batch])
+                logits = X_batch @ self.weights + self.bias
+                logits -= logits.max(axis=1, keepdims=True)
+                proba = np.exp(logits)
+                proba /= proba.sum(axis=1, keepdims=True)
+                grad = (proba - Y[batch]) / len(batch)
+                self.weights -= lr * (X_batch.T @ grad + l2 * self.weights)
+                self.bias -= lr * grad.sum(axis=0)
+        return self
+
+    def save(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(
+            path,
+            weights=self.weights,
+            bias=self.bias,
+            labels=np.array(self.labels),
+            dims=self.dims,
+            ngram_range=np.array(self.ngram_range),
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "IntentClassifier":
+        data = np.load(path, allow_pickle=False)
+        model = cls(
+            labels=[str(label) for label in data["labels"]],
+            dims=int(data["dims"]),
+            ngram_range=tuple(int(n) for n in data["ngram_range"]),
+        )
+        model.weights = data["weights"]
+        model.bias = data["bias"]
+        return model
+
+
+class LocalIntentResponder:
+    """Responde localmente turnos triviais com alta confiança"""
+
+    def __init__(self, classifier: IntentClassifier, threshold: float = 0.9,
+                 local_labels: Sequence[str] = ("greeting", "farewell"), max_chars: int = 60):
+        self.classifier = classifier
+        self.threshold = threshold
+        self.local_labels = [label for label in local_labels if label in TEMPLATES]
+        self.max_chars = max_chars
+
+    def respond(self, utterance: str) -> Optional[Dict[str, Any]]:
+        """
+        Resposta templated para a fala, ou None para seguir ao LLM
+
+        Args:
+            utterance: Fala do usuário
+
+        Returns:
+            Dict no contrato de StellaSpeechResponse ou None
+        """
+        if len(utterance) > self.max_chars:
+            self._record(False)
+            return None
+
+        label, confidence = self.classifier.predict(utterance)
+        if label in self.local_labels and confidence >= self.threshold:
+            logger.info(f"⚡ Intenção local: {label} ({confidence:.2f})")
+            self._record(True)
+            resposta = dict(TEMPLATES[label])
+            resposta["reason"] = f"Classificador local ({confidence:.2f})"
+            return resposta
+
+        self._record(False)
+        return None
+
+    @staticmethod
+    def _record(local: bool):
+        metrics.inc("intent.local_answered" if local else "intent.deferred_to_llm")
+        local_count = metrics.counter("intent.local_answered")
+        total = local_count + metrics.counter("intent.deferred_to_llm")
+        metrics.set_gauge("intent.local_share", local_count / total if total else 0.0)
+
+
+_responder: Optional[LocalIntentResponder] = None
+_responder_loaded = False
+
+
+def get_local_responder() -> Optional[LocalIntentResponder]:
+    """Responder configurado, ou None se desativado ou sem modelo treinado"""
+    global _responder, _responder_loaded
+    if _responder_loaded:
+        return _responder
+    _responder_loaded = True
+
+    settings = get_settings()
+    if not settings.get('intent_classifier.enabled', False):
+        return None
+    path = Path(settings.get('intent_classifier.model_path') or DEFAULT_MODEL_PATH)
+    if not path.exists():
+        logger.warning(f"Modelo de intenções não encontrado em {path}; todas as falas irão ao LLM")
+        return None
+    try:
+        classifier = IntentClassifier.load(path)
+    except Exception as e:
+        logger.error(f"Erro ao carregar modelo de intenções: {e}")
+        return None
+
+    _responder = LocalIntentResponder(
+        classifier,
+        threshold=settings.get('intent_classifier.confidence_threshold', 0.9),
+        local_labels=settings.get('intent_classifier.local_labels', ["greeting", "farewell"]),
+        max_chars=settings.get('intent_classifier.max_chars', 60),
+    )
+    logger.success(f"Classificador local de intenções carregado ({', '.join(classifier.labels)})")
+    return _responder
+
+
+def _load_dataset(log_path: Path) -> Tuple[List[str], List[str]]:
+    texts, labels = [], []
+    for turn in read_turns(log_path):
+        label = label_from_turn(turn)
+        if turn.get("text") and label:
+            texts.append(turn["text"])
+            labels.append(label)
+    return texts, labels
+
+
+def _train_command(args):
+    texts, labels = _load_dataset(Path(args.log))
+    if not texts:
+        print(f"Nenhum turno em {args.log}")
+        return
+    counts = Counter(labels)
+    print(f"Turnos: {len(texts)} | rótulos: {dict(counts)}")
+
+    rng = np.random.default_rng(args.seed)
+    order = rng.permutation(len(texts))
+    n_test = int(len(texts) * args.holdout)
+    test, train = order[:n_test], order[n_test:]
+
+    classifier = IntentClassifier(sorted(counts), dims=args.dims)
+    classifier.fit(
+        [texts[i] for i in train],
+        [labels[i] for i in train],
+        epochs=args.epochs,
+        lr=args.lr,
+        seed=args.seed
+    )
+
+    if n_test:
+        responder = LocalIntentResponder(classifier, threshold=args.threshold)
+        correct = answered = answered_correct = 0
+        for i in test:
+            label, confidence = classifier.predict(texts[i])
+            correct += label == labels[i]
+            if label in responder.local_labels and confidence >= args.threshold:
+                answered += 1
+                answered_correct += label == labels[i]
+        print(f"Acurácia (holdout): {correct / n_test:.3f}")
+        print(f"Respondidos localmente: {answered / n_test:.1%} | precisão: "
+              f"{(answered_correct / answered if answered else 0):.3f}")
+
+    classifier.save(Path(args.out))
+    print(f"Modelo salvo em {args.out}")
+
+
+def _predict_command(args):
+    classifier = IntentClassifier.load(Path(args.model))
+    for text in args.texts:
+        label, confidence = classifier.predict(text)
+        print(f"{text!r}: {label} ({confidence:.3f})")
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(description="Classificador local de intenções da Stella")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    train = sub.add_parser("train", help="Treina a partir do log de turnos do LLM")
+    train.add_argument("--log", default=str(DEFAULT_TURN_LOG_PATH))
+    train.add_argument("--out", default=str(DEFAULT_MODEL_PATH))
+    train.add_argument("--dims", type=int, default=4096)
+    train.add_argument("--epochs", type=int, default=100)
+    train.add_argument("--lr", type=float, default=2.0)
+    train.add_argument("--holdout", type=float, default=0.2)
+    train.add_argument("--threshold", type=float, default=0.9)
+    train.add_argument("--seed", type=int, default=0)
+    train.set_defaults(func=_train_command)
+
+    predict = sub.add_parser("predict", help="Classifica frases")
+    predict.add_argument("texts", nargs="+")
+    predict.add_argument("--model", default=str(DEFAULT_MODEL_PATH))
+    predict.set_defaults(func=_predict_command)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Leitura progressiva do JSON da Stella enquanto o Gemini gera a resposta
+
+O Gemini devolve o JSON em pedaços. Para a fala começar antes do fim da
+geração, o ResponseFieldStreamer acompanha a estrutura do JSON caractere a
+caractere e devolve o texto do campo "response" assim que ele chega (com
+escapes decodificados). Campos simples de nível superior já completos, como
+"intention", ficam disponíveis em `fields`.
+"""
+from typing import Dict, List, Optional
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class ResponseFieldStreamer:
+    """Extrai incrementalmente strings de nível superior de um objeto JSON"""
+
+    def __init__(self, stream_field: str = "response"):
+        self.stream_field = stream_field
+        self.fields: Dict[str, str] = {}
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._unicode: Optional[str] = None
+        self._buffer: List[str] = []
+        self._key: Optional[str] = None
+        self._expect_value = False
+        self._is_key = False
+
+    def feed(self, chunk: str) -> str:
+        """
+        Processa um pedaço da resposta
+
+        Args:
+            chunk: Texto recebido do stream
+
+        Returns:
+            Novo texto do campo acompanhado (vazio se não houver)
+        """
+        out: List[str] = []
+        for ch in chunk:
+            if not self._started:
+                # Ignora cercas de markdown (```json) antes do objeto
+                if ch == "{":
+                    self._started = True
+                    self._depth = 1
+                continue
+            if self._in_string:
+                self._string_char(ch, out)
+            elif ch == '"':
+                self._in_string = True
+                self._buffer = []
+                self._is_key = self._depth == 1 and not self._expect_value
+            elif ch in "{[":
+                self._depth += 1
+                self._expect_value = False
+            elif ch in "}]":
+                self._depth -= 1
+            elif ch == ":" and self._depth == 1:
+                self._expect_value = True
+            elif ch == "," and self._depth == 1:
+                self._expect_value = False
+                self._key = None
+        return "".join(out)
+
+    def _streaming(self) -> bool:
+        return self._depth == 1 and not self._is_key and self._key == self.stream_field
+
+    def _emit(self, text: str, out: List[str]):
+        self._buffer.append(text)
+        if self._streaming():
+            out.append(text)
+
+    def _string_char(self, ch: str, out: List[str]):
+        if self._unicode is not None:
+            self._unicode += ch
+            if len(self._unicode) == 4:
+                try:
+                    self._emit(chr(int(self._unicode, 16)), out)
+                except ValueError:
+                    pass
+                self._unicode = None
+            return
+        if self._escape:
+            self._escape = False
+            if ch == "u":
+                self._unicode = ""
+            else:
+                self._emit(_ESCAPES.get(ch, ch), out)
+            return
+        if ch == "\\":
+            self._escape = True
+        elif ch == '"':
+            self._in_string = False
+            text = "".join(self._buffer)
+            if self._depth == 1:
+                if self._is_key:
+                    self._key = text
+                elif self._key is not None:
+                    self.fields[self._key] = text
+                    self._expect_value = False
+        else:
+            self._emit(ch, out)
@@ -0,0 +1,300 @@
+"""
+Cliente assíncrono do LLM com limite global de concorrência e fila por prioridade
+
+Antes cada fala ocupava uma thread do executor padrão (asyncio.to_thread)
+durante toda a geração, sem nenhum limite de chamadas simultâneas à API. Aqui:
+- as chamadas usam a API assíncrona nativa do Gemini (generate_content_async)
+- no máximo `max_concurrency` chamadas ficam em andamento
+- as demais esperam numa fila por prioridade: continuações de retirada
+  (confirmações) passam na frente de consultas de estoque
+- cada requisição tem um prazo total (fila + geração); quem estoura o prazo na
+  fila sai dela sem consumir cota
+- fila cheia rejeita na hora (LLMOverloadedError), em vez de acumular esperas
+- chamadas lentas são "hedged": se a primeira tentativa não respondeu até o
+  atraso de hedge (percentil recente da latência de geração), uma segunda é
+  disparada; a primeira resposta válida vence e a outra é cancelada
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+from loguru import logger
+from stella.agent.metrics import metrics
+
+PRIORITY_CONFIRM = 0   # sessão com retirada pendente (confirmação/ajuste)
+PRIORITY_DEFAULT = 1
+PRIORITY_QUERY = 2     # consultas de estoque
+
+
+T = TypeVar("T")
+
+
+class LLMOverloadedError(RuntimeError):
+    """Fila do LLM cheia"""
+
+
+class PriorityLimiter:
+    """Semáforo com fila por prioridade (menor valor é atendido primeiro, FIFO no empate)"""
+
+    def __init__(self, max_concurrency: int = 4, max_queue: int = 64):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for _, _, fut in self._waiters if not fut.done())
+
+    def _update_gauges(self):
+        metrics.set_gauge("llm.in_flight", self.in_flight)
+        metrics.set_gauge("llm.queue_depth", self.queue_depth)
+
+    async def acquire(self, priority: int, timeout: Optional[float]):
+        """
+        Aguarda uma vaga
+
+        Raises:
+            LLMOverloadedError: fila cheia
+            asyncio.TimeoutError: prazo esgotado na fila
+        """
+        if self.in_flight < self.max_concurrency and not self.queue_depth:
+            self.in_flight += 1
+            self._update_gauges()
+            metrics.observe("llm.queue_wait_ms", 0.0)
+            return
+
+        if self.queue_depth >= self.max_queue:
+            metrics.inc("llm.rejected")
+            raise LLMOverloadedError(f"Fila do LLM cheia ({self.max_queue} requisições)")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        self._update_gauges()
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            if future.done() and not future.cancelled():
+                # A vaga chegou junto com o timeout/cancelamento: devolve
+                self.release()
+            else:
+                future.cancel()
+                metrics.inc("llm.queue_timeouts")
+            self._update_gauges()
+            raise
+        metrics.observe("llm.queue_wait_ms", (time.perf_counter() - started) * 1000)
+
+    def release(self):
+        """Libera a vaga, repassando-a ao próximo da fila (se houver)"""
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)  # vaga transferida: in_flight não muda
+                self._update_gauges()
+                return
+        self.in_flight -= 1
+        self._update_gauges()
+
+    @asynccontextmanager
+    async def slot(self, priority: int, timeout: Optional[float]):
+        await self.acquire(priority, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class AsyncLLMClient:
+    """Chamadas ao modelo com prazo por requisição, limitadas pelo PriorityLimiter"""
+
+    def __init__(self, model: Any, max_concurrency: int = 4, max_queue: int = 64):
+        self.model = model
+        self.limiter = PriorityLimiter(max_concurrency, max_queue)
+        # Envolve o modelo de cada chamada (ex: gravação/reprodução de cassetes)
+        self.model_wrapper: Optional[Callable[[Any], Any]] = None
+
+    def _target(self, model: Any) -> Any:
+        target = model or self.model
+        return self.model_wrapper(target) if self.model_wrapper is not None else target
+
+    async def generate(self, contents: Any, priority: int = PRIORITY_DEFAULT, timeout: Optional[float] = None,
+                       model: Any = None) -> str:
+        """
+        Gera a resposta completa
+
+        Args:
+            contents: Histórico + prompt do turno
+            priority: PRIORITY_CONFIRM, PRIORITY_DEFAULT ou PRIORITY_QUERY
+            timeout: Prazo total em segundos (fila + geração)
+            model: Modelo alternativo (ex: que referencia um cache de contexto)
+
+        Returns:
+            Texto gerado
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        async with self.limiter.slot(priority, timeout):
+            started = time.perf_counter()
+            response = await asyncio.wait_for(
+                self._target(model).generate_content_async(contents),
+                self._remaining(deadline)
+            )
+            metrics.observe("llm.generation_ms", (time.perf_counter() - started) * 1000)
+            self._record_usage(response)
+            return response.text
+
+    async def stream(self, contents: Any, priority: int = PRIORITY_DEFAULT,
+                     timeout: Optional[float] = None, model: Any = None) -> AsyncIterator[str]:
+        """
+        Gera a resposta em pedaços (a vaga fica ocupada até o fim do stream)
+
+        O prazo vale para cada espera por um novo pedaço, limitado ao prazo total.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        async with self.limiter.slot(priority, timeout):
+            started = time.perf_counter()
+            response = await asyncio.wait_for(
+                self._target(model).generate_content_async(contents, stream=True),
+                self._remaining(deadline)
+            )
+            chunks = response.__aiter__()
+            last_chunk = None
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), self._remaining(deadline))
+                except StopAsyncIteration:
+                    break
+                last_chunk = chunk
+                try:
+                    text = chunk.text
+                except ValueError:
+                    continue  # pedaço sem texto (ex: apenas metadados)
+                yield text
+            metrics.observe("llm.generation_ms", (time.perf_counter() - started) * 1000)
+            # No stream, o uso de tokens vem no último pedaço
+            self._record_usage(last_chunk)
+
+    @staticmethod
+    def _record_usage(response: Any):
+        """Tokens de prompt cobrados vs. servidos pelo cache de contexto"""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return
+        prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+        cached_tokens = getattr(usage, "cached_content_token_count", 0) or 0
+        metrics.inc("llm.prompt_tokens", prompt_tokens)
+        metrics.inc("llm.cached_tokens", cached_tokens)
+        metrics.inc("llm.billed_prompt_tokens", prompt_tokens - cached_tokens)
+        metrics.set_gauge(
+            "llm.cached_token_share",
+            metrics.counter("llm.cached_tokens") / max(1, metrics.counter("llm.prompt_tokens"))
+        )
+
+    async def hedged(
+        self,
+        make_attempt: Callable[[int], Awaitable[T]],
+        is_valid: Callable[[T], bool],
+        hedge_delay: Optional[float],
+        timeout: Optional[float] = None,
+        max_attempts: int = 2,
+        should_hedge: Callable[[], bool] = lambda: True
+    ) -> T:
+        """
+        Executa tentativas concorrentes com atraso de hedge; a primeira válida vence
+
+        Args:
+            make_attempt: Cria a tentativa n (0 = principal)
+            is_valid: Resultado aceitável?
+            hedge_delay: Segundos até disparar a próxima tentativa (None = sem hedge)
+            timeout: Orçamento total em segundos
+            max_attempts: Máximo de tentativas simultâneas/sequenciais
+            should_hedge: Consultado antes de cada hedge (ex: stream já em andamento)
+
+        Returns:
+            Primeiro resultado válido; se nenhum for válido, o da tentativa que terminou primeiro
+
+        Raises:
+            asyncio.TimeoutError: orçamento esgotado (tentativas pendentes são canceladas)
+            Exception: erro da última tentativa, se todas falharem
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        tasks: Dict[asyncio.Task, int] = {}  # tarefa -> número da tentativa
+        launched = 0
+        fallback: List[T] = []
+        last_error: Optional[BaseException] = None
+
+        def _launch():
+            nonlocal launched
+            tasks[asyncio.ensure_future(make_attempt(launched))] = launched
+            launched += 1
+
+        _launch()
+        next_hedge = None if hedge_delay is None else time.monotonic() + hedge_delay
+        try:
+            while tasks:
+                now = time.monotonic()
+                waits = [t - now for t in (deadline, next_hedge) if t is not None]
+                done, _ = await asyncio.wait(
+                    tasks,
+                    timeout=max(0.0, min(waits)) if waits else None,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    attempt = tasks.pop(task)
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        logger.warning(f"Tentativa {attempt} ao LLM falhou: {last_error!r}")
+                        continue
+                    result = task.result()
+                    if is_valid(result):
+                        if attempt > 0:
+                            metrics.inc("llm.hedge_wins")
+                        return result
+                    fallback.append(result)
+
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    metrics.inc("llm.budget_exhausted")
+                    raise asyncio.TimeoutError()
+                can_launch = launched < max_attempts
+                # Falha/resposta inválida antecipa a próxima tentativa; lentidão dispara o hedge
+                if can_launch and (not tasks or (next_hedge is not None and now >= next_hedge)):
+                    if tasks and not should_hedge():
+                        next_hedge = None
+                        continue
+                    if tasks:
+                        metrics.inc("llm.hedges_fired")
+                        logger.info(f"🔀 LLM lento, disparando tentativa paralela ({hedge_delay:.2f}s)")
+                    _launch()
+                    next_hedge = None if hedge_delay is None else now + hedge_delay
+                elif not can_launch:
+                    next_hedge = None
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        if fallback:
+            return fallback[0]
+        raise last_error if last_error is not None else RuntimeError("Nenhuma tentativa ao LLM concluída")
+
+    @staticmethod
+    def hedge_delay(percentile: float = 95, min_samples: int = 20, default_seconds: float = 3.0,
+                    min_seconds: float = 0.5) -> float:
+        """Atraso de hedge: percentil recente da latência de geração (ou valor padrão sem amostras)"""
+        if metrics.count("llm.generation_ms") < min_samples:
+            return default_seconds
+        value = metrics.percentile("llm.generation_ms", percentile)
+        return max(min_seconds, value / 1000) if value is not None else default_seconds
+
+    @staticmethod
+    def _remaining(deadline: Optional[float]) -> Optional[float]:
+        if deadline is None:
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.warning("⏱️ Prazo da requisição ao LLM esgotado")
+            raise asyncio.TimeoutError()
+        return remaining
@@ -0,0 +1,219 @@
+"""
+Provedores do LLM: Gemini ou substituto local determinístico
+
+O speech_processor dependia do google.generativeai no import e encerrava o
+processo sem GEMINI_API_KEY, então nada rodava (nem teste de carga, nem
+profiling) sem o serviço real. Aqui o modelo vem de um provedor escolhido em
+llm.provider:
+
+- gemini: GenerativeModel da API do Gemini (importado só quando usado)
+- local: modelo em processo, sem rede, com a mesma interface usada pelo
+  AsyncLLMClient (generate_content_async, com ou sem stream). Responde por
+  roteiro (llm.local_script_path) ou por regras (carrinho pendente,
+  interpretador offline, consultas de estoque) e injeta latência e falhas
+  configuráveis, com semente fixa para execuções reproduzíveis
+
+Sem chave do Gemini o servidor sobe mesmo assim: as chamadas falham e os
+turnos seguem pelo interpretador offline.
+"""
+import asyncio
+import json
+import os
+import random
+import re
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, List, Optional
+from loguru import logger
+from stella.agent.cart import is_confirmation
+from stella.agent.context_cache import GeminiContextCacheBackend, LocalContextCacheBackend
+from stella.agent.intent_classifier import TEMPLATES
+from stella.agent.offline_parser import get_offline_parser
+from stella.agent.product_index import get_product_index
+from stella.agent.stock_cache import get_stock_snapshot
+from stella.agent.stock_query import answer_stock_query
+from stella.agent.text_utils import estimate_tokens, tokenize
+from stella.config.settings import get_settings
+
+
+class LLMProviderError(RuntimeError):
+    """Provedor do LLM indisponível ou mal configurado"""
+
+
+class UnavailableModel:
+    """Modelo de um provedor que não pôde ser configurado: toda chamada falha"""
+
+    def __init__(self, reason: str):
+        self.reason = reason
+
+    async def generate_content_async(self, contents: Any, **kwargs):
+        raise LLMProviderError(self.reason)
+
+    def generate_content(self, contents: Any, **kwargs):
+        raise LLMProviderError(self.reason)
+
+
+class GeminiProvider:
+    """API do Gemini (google.generativeai)"""
+
+    name = "gemini"
+
+    def build_model(self, model_id: str, system_instruction: str,
+                    generation_config: Optional[Dict[str, Any]] = None) -> Any:
+        api_key = os.environ.get("GEMINI_API_KEY")
+        if not api_key:
+            raise LLMProviderError("GEMINI_API_KEY ausente. Defina no .env ou no ambiente e reinicie.")
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        logger.success("Variável de ambiente GEMINI_API_KEY carregada.")
+        return genai.GenerativeModel(model_id, system_instruction=system_instruction, generation_config=generation_config)
+
+    def context_cache_backend(self, base_model: Any) -> Any:
+        return GeminiContextCacheBackend()
+
+
+# Saudações/despedidas reconhecidas pelo modelo local
+_GREETINGS = {"oi", "ola", "bom", "boa", "dia", "tarde", "noite", "stella", "tudo", "bem", "e", "ai"}
+_FAREWELLS = {"tchau", "ate", "logo", "mais", "obrigado", "obrigada", "valeu", "stella", "e"}
+_COMMAND_RE = re.compile(r'Analise este comando: "(.*?)"\s*\n', re.DOTALL)
+_CART_RE = re.compile(r"CARRINHO PENDENTE \(aguardando confirmação\): (\[.*?\])\n")
+
+
+class LocalModel:
+    """
+    Substituto determinístico do Gemini
+
+    Args:
+        script: Respostas roteirizadas [{"match": regex, "response": {...}}], testadas em ordem
+        latency_ms: Latência simulada por chamada
+        latency_jitter_ms: Variação máxima (+/-) da latência
+        failure_rate: Fração de chamadas que falham (0-1)
+        seed: Semente do sorteio de latência/falhas
+        chunk_chars: Tamanho dos pedaços no modo stream
+    """
+
+    def __init__(self, script: Optional[List[Dict[str, Any]]] = None, latency_ms: float = 0,
+                 latency_jitter_ms: float = 0, failure_rate: float = 0.0, seed: int = 0, chunk_chars: int = 16):
+        self.script = [(re.compile(s["match"], re.IGNORECASE), s["response"]) for s in script or []]
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.failure_rate = failure_rate
+        self.chunk_chars = chunk_chars
+        self._rng = random.Random(seed)
+
+    async def generate_content_async(self, contents: List[Dict[str, Any]], stream: bool = False, **kwargs):
+        latency = max(0.0, self.latency_ms + self._rng.uniform(-1, 1) * self.latency_jitter_ms) / 1000
+        fail = self._rng.random() < self.failure_rate
+        prompt = "\n".join(str(p) for c in contents for p in c.get("parts", []))
+        usage = SimpleNamespace(prompt_token_count=estimate_tokens(prompt), cached_content_token_count=0)
+
+        if not stream:
+            await asyncio.sleep(latency)
+            if fail:
+                raise ConnectionError("Falha simulada do LLM local")
+            return SimpleNamespace(text=await self._respond(contents), usage_metadata=usage)
+
+        # Stream: ~30% da latência até o primeiro pedaço, o resto distribuído entre eles
+        await asyncio.sleep(latency * 0.3)
+        if fail:
+            raise ConnectionError("Falha simulada do LLM local")
+        text = await self._respond(contents)
+        return self._chunks(text, latency * 0.7, usage)
+
+    async def _chunks(self, text: str, duration: float, usage: Any) -> AsyncIterator[Any]:
+        pieces = [text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)] or [""]
+        for n, piece in enumerate(pieces):
+            await asyncio.sleep(duration / len(pieces))
+            yield SimpleNamespace(text=piece, usage_metadata=usage if n == len(pieces) - 1 else None)
+
+    def generate_content(self, contents: List[Dict[str, Any]], **kwargs):
+        raise LLMProviderError("O modelo local só atende chamadas assíncronas")
+
+    async def _respond(self, contents: List[Dict[str, Any]]) -> str:
+        prompt = str(contents[-1]["parts"][-1]) if contents else ""
+        commands = _COMMAND_RE.findall(prompt)
+        comando = commands[-1] if commands else prompt
+        return json.dumps(await self._interpret(comando, prompt), ensure_ascii=False)
+
+    async def _interpret(self, comando: str, prompt: str) -> Dict[str, Any]:
+        for pattern, response in self.script:
+            if pattern.search(comando):
+                return response
+
+        cart = _CART_RE.search(prompt)
+        if cart and is_confirmation(comando):
+            return {
+                "intention": "withdraw_confirm",
+                "items": json.loads(cart.group(1)),
+                "response": "Retirada confirmada. Obrigada!",
+                "stella_analysis": "normal",
+            }
+
+        snapshot = await get_stock_snapshot()
+        resultado = get_offline_parser().interpret(comando, get_product_index(snapshot), snapshot.items)
+        if resultado is not None:
+            return resultado
+        resultado = answer_stock_query(snapshot, comando)
+        if resultado is not None:
+            return resultado
+
+        tokens = set(tokenize(comando))
+        if tokens and tokens <= _GREETINGS:
+            return TEMPLATES["greeting"]
+        if tokens and tokens <= _FAREWELLS:
+            return TEMPLATES["farewell"]
+        return {
+            "intention": "not_understood",
+            "items": [],
+            "response": "Não entendi. Pode repetir o pedido?",
+            "stella_analysis": "not_understood",
+        }
+
+
+class LocalProvider:
+    """Modelo local determinístico, com latência e falhas configuráveis"""
+
+    name = "local"
+
+    def build_model(self, model_id: str, system_instruction: str,
+                    generation_config: Optional[Dict[str, Any]] = None) -> Any:
+        settings = get_settings()
+        script = None
+        script_path = settings.get('llm.local_script_path')
+        if script_path:
+            with open(Path(script_path), encoding="utf-8") as f:
+                script = json.load(f)
+        logger.info("🧪 LLM local (substituto determinístico) em uso")
+        return LocalModel(
+            script=script,
+            latency_ms=settings.get('llm.local_latency_ms', 0),
+            latency_jitter_ms=settings.get('llm.local_latency_jitter_ms', 0),
+            failure_rate=settings.get('llm.local_failure_rate', 0.0),
+            seed=settings.get('llm.local_seed', 0)
+        )
+
+    def context_cache_backend(self, base_model: Any) -> Any:
+        return LocalContextCacheBackend(base_model)
+
+
+_PROVIDERS = {"gemini": GeminiProvider, "local": LocalProvider}
+
+
+def create_llm_provider(name: Optional[str] = None) -> Any:
+    """Provedor conforme llm.provider ('gemini' ou 'local')"""
+    name = name or get_settings().get('llm.provider', 'gemini')
+    provider = _PROVIDERS.get(name)
+    if provider is None:
+        logger.warning(f"Provedor de LLM desconhecido '{name}', usando gemini")
+        provider = GeminiProvider
+    return provider()
+
+
+def build_model(provider: Any, model_id: str, system_instruction: str,
+                generation_config: Optional[Dict[str, Any]] = None) -> Any:
+    """Modelo do provedor; se não puder ser criado, um modelo que sempre falha (turnos seguem offline)"""
+    try:
+        return provider.build_model(model_id, system_instruction, generation_config)
+    except Exception as e:
+        logger.error(f"LLM '{provider.name}' indisponível: {e}")
+        return UnavailableModel(str(e))
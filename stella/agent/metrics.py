@@ -0,0 +1,100 @@
+"""
+Métricas em memória do agente (contadores, gauges e distribuições)
+
+Leve e sem dependências: serve para acompanhar latência, uso de tokens e
+eficiência dos caminhos locais. Exposto em GET /metrics.
+"""
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+
+class _Distribution:
+    """Contagem, soma, mínimo/máximo e janela das últimas amostras para percentis"""
+
+    def __init__(self, window: int = 512):
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        self.samples: Deque[float] = deque(maxlen=window)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.samples.append(value)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        idx = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+        return ordered[idx]
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "avg": self.total / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+class Metrics:
+    """Registro de métricas thread-safe"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._gauges: Dict[str, float] = {}
+        self._distributions: Dict[str, _Distribution] = {}
+
+    def inc(self, name: str, value: float = 1):
+        """Incrementa um contador"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float):
+        """Define o valor atual de um gauge"""
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        """Registra uma amostra em uma distribuição (latência, tokens, ...)"""
+        with self._lock:
+            dist = self._distributions.get(name)
+            if dist is None:
+                dist = self._distributions[name] = _Distribution()
+            dist.observe(value)
+
+    def counter(self, name: str) -> float:
+        return self._counters.get(name, 0)
+
+    def count(self, name: str) -> int:
+        """Quantidade de amostras registradas em uma distribuição"""
+        with self._lock:
+            dist = self._distributions.get(name)
+            return dist.count if dist else 0
+
+    def percentile(self, name: str, pct: float) -> Optional[float]:
+        """Percentil das amostras recentes de uma distribuição"""
+        with self._lock:
+            dist = self._distributions.get(name)
+            return dist.percentile(pct) if dist else None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Retorna todas as métricas em formato serializável"""
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "distributions": {name: dist.summary() for name, dist in self._distributions.items()},
+            }
+
+
+metrics = Metrics()
@@ -0,0 +1,298 @@
+"""
+Interpretador offline de pedidos de retirada (gramática simples em português)
+
+Quando o Gemini está fora do ar ou estoura o tempo, a Stella continua
+atendendo pedidos de retirada: "quero cinco seringas de dez ml e duas luvas"
+vira items [{'productName': 'seringa_10ml', 'quantity': 5}, {'productName':
+'luva', 'quantity': 2}] no mesmo contrato de StellaSpeechResponse.
+
+Gramática reconhecida:
+    pedido  := [verbo ...] item ((',' | 'e' | 'mais') item)*
+    item    := quantidade [embalagem ['de']] produto
+    quantidade := dígitos | número por extenso ("vinte e cinco", "meia dúzia")
+    produto := palavras até o próximo item, com medidas ("dez ml" -> "10ml")
+
+Perguntas ("quantas seringas tem?") e negações não são tratadas: ficam para o LLM.
+"""
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from stella.agent.metrics import metrics
+from stella.agent.product_index import ProductCandidate, ProductIndex
+from stella.agent.text_utils import fold_accents
+from stella.config.settings import get_settings
+
+NUMBER_WORDS: Dict[str, int] = {
+    "zero": 0, "um": 1, "uma": 1, "dois": 2, "duas": 2, "tres": 3, "quatro": 4,
+    "cinco": 5, "seis": 6, "sete": 7, "oito": 8, "nove": 9, "dez": 10, "onze": 11,
+    "doze": 12, "treze": 13, "quatorze": 14, "catorze": 14, "quinze": 15,
+    "dezesseis": 16, "dezasseis": 16, "dezessete": 17, "dezoito": 18, "dezenove": 19,
+    "vinte": 20, "trinta": 30, "quarenta": 40, "cinquenta": 50, "sessenta": 60,
+    "setenta": 70, "oitenta": 80, "noventa": 90, "cem": 100, "cento": 100,
+    "duzentos": 200, "duzentas": 200, "trezentos": 300, "trezentas": 300,
+    "quatrocentos": 400, "quatrocentas": 400, "quinhentos": 500, "quinhentas": 500,
+    "seiscentos": 600, "seiscentas": 600, "setecentos": 700, "setecentas": 700,
+    "oitocentos": 800, "oitocentas": 800, "novecentos": 900, "novecentas": 900,
+}
+
+# Unidades de medida que fazem parte do nome do produto ("seringa 10ml")
+MEASURE_UNITS: Dict[str, str] = {
+    "ml": "ml", "mililitro": "ml", "mililitros": "ml",
+    "l": "l", "litro": "l", "litros": "l",
+    "mg": "mg", "miligrama": "mg", "miligramas": "mg",
+    "g": "g", "grama": "g", "gramas": "g", "kg": "kg",
+    "mcg": "mcg", "ui": "ui",
+    "mm": "mm", "milimetro": "mm", "milimetros": "mm",
+    "cm": "cm", "centimetro": "cm", "centimetros": "cm",
+}
+
+# Unidades de contagem entre a quantidade e o produto ("duas unidades de luva")
+COUNT_UNITS = {"unidade", "unidades", "un", "und", "par", "pares"}
+
+WITHDRAW_VERBS = {
+    "retirar", "retiro", "retire", "tirar", "pegar", "pego", "pegue", "quero", "queria",
+    "preciso", "precisamos", "separa", "separe", "separar", "manda", "mande", "traz",
+    "traga", "solicito", "solicitar", "me", "da", "de", "gostaria", "retirada",
+}
+
+QUESTION_WORDS = {"quanto", "quantos", "quantas", "qual", "quais", "tem", "temos", "existe", "onde", "como"}
+NEGATIONS = {"nao", "nem", "cancela", "cancelar", "cancele"}
+
+CONNECTIVES = {"de", "da", "do", "das", "dos"}
+TRAILING_FILLERS = {
+    "por", "favor", "pra", "para", "mim", "agora", "stella", "ai", "aqui", "ok", "obrigado",
+    "obrigada", "rapidinho", "hoje", "tambem",
+}
+
+_SPLIT_DIGITS_RE = re.compile(r"(\d+)([a-z]+)")
+_TOKEN_RE = re.compile(r"\d+|[a-z]+|[,;]")
+
+
+@dataclass
+class ParsedItem:
+    """Item extraído da fala, já resolvido contra o estoque (quando possível)"""
+    spoken: str
+    quantity: int
+    candidate: Optional[ProductCandidate] = None
+
+    @property
+    def product_name(self) -> str:
+        return self.candidate.key if self.candidate else self.spoken.replace(" ", "_")
+
+
+@dataclass
+class OfflineParse:
+    """Resultado da interpretação offline de um pedido de retirada"""
+    items: List[ParsedItem] = field(default_factory=list)
+    leftover: List[str] = field(default_factory=list)  # palavras não consumidas pela gramática
+
+    @property
+    def resolved(self) -> bool:
+        return bool(self.items) and all(it.candidate is not None for it in self.items)
+
+    @property
+    def simple(self) -> bool:
+        """Pedido sem ambiguidade: todos os itens resolvidos e nada sobrando na fala"""
+        return self.resolved and not self.leftover
+
+
+def _tokens(text: str) -> List[str]:
+    text = fold_accents(text).replace("_", " ")
+    text = _SPLIT_DIGITS_RE.sub(r"\1 \2", text)
+    return _TOKEN_RE.findall(text)
+
+
+def _read_number(tokens: List[str], i: int) -> Tuple[Optional[int], int]:
+    """
+    Lê uma quantidade a partir da posição i
+
+    Returns:
+        (valor, próxima posição) ou (None, i) se não houver número
+    """
+    if i >= len(tokens):
+        return None, i
+    tok = tokens[i]
+    if tok.isdigit():
+        value, j = int(tok), i + 1
+    elif tok == "meia" and i + 1 < len(tokens) and tokens[i + 1] in ("duzia", "duzias"):
+        return 6, i + 2
+    elif tok in NUMBER_WORDS or tok == "mil":
+        total, current, last, j = 0, 0, None, i
+        while j < len(tokens):
+            word = tokens[j]
+            if word == "mil":
+                total += (current or 1) * 1000
+                current, last = 0, 1000
+                j += 1
+            elif word in NUMBER_WORDS and (last is None or NUMBER_WORDS[word] < last):
+                current += NUMBER_WORDS[word]
+                last = NUMBER_WORDS[word]
+                j += 1
+            else:
+                break
+            # "vinte e cinco", "cento e dez": o 'e' só une números em ordem decrescente
+            if (j + 1 < len(tokens) and tokens[j] == "e" and tokens[j + 1] in NUMBER_WORDS
+                    and last is not None and NUMBER_WORDS[tokens[j + 1]] < last):
+                j += 1
+        value = total + current
+    else:
+        return None, i
+
+    if j < len(tokens) and tokens[j] in ("duzia", "duzias"):
+        value, j = value * 12, j + 1
+    return value, j
+
+
+def _is_item_start(tokens: List[str], i: int) -> bool:
+    """Quantidade que inicia um item (e não uma medida como 'dez ml')"""
+    value, j = _read_number(tokens, i)
+    if value is None:
+        return False
+    return j >= len(tokens) or tokens[j] not in MEASURE_UNITS
+
+
+def _product_phrase(words: List[str]) -> str:
+    """Normaliza as palavras do produto: medidas coladas e conectivos antes delas removidos"""
+    out: List[str] = []
+    i = 0
+    while i < len(words):
+        value, j = _read_number(words, i)
+        if value is not None and j < len(words) and words[j] in MEASURE_UNITS:
+            if out and out[-1] in CONNECTIVES:
+                out.pop()
+            out.append(f"{value}{MEASURE_UNITS[words[j]]}")
+            i = j + 1
+            continue
+        out.append(words[i])
+        i += 1
+    while out and (out[-1] in TRAILING_FILLERS or out[-1] in CONNECTIVES):
+        out.pop()
+    return " ".join(out)
+
+
+def parse_withdraw(text: str, index: ProductIndex, min_score: float = 0.75) -> Optional[OfflineParse]:
+    """
+    Interpreta um pedido de retirada sem LLM
+
+    Args:
+        text: Fala do usuário
+        index: Índice de nomes do snapshot de estoque atual
+        min_score: Score mínimo para aceitar um produto aproximado
+
+    Returns:
+        OfflineParse com ao menos um item, ou None se a fala não for um pedido de retirada
+    """
+    tokens = _tokens(text)
+    if not tokens or "?" in text or any(t in QUESTION_WORDS or t in NEGATIONS for t in tokens):
+        return None
+
+    parse = OfflineParse()
+    i = 0
+    # Prefixo antes do primeiro item ("stella, quero retirar ...")
+    while i < len(tokens) and not _is_item_start(tokens, i):
+        if tokens[i] not in WITHDRAW_VERBS and tokens[i] not in TRAILING_FILLERS and tokens[i] != ",":
+            parse.leftover.append(tokens[i])
+        i += 1
+
+    while i < len(tokens):
+        quantity, i = _read_number(tokens, i)
+        if quantity is None or quantity <= 0:
+            return None
+        while i < len(tokens) and tokens[i] in COUNT_UNITS:
+            i += 1
+        while i < len(tokens) and tokens[i] in CONNECTIVES:
+            i += 1
+
+        words: List[str] = []
+        while i < len(tokens):
+            tok = tokens[i]
+            if tok in (",", ";"):
+                i += 1
+                break
+            if tok in ("e", "mais") and _is_item_start(tokens, i + 1):
+                i += 1
+                break
+            if _is_item_start(tokens, i):
+                break
+            words.append(tok)
+            i += 1
+        while i < len(tokens) and tokens[i] in (",", ";", "e", "mais"):
+            i += 1
+
+        spoken = _product_phrase(words)
+        if not spoken:
+            return None
+        parse.items.append(ParsedItem(spoken, quantity, _resolve(spoken, index, min_score)))
+
+    return parse if parse.items else None
+
+
+def _resolve(spoken: str, index: ProductIndex, min_score: float) -> Optional[ProductCandidate]:
+    """Resolve o nome falado; tenta também sem conectivos ('agulha de insulina' -> 'agulha insulina')"""
+    best = index.best(spoken, min_score)
+    if best is None or best.method == "fuzzy":
+        bare = " ".join(w for w in spoken.split() if w not in CONNECTIVES)
+        if bare != spoken:
+            alt = index.best(bare, min_score)
+            if alt is not None and (best is None or alt.score > best.score):
+                best = alt
+    return best
+
+
+def build_offline_response(parse: OfflineParse, stock: Dict[str, Any]) -> Dict[str, Any]:
+    """Resposta no contrato de StellaSpeechResponse para um pedido interpretado offline"""
+    items = [{"productName": it.product_name, "quantity": it.quantity} for it in parse.items]
+    descricao = ", ".join(
+        f"{it.quantity} {(stock.get(it.product_name) or {}).get('name') or it.spoken}"
+        for it in parse.items
+    )
+    return {
+        "intention": "withdraw_request",
+        "items": items,
+        "response": f"Você confirma a retirada de {descricao}?",
+        "stella_analysis": "normal",
+        "reason": "Interpretação offline (sem LLM)",
+    }
+
+
+class OfflineWithdrawParser:
+    """Interpretador offline configurado pela seção offline_parser do stella_config.yaml"""
+
+    def __init__(self, enabled: bool = True, fast_path: bool = False, min_score: float = 0.75):
+        self.enabled = enabled
+        self.fast_path = fast_path
+        self.min_score = min_score
+
+    def interpret(self, text: str, index: ProductIndex, stock: Dict[str, Any],
+                  require_simple: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Resposta offline para a fala, ou None se a gramática não cobrir o pedido
+
+        Args:
+            text: Fala do usuário
+            index: Índice de nomes do snapshot atual
+            stock: Estoque indexado por nome normalizado
+            require_simple: Só responde pedidos sem ambiguidade (caminho rápido)
+        """
+        if not self.enabled:
+            return None
+        parse = parse_withdraw(text, index, self.min_score)
+        if parse is None or (require_simple and not parse.simple):
+            return None
+        metrics.inc("offline_parser.fast_path" if require_simple else "offline_parser.fallback")
+        return build_offline_response(parse, stock)
+
+
+_parser: Optional[OfflineWithdrawParser] = None
+
+
+def get_offline_parser() -> OfflineWithdrawParser:
+    global _parser
+    if _parser is None:
+        settings = get_settings()
+        _parser = OfflineWithdrawParser(
+            enabled=settings.get('offline_parser.enabled', True),
+            fast_path=settings.get('offline_parser.fast_path_simple_commands', False),
+            min_score=settings.get('inventory.name_match_min_score', 0.75)
+        )
+    return _parser
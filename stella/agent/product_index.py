@@ -0,0 +1,180 @@
+"""
+Índice de resolução de nomes de produtos
+
+Resolve o nome falado/retornado pelo LLM para a chave do estoque, em ordem:
+1. chave normalizada exata ('Seringa 10ml' -> 'seringa_10ml')
+2. forma canônica sem acentos, no singular e sem separadores
+   ('seringas 10 ml' e 'seringa_10ml' -> 'seringa10ml')
+3. aproximação por n-gramas (índice invertido) refinada por distância de edição
+
+Na aproximação, medidas (10ml, 500mg, 2...) precisam bater: 'seringa 10ml' é
+parecida com 'seringa_20ml' no texto, mas é outro produto.
+
+O índice é construído uma vez por versão do snapshot de estoque.
+"""
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+from stella.agent.stock_cache import StockSnapshot, normalize_product_name
+from stella.agent.text_utils import char_ngrams, fold_accents, tokenize
+
+# Unidades reconhecidas junto de números nos nomes de produtos
+UNITS: Set[str] = {"ml", "l", "mg", "g", "kg", "mcg", "ug", "ui", "cm", "mm", "m", "un", "cx", "fr"}
+_MEASURE_RE = re.compile(r"(\d+(?:[.,]\d+)?)\s*([a-z]+)?")
+
+
+@dataclass
+class ProductCandidate:
+    """Produto candidato para um nome, com score de 0 a 1"""
+    key: str
+    score: float
+    method: str  # exact | canonical | fuzzy
+
+
+def canonical_name(name: str) -> str:
+    """Forma canônica para comparação: sem acentos, no singular e sem separadores"""
+    return "".join(tokenize(name))
+
+
+def measures(name: str) -> List[Tuple[str, Optional[str]]]:
+    """Números do nome com a unidade, se houver ('Seringa 10 ml' -> [('10', 'ml')])"""
+    found = []
+    for number, word in _MEASURE_RE.findall(fold_accents(name).replace("_", " ")):
+        unit = word if word in UNITS else word[:-1] if word.endswith("s") and word[:-1] in UNITS else None
+        found.append((number.replace(",", "."), unit))
+    return sorted(found, key=lambda m: (m[0], m[1] or ""))
+
+
+def measures_compatible(query: List[Tuple[str, Optional[str]]], candidate: List[Tuple[str, Optional[str]]]) -> bool:
+    """
+    Medidas da fala batem com as do produto
+
+    Sem números na fala qualquer produto serve; com números, os valores precisam
+    ser os mesmos e as unidades só são comparadas quando as duas estão presentes.
+    """
+    if not query:
+        return True
+    if len(query) != len(candidate):
+        return False
+    return all(
+        qn == cn and (qu is None or cu is None or qu == cu)
+        for (qn, qu), (cn, cu) in zip(query, candidate)
+    )
+
+
+def edit_distance(a: str, b: str) -> int:
+    """Distância de Levenshtein"""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ca != cb)
+            ))
+        previous = current
+    return previous[-1]
+
+
+class ProductIndex:
+    """Índice de nomes de produtos de um snapshot de estoque"""
+
+    def __init__(self, stock: Dict[str, Any], version: Optional[str] = None, max_fuzzy_candidates: int = 8):
+        self.version = version
+        self.max_fuzzy_candidates = max_fuzzy_candidates
+        self._keys: Set[str] = set(stock)
+        self._canonical: Dict[str, str] = {}
+        self._canonical_by_key: Dict[str, str] = {}
+        self._ngram_postings: Dict[str, List[str]] = {}
+        self._ngram_sizes: Dict[str, int] = {}
+        self._measures: Dict[str, List[Tuple[str, Optional[str]]]] = {}
+
+        for key, item in stock.items():
+            forms = {canonical_name(key), canonical_name(item.get("name") or "")}
+            forms.discard("")
+            for form in forms:
+                self._canonical.setdefault(form, key)
+            canonical = canonical_name(key) or key
+            self._canonical_by_key[key] = canonical
+            self._measures[key] = measures(key) or measures(item.get("name") or "")
+            grams = char_ngrams(canonical)
+            self._ngram_sizes[key] = len(grams)
+            for gram in grams:
+                self._ngram_postings.setdefault(gram, []).append(key)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def resolve(self, name: str, limit: int = 3) -> List[ProductCandidate]:
+        """
+        Candidatos para um nome de produto, ordenados por score
+
+        Args:
+            name: Nome como falado ou retornado pelo LLM
+            limit: Quantidade máxima de candidatos
+
+        Returns:
+            Lista de ProductCandidate (vazia se nada parecido)
+        """
+        if not name:
+            return []
+
+        key = normalize_product_name(name)
+        if key in self._keys:
+            return [ProductCandidate(key, 1.0, "exact")]
+
+        canonical = canonical_name(name)
+        if not canonical:
+            return []
+        match = self._canonical.get(canonical)
+        if match is not None:
+            return [ProductCandidate(match, 0.95, "canonical")]
+
+        # Candidatos que compartilham n-gramas com o nome; n-gramas muito comuns
+        # (ex: 'ml ') são ignorados para manter a busca rápida em catálogos grandes
+        grams = char_ngrams(canonical)
+        common_limit = max(50, len(self._keys) // 20)
+        postings = [self._ngram_postings[g] for g in grams if g in self._ngram_postings]
+        selective = [p for p in postings if len(p) <= common_limit] or postings
+        shared: Counter = Counter()
+        for posting in selective:
+            shared.update(posting)
+        if not shared:
+            return []
+
+        query_measures = measures(name)
+        ranked = []
+        for candidate, common in shared.most_common(self.max_fuzzy_candidates):
+            if not measures_compatible(query_measures, self._measures[candidate]):
+                continue
+            jaccard = common / (len(grams) + self._ngram_sizes[candidate] - common)
+            target = self._canonical_by_key[candidate]
+            distance = edit_distance(canonical, target)
+            edit_score = 1 - distance / max(len(canonical), len(target))
+            score = round(0.9 * max(jaccard, edit_score), 4)
+            ranked.append(ProductCandidate(candidate, score, "fuzzy"))
+
+        ranked.sort(key=lambda c: (-c.score, c.key))
+        return ranked[:limit]
+
+    def best(self, name: str, min_score: float = 0.75) -> Optional[ProductCandidate]:
+        """Melhor candidato com score mínimo, ou None"""
+        candidates = self.resolve(name, limit=1)
+        if candidates and candidates[0].score >= min_score:
+            return candidates[0]
+        return None
+
+
+_index: Optional[ProductIndex] = None
+
+
+def get_product_index(snapshot: StockSnapshot) -> ProductIndex:
+    """Índice do snapshot atual (reconstruído apenas quando a versão muda)"""
+    global _index
+    if _index is None or _index.version != snapshot.version or not snapshot.version:
+        _index = ProductIndex(snapshot.items, snapshot.version)
+    return _index
@@ -0,0 +1,129 @@
+"""
+Cache de respostas do LLM para turnos repetíveis
+
+Vários quiosques perguntam a mesma coisa ("quanto tem de luva?"). Respostas
+de intenções sem estado (stock_query, doubt, saudações) são guardadas por:
+- fala normalizada (sem acentos, no singular, sem pontuação)
+- versão do estoque relevante: hash das quantidades dos produtos enviados no
+  prompt (se uma dessas quantidades muda, a chave muda e a entrada antiga
+  deixa de ser usada)
+- versão do prompt/modelo
+
+Eviction LRU com limite de entradas e TTL. Produtos retirados também
+invalidam explicitamente as entradas que os referenciam.
+"""
+import copy
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+from stella.agent.metrics import metrics
+from stella.agent.text_utils import tokenize
+from stella.config.settings import get_settings
+
+
+def stock_fingerprint(stock: Dict[str, Any]) -> str:
+    """Versão das quantidades de um recorte do estoque"""
+    payload = sorted((key, int(item.get("quantity", 0))) for key, item in stock.items())
+    return hashlib.sha1(json.dumps(payload).encode("utf-8")).hexdigest()[:12]
+
+
+def prompt_version(*parts: str) -> str:
+    """Versão do prompt/modelo (muda quando a instrução de sistema ou o modelo mudam)"""
+    return hashlib.sha1("\x00".join(parts).encode("utf-8")).hexdigest()[:12]
+
+
+class ResponseCache:
+    """Cache LRU + TTL de respostas do LLM"""
+
+    def __init__(
+        self,
+        max_entries: int = 512,
+        ttl_seconds: float = 300,
+        intents: Iterable[str] = ("stock_query", "doubt"),
+        analyses: Iterable[str] = ("greeting",)
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.intents = set(intents)
+        self.analyses = set(analyses)
+        self._lock = threading.Lock()
+        # chave -> (expira_em, produtos referenciados, resposta)
+        self._entries: "OrderedDict[Tuple[str, str, str], Tuple[float, Set[str], Dict[str, Any]]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def make_key(utterance: str, stock_version: str, prompt_ver: str) -> Tuple[str, str, str]:
+        return (" ".join(tokenize(utterance)), stock_version, prompt_ver)
+
+    def cacheable(self, resultado: Dict[str, Any]) -> bool:
+        """Só intenções que não dependem do estado da conversa"""
+        return resultado.get("intention") in self.intents or resultado.get("stella_analysis") in self.analyses
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[Dict[str, Any]]:
+        """Cópia da resposta guardada, ou None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.time():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                metrics.inc("response_cache.miss")
+                return None
+            self._entries.move_to_end(key)
+        metrics.inc("response_cache.hit")
+        return copy.deepcopy(entry[2])
+
+    def put(self, key: Tuple[str, str, str], resultado: Dict[str, Any], products: Iterable[str] = ()):
+        """Guarda a resposta se a intenção for cacheável"""
+        if not self.cacheable(resultado):
+            return
+        referenced = set(products) | {it.get("productName") for it in resultado.get("items") or []}
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl_seconds, referenced, copy.deepcopy(resultado))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                metrics.inc("response_cache.evicted")
+            metrics.set_gauge("response_cache.entries", len(self._entries))
+
+    def invalidate_products(self, products: Iterable[str]) -> int:
+        """Remove entradas que referenciam algum dos produtos; retorna quantas foram removidas"""
+        products = set(products)
+        if not products:
+            return 0
+        with self._lock:
+            stale = [key for key, (_, referenced, _) in self._entries.items() if referenced & products]
+            for key in stale:
+                del self._entries[key]
+            metrics.set_gauge("response_cache.entries", len(self._entries))
+        if stale:
+            metrics.inc("response_cache.invalidated", len(stale))
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Cache compartilhado, ou None se desativado"""
+    global _cache
+    settings = get_settings()
+    if not settings.get('response_cache.enabled', True):
+        return None
+    if _cache is None:
+        _cache = ResponseCache(
+            max_entries=settings.get('response_cache.max_entries', 512),
+            ttl_seconds=settings.get('response_cache.ttl_seconds', 300),
+            intents=settings.get('response_cache.intents', ["stock_query", "doubt"]),
+            analyses=settings.get('response_cache.analyses', ["greeting"])
+        )
+    return _cache
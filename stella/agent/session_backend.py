@@ -0,0 +1,415 @@
+"""
+Estado de sessão fora do processo (vários workers do uvicorn, reinício a quente)
+
+Com históricos só em memória, requisições seguidas da mesma conversa que caem
+em workers diferentes perdiam o contexto, e um reinício perdia todas as
+conversas em andamento. Aqui o estado de cada sessão (histórico compacto +
+carrinho pendente) vira um JSON pequeno guardado num backend plugável:
+
+- memory: nada sai do processo (padrão; o SessionStore local é a fonte)
+- sqlite: arquivo local, compartilhado pelos workers da mesma máquina
+- redis: qualquer servidor compatível com o protocolo Redis
+  (messaging.redis_host/redis_port; pacote `redis` importado só se usado)
+
+O SessionStore local continua como cache: o estado é recarregado no início
+de cada turno e gravado no fim. Dentro de um worker a ordem dos turnos vem do
+lock por sessão (session_concurrency); entre workers, o trecho carregar ->
+interpretar -> gravar roda sob um lock no próprio backend (linha em
+session_locks no SQLite, SET NX PX no Redis), com dono (token) e prazo, para
+que dois workers não sobrescrevam o histórico/carrinho um do outro.
+
+O mesmo backend guarda os registros de idempotência das requisições
+(ver idempotency), para que um retry atendido por outro worker não gere
+um segundo turno.
+"""
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from loguru import logger
+from stella.agent.cart import CartStore
+from stella.agent.metrics import metrics
+from stella.agent.session_store import SessionStore
+from stella.config.settings import get_settings
+
+DEFAULT_SQLITE_PATH = Path(__file__).parent.parent / "data" / "sessions.db"
+
+
+class SessionBusyError(RuntimeError):
+    """Outro worker manteve o lock da sessão além do tempo de espera"""
+
+
+class InMemorySessionBackend:
+    """Sem estado externo: o SessionStore do processo é a fonte"""
+
+    shared = False
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return None
+
+    def save(self, session_id: str, state: Dict[str, Any], ttl_seconds: float):
+        pass
+
+    def delete(self, session_id: str):
+        pass
+
+    def acquire_lock(self, session_id: str, token: str, ttl_seconds: float) -> bool:
+        return True
+
+    def release_lock(self, session_id: str, token: str):
+        pass
+
+    def claim_request(self, key: str, ttl_seconds: float) -> bool:
+        return True
+
+    def renew_request(self, key: str, ttl_seconds: float) -> bool:
+        return True
+
+    def finish_request(self, key: str, result: Any, ttl_seconds: float) -> bool:
+        return True
+
+    def release_request(self, key: str):
+        pass
+
+    def load_request(self, key: str) -> Tuple[bool, Any]:
+        return False, None
+
+    def close(self):
+        pass
+
+
+class SQLiteSessionBackend:
+    """Estado em um arquivo SQLite (WAL), com expiração por sessão"""
+
+    shared = True
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, timeout=5)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, state TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS session_locks ("
+                "session_id TEXT PRIMARY KEY, token TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS requests ("
+                "request_key TEXT PRIMARY KEY, result TEXT, expires_at REAL NOT NULL)"
+            )
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state FROM sessions WHERE session_id = ? AND expires_at > ?",
+                (session_id, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, session_id: str, state: Dict[str, Any], ttl_seconds: float):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, state, expires_at) VALUES (?, ?, ?)",
+                (session_id, _dumps(state), now + ttl_seconds)
+            )
+            self._conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+
+    def delete(self, session_id: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def acquire_lock(self, session_id: str, token: str, ttl_seconds: float) -> bool:
+        """Cria a linha de lock da sessão se não houver uma válida (lock vencido é retomado)"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM session_locks WHERE session_id = ? AND expires_at <= ?", (session_id, now)
+            )
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO session_locks (session_id, token, expires_at) VALUES (?, ?, ?)",
+                (session_id, token, now + ttl_seconds)
+            )
+            return cursor.rowcount == 1
+
+    def release_lock(self, session_id: str, token: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM session_locks WHERE session_id = ? AND token = ?", (session_id, token)
+            )
+
+    def claim_request(self, key: str, ttl_seconds: float) -> bool:
+        """Registra a requisição como em andamento se ainda não existir (set-if-absent)"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM requests WHERE expires_at <= ?", (now,))
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO requests (request_key, result, expires_at) VALUES (?, NULL, ?)",
+                (key, now + ttl_seconds)
+            )
+            return cursor.rowcount == 1
+
+    def renew_request(self, key: str, ttl_seconds: float) -> bool:
+        """Estende o prazo do registro em andamento; False se ele venceu ou já terminou"""
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE requests SET expires_at = ? WHERE request_key = ? AND result IS NULL AND expires_at > ?",
+                (now + ttl_seconds, key, now)
+            )
+            return cursor.rowcount == 1
+
+    def finish_request(self, key: str, result: Any, ttl_seconds: float) -> bool:
+        """Guarda o resultado; False se o registro não existe mais"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE requests SET result = ?, expires_at = ? WHERE request_key = ?",
+                (_dumps(result), time.time() + ttl_seconds, key)
+            )
+            return cursor.rowcount == 1
+
+    def release_request(self, key: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM requests WHERE request_key = ?", (key,))
+
+    def load_request(self, key: str) -> Tuple[bool, Any]:
+        """(existe, resultado); resultado None enquanto outro worker processa"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result FROM requests WHERE request_key = ? AND expires_at > ?",
+                (key, time.time())
+            ).fetchone()
+        if row is None:
+            return False, None
+        return True, json.loads(row[0]) if row[0] is not None else None
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RedisSessionBackend:
+    """Estado em um servidor Redis (ou compatível), com expiração nativa (SET EX)"""
+
+    shared = True
+
+    def __init__(self, host: str = "localhost", port: int = 6379, db: int = 0,
+                 prefix: str = "stella:session:", timeout_seconds: float = 5):
+        import redis
+        self.prefix = prefix
+        self._client = redis.Redis(
+            host=host, port=port, db=db,
+            socket_timeout=timeout_seconds, socket_connect_timeout=timeout_seconds
+        )
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        raw = self._client.get(self.prefix + session_id)
+        return json.loads(raw) if raw else None
+
+    def save(self, session_id: str, state: Dict[str, Any], ttl_seconds: float):
+        self._client.set(self.prefix + session_id, _dumps(state), ex=max(1, int(ttl_seconds)))
+
+    def delete(self, session_id: str):
+        self._client.delete(self.prefix + session_id)
+
+    def acquire_lock(self, session_id: str, token: str, ttl_seconds: float) -> bool:
+        return bool(self._client.set(self.prefix + "lock:" + session_id, token, nx=True, px=int(ttl_seconds * 1000)))
+
+    def release_lock(self, session_id: str, token: str):
+        # Só apaga se o lock ainda for deste turno (pode ter vencido e sido retomado)
+        self._client.eval(_RELEASE_LOCK_SCRIPT, 1, self.prefix + "lock:" + session_id, token)
+
+    def claim_request(self, key: str, ttl_seconds: float) -> bool:
+        # Valor vazio = em andamento; o resultado substitui depois
+        return bool(self._client.set(self.prefix + "request:" + key, "", nx=True, ex=max(1, int(ttl_seconds))))
+
+    def renew_request(self, key: str, ttl_seconds: float) -> bool:
+        # Só renova enquanto o valor é o de "em andamento"
+        return bool(self._client.eval(
+            _RENEW_REQUEST_SCRIPT, 1, self.prefix + "request:" + key, int(ttl_seconds * 1000)
+        ))
+
+    def finish_request(self, key: str, result: Any, ttl_seconds: float) -> bool:
+        return bool(self._client.set(
+            self.prefix + "request:" + key, _dumps(result), xx=True, ex=max(1, int(ttl_seconds))
+        ))
+
+    def release_request(self, key: str):
+        self._client.delete(self.prefix + "request:" + key)
+
+    def load_request(self, key: str) -> Tuple[bool, Any]:
+        raw = self._client.get(self.prefix + "request:" + key)
+        if raw is None:
+            return False, None
+        return True, json.loads(raw) if raw else None
+
+    def close(self):
+        self._client.close()
+
+
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+_RENEW_REQUEST_SCRIPT = """
+if redis.call('get', KEYS[1]) == '' then
+    return redis.call('pexpire', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+
+def _dumps(state: Dict[str, Any]) -> str:
+    return json.dumps(state, ensure_ascii=False, separators=(",", ":"))
+
+
+class SessionStateSync:
+    """Recarrega/grava o estado da sessão (histórico + carrinho) no backend"""
+
+    def __init__(self, backend: Any, store: SessionStore, carts: CartStore,
+                 lock_ttl_seconds: float = 30, lock_wait_seconds: float = 20):
+        self.backend = backend
+        self.store = store
+        self.carts = carts
+        self.lock_ttl_seconds = lock_ttl_seconds
+        self.lock_wait_seconds = lock_wait_seconds
+
+    @asynccontextmanager
+    async def locked(self, session_id: str):
+        """
+        Lock da sessão no backend, compartilhado entre workers
+
+        Envolve restore -> turno -> persist. O lock vence sozinho após
+        lock_ttl_seconds (worker que caiu no meio do turno). Falhas do backend
+        não bloqueiam o turno; outro worker segurando o lock além de
+        lock_wait_seconds gera SessionBusyError.
+        """
+        if not self.backend.shared:
+            yield
+            return
+
+        token = uuid.uuid4().hex
+        started = time.perf_counter()
+        deadline = time.monotonic() + self.lock_wait_seconds
+        delay = 0.02
+        acquired = False
+        while True:
+            try:
+                acquired = await asyncio.to_thread(self.backend.acquire_lock, session_id, token, self.lock_ttl_seconds)
+            except Exception as e:
+                logger.warning(f"Falha ao obter lock da sessão {session_id} no backend: {e}")
+                metrics.inc("sessions.backend_errors")
+                break
+            if acquired:
+                break
+            if time.monotonic() >= deadline:
+                metrics.inc("sessions.backend_lock_timeouts")
+                raise SessionBusyError(f"Sessão {session_id} ocupada em outro worker")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.2)
+        metrics.observe("sessions.backend_lock_wait_ms", (time.perf_counter() - started) * 1000)
+
+        try:
+            yield
+        finally:
+            if acquired:
+                try:
+                    await asyncio.to_thread(self.backend.release_lock, session_id, token)
+                except Exception as e:
+                    logger.warning(f"Falha ao liberar lock da sessão {session_id}: {e}")
+                    metrics.inc("sessions.backend_errors")
+
+    async def restore(self, session_id: str):
+        """Traz o estado mais recente (de outro worker ou de antes do reinício)"""
+        if not self.backend.shared:
+            return
+        try:
+            state = await asyncio.to_thread(self.backend.load, session_id)
+        except Exception as e:
+            logger.warning(f"Falha ao carregar estado da sessão {session_id}: {e}")
+            metrics.inc("sessions.backend_errors")
+            return
+        if state is None:
+            # Encerrada ou vencida em outro worker: o que sobrou aqui não pode voltar no persist
+            sess = self.store.get(session_id)
+            if (sess is not None and (sess.turns or sess.summary)) or session_id in self.carts:
+                if sess is not None:
+                    sess.clear()
+                self.carts.pop(session_id)
+                metrics.inc("sessions.restore_cleared")
+            return
+        self.store.get_or_create(session_id).load_dict(state.get("history") or {})
+        self.carts.restore(session_id, state.get("cart"))
+        metrics.inc("sessions.restored")
+
+    async def persist(self, session_id: str):
+        """Grava o estado no fim do turno"""
+        if not self.backend.shared:
+            return
+        sess = self.store.get(session_id)
+        if sess is None:
+            return
+        state = {"history": sess.to_dict(), "cart": self.carts.to_dict(session_id)}
+        try:
+            await asyncio.to_thread(self.backend.save, session_id, state, self.store.ttl_seconds)
+        except Exception as e:
+            logger.warning(f"Falha ao gravar estado da sessão {session_id}: {e}")
+            metrics.inc("sessions.backend_errors")
+
+    async def delete(self, session_id: str):
+        """Encerramento explícito: o estado some para todos os workers"""
+        if not self.backend.shared:
+            return
+        try:
+            await asyncio.to_thread(self.backend.delete, session_id)
+        except Exception as e:
+            logger.warning(f"Falha ao apagar estado da sessão {session_id}: {e}")
+            metrics.inc("sessions.backend_errors")
+
+    def close(self):
+        self.backend.close()
+
+
+def create_session_state_sync(store: SessionStore, carts: CartStore) -> SessionStateSync:
+    """SessionStateSync com o backend e os prazos de lock das configurações"""
+    settings = get_settings()
+    return SessionStateSync(
+        create_session_backend(),
+        store,
+        carts,
+        lock_ttl_seconds=settings.get('sessions.lock_ttl_seconds', 30),
+        lock_wait_seconds=settings.get('sessions.lock_wait_seconds', 20)
+    )
+
+
+def create_session_backend() -> Any:
+    """Backend conforme sessions.backend ('memory', 'sqlite' ou 'redis')"""
+    settings = get_settings()
+    name = settings.get('sessions.backend', 'memory')
+    if name == 'sqlite':
+        path = settings.get('sessions.sqlite_path')
+        return SQLiteSessionBackend(Path(path) if path else DEFAULT_SQLITE_PATH)
+    if name == 'redis':
+        return RedisSessionBackend(
+            host=settings.get('messaging.redis_host', 'localhost'),
+            port=settings.get('messaging.redis_port', 6379),
+            db=settings.get('sessions.redis_db', 0),
+            prefix=settings.get('sessions.redis_prefix', 'stella:session:'),
+            timeout_seconds=settings.get('messaging.connection_timeout_seconds', 5)
+        )
+    if name != 'memory':
+        logger.warning(f"Backend de sessão desconhecido '{name}', usando memória")
+    return InMemorySessionBackend()
@@ -0,0 +1,88 @@
+"""
+Sessões simultâneas de vários quiosques
+
+Antes havia uma única sessão ativa por processo: um session_id novo apagava
+todas as outras, então dois quiosques destruíam o contexto um do outro. Aqui:
+- cada sessão tem seu próprio lock: turnos da mesma sessão são processados em
+  ordem, e sessões diferentes seguem em paralelo
+- a exclusividade passa a ser por dispositivo (opcional): uma sessão nova no
+  mesmo quiosque encerra a anterior daquele quiosque, sem afetar os demais
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Tuple
+from stella.agent.metrics import metrics
+
+
+class SessionLocks:
+    """Um asyncio.Lock por sessão, descartado quando ninguém o usa"""
+
+    def __init__(self):
+        self._locks: Dict[str, Tuple[asyncio.Lock, int]] = {}  # session_id -> (lock, usuários)
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    def is_held(self, session_id: str) -> bool:
+        """Há turno da sessão em andamento ou aguardando o lock"""
+        return session_id in self._locks
+
+    @asynccontextmanager
+    async def hold(self, session_id: str):
+        """Serializa os turnos de uma sessão"""
+        lock, users = self._locks.get(session_id) or (asyncio.Lock(), 0)
+        self._locks[session_id] = (lock, users + 1)
+        started = time.perf_counter()
+        try:
+            async with lock:
+                metrics.observe("sessions.lock_wait_ms", (time.perf_counter() - started) * 1000)
+                yield
+        finally:
+            lock, users = self._locks[session_id]
+            if users <= 1:
+                del self._locks[session_id]
+            else:
+                self._locks[session_id] = (lock, users - 1)
+
+
+class DeviceSessions:
+    """Sessão corrente de cada dispositivo (quiosque)"""
+
+    def __init__(self):
+        self._by_device: Dict[str, str] = {}
+        self._by_session: Dict[str, str] = {}
+
+    def claim(self, device_id: str, session_id: str) -> Optional[str]:
+        """
+        Associa a sessão ao dispositivo
+
+        Returns:
+            Sessão anterior do dispositivo (a ser encerrada), ou None
+        """
+        previous = self._by_device.get(device_id)
+        if previous == session_id:
+            return None
+        if previous is not None:
+            self._by_session.pop(previous, None)
+        old_device = self._by_session.get(session_id)
+        if old_device is not None and old_device != device_id:
+            self._by_device.pop(old_device, None)
+        self._by_device[device_id] = session_id
+        self._by_session[session_id] = device_id
+        metrics.set_gauge("sessions.devices", len(self._by_device))
+        return previous
+
+    def release(self, session_id: str):
+        """Desfaz a associação (sessão encerrada ou expirada)"""
+        device_id = self._by_session.pop(session_id, None)
+        if device_id is not None and self._by_device.get(device_id) == session_id:
+            del self._by_device[device_id]
+        metrics.set_gauge("sessions.devices", len(self._by_device))
+
+    def device_of(self, session_id: str) -> Optional[str]:
+        return self._by_session.get(session_id)
+
+
+session_locks = SessionLocks()
+device_sessions = DeviceSessions()
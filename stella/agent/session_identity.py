@@ -0,0 +1,195 @@
+"""
+Identidade especulativa por sessão
+
+Permite iniciar o reconhecimento facial em background assim que a sessão
+começa, vinculando o resultado à sessão com um TTL. Quando a confirmação de
+retirada chega, a identidade normalmente já está resolvida e a latência do
+reconhecimento sai do caminho crítico.
+
+Sessões que nunca falam (e nunca chamam /session/end) não passam pelo
+SessionStore, então uma varredura periódica descarta as entradas vencidas e,
+quando não sobra nenhuma, avisa o dono da câmera para liberá-la.
+"""
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Optional
+from loguru import logger
+from stella.config.settings import get_settings
+
+
+@dataclass
+class _IdentityEntry:
+    task: asyncio.Task
+    user_id: Optional[str] = None
+    resolved_at: Optional[float] = None
+    started_at: float = field(default_factory=time.time)
+
+
+class SessionIdentityRegistry:
+    """Reconhecimentos em andamento e identidades resolvidas por session_id"""
+
+    def __init__(self, ttl_seconds: float = 120, sweep_interval_seconds: float = 30):
+        self.ttl_seconds = ttl_seconds
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self._entries: Dict[str, _IdentityEntry] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+        self._on_idle: Optional[Callable[[], Awaitable[None]]] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def set_idle_callback(self, on_idle: Optional[Callable[[], Awaitable[None]]]):
+        """Define a função chamada quando a última identidade vence (ex.: liberar a câmera)"""
+        self._on_idle = on_idle
+
+    def start(self, session_id: str, recognize: Callable[[], Awaitable[Optional[str]]]) -> bool:
+        """
+        Dispara o reconhecimento em background para a sessão
+
+        Args:
+            session_id: ID da sessão
+            recognize: Função assíncrona que retorna o ID do usuário reconhecido (ou None)
+
+        Returns:
+            True se o reconhecimento foi iniciado
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            logger.warning("Sem event loop ativo, reconhecimento especulativo não iniciado")
+            return False
+
+        self.cancel(session_id)
+        task = loop.create_task(self._run(session_id, recognize))
+        self._entries[session_id] = _IdentityEntry(task=task)
+        self._ensure_sweeper(loop)
+        logger.info(f"🔍 Reconhecimento especulativo iniciado | Sessão: {session_id}")
+        return True
+
+    async def _run(self, session_id: str, recognize: Callable[[], Awaitable[Optional[str]]]) -> Optional[str]:
+        try:
+            user_id = await recognize()
+        except asyncio.CancelledError:
+            logger.info(f"Reconhecimento especulativo cancelado | Sessão: {session_id}")
+            raise
+        except Exception as e:
+            logger.error(f"❌ Erro no reconhecimento especulativo (sessão {session_id}): {e}")
+            user_id = None
+
+        entry = self._entries.get(session_id)
+        if entry is not None and entry.task is asyncio.current_task():
+            entry.user_id = user_id
+            entry.resolved_at = time.time()
+            if user_id:
+                logger.success(f"✅ Identidade resolvida para sessão {session_id}: {user_id}")
+        return user_id
+
+    def _expired(self, entry: _IdentityEntry, now: Optional[float] = None) -> bool:
+        now = now or time.time()
+        if entry.resolved_at is None:
+            # Reconhecimento que não termina também vence (câmera presa)
+            return now - entry.started_at > self.ttl_seconds
+        return now - entry.resolved_at > self.ttl_seconds
+
+    def get(self, session_id: str) -> Optional[str]:
+        """Retorna a identidade já resolvida e dentro do TTL, sem esperar"""
+        entry = self._entries.get(session_id)
+        if entry is None or entry.resolved_at is None:
+            return None
+        if self._expired(entry):
+            self.cancel(session_id)
+            return None
+        return entry.user_id
+
+    async def resolve(self, session_id: str, timeout: float) -> Optional[str]:
+        """
+        Retorna a identidade da sessão, aguardando um reconhecimento em andamento
+
+        Args:
+            session_id: ID da sessão
+            timeout: Tempo máximo de espera em segundos
+
+        Returns:
+            ID do usuário ou None se não houver identidade válida a tempo
+        """
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return None
+
+        if not entry.task.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(entry.task), timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                logger.warning(f"⚠️ Identidade da sessão {session_id} não resolvida em {timeout}s")
+                return None
+
+        return self.get(session_id)
+
+    def cancel(self, session_id: str) -> bool:
+        """Cancela o reconhecimento em andamento e descarta a identidade da sessão"""
+        entry = self._entries.pop(session_id, None)
+        if entry is None:
+            return False
+        if not entry.task.done():
+            entry.task.cancel()
+        return True
+
+    def sweep(self) -> int:
+        """
+        Descarta identidades vencidas (e cancela reconhecimentos presos)
+
+        Returns:
+            Quantidade de entradas removidas
+        """
+        now = time.time()
+        expired = [sid for sid, entry in self._entries.items() if self._expired(entry, now)]
+        for session_id in expired:
+            self.cancel(session_id)
+        if expired:
+            logger.info(f"🧹 {len(expired)} identidade(s) especulativa(s) vencida(s) descartada(s)")
+        return len(expired)
+
+    async def _run_idle_callback(self):
+        if self._entries:
+            return  # Nova sessão começou antes do callback rodar
+        try:
+            await self._on_idle()
+        except Exception as e:
+            logger.error(f"❌ Erro ao liberar recursos do reconhecimento especulativo: {e}")
+
+    def _ensure_sweeper(self, loop: asyncio.AbstractEventLoop):
+        """Inicia a varredura em segundo plano no loop atual (se ainda não estiver rodando)"""
+        if self._sweeper is not None and not self._sweeper.done() and self._sweeper.get_loop() is loop:
+            return
+        self._sweeper = loop.create_task(self._sweep_loop())
+
+    async def _sweep_loop(self):
+        while self._entries:
+            await asyncio.sleep(self.sweep_interval_seconds)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Erro na varredura de identidades especulativas: {e}")
+        # Nenhuma sessão especulativa pendente: libera a câmera
+        await self._run_idle_callback()
+
+    async def close(self):
+        """Cancela reconhecimentos e a varredura (desligamento)"""
+        for session_id in list(self._entries):
+            entry = self._entries.pop(session_id)
+            if not entry.task.done():
+                entry.task.cancel()
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except (asyncio.CancelledError, RuntimeError):
+                pass
+            self._sweeper = None
+
+
+session_identities = SessionIdentityRegistry(
+    ttl_seconds=get_settings().get('speculative_auth.ttl_seconds', 120),
+    sweep_interval_seconds=get_settings().get('speculative_auth.sweep_interval_seconds', 30)
+)
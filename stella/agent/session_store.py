@@ -0,0 +1,212 @@
+"""
+Armazenamento das sessões de conversa com expiração e limite de memória
+
+Antes, toda requisição varria todas as sessões procurando as expiradas. Aqui:
+- a expiração usa um heap de prazos: a varredura só toca as sessões vencidas
+  (entradas antigas do heap são descartadas ou reagendadas ao sair do topo)
+- a varredura roda em segundo plano, a cada `sweep_interval_seconds`
+- a memória aproximada de todos os históricos tem um orçamento global; acima
+  dele, as sessões menos usadas recentemente (LRU) são removidas, exceto as
+  que têm um turno em andamento (o turno continuaria alterando um histórico
+  que já saiu do armazenamento)
+- cada histórico tem um teto de turnos mantidos na íntegra (o resto vira resumo)
+"""
+import asyncio
+import heapq
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+from loguru import logger
+from stella.agent.conversation import ConversationHistory
+from stella.agent.metrics import metrics
+from stella.config.settings import get_settings
+
+
+class SessionStore:
+    """Históricos de conversa por session_id, com TTL e orçamento de memória"""
+
+    def __init__(
+        self,
+        ttl_seconds: float = 180,
+        memory_budget_bytes: int = 64 * 1024 * 1024,
+        sweep_interval_seconds: float = 15,
+        history_factory: Optional[Callable[[], ConversationHistory]] = None,
+        on_remove: Optional[Callable[[str], None]] = None,
+        is_busy: Optional[Callable[[str], bool]] = None
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.memory_budget_bytes = memory_budget_bytes
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self.history_factory = history_factory or ConversationHistory
+        self.on_remove = on_remove  # limpeza do estado associado (carrinho, identidade...)
+        self.is_busy = is_busy  # sessão com turno em andamento (não é despejada)
+        self._sessions: "OrderedDict[str, ConversationHistory]" = OrderedDict()  # ordem LRU
+        self._last_seen: Dict[str, float] = {}
+        self._expiry: List[Tuple[float, str]] = []  # (prazo, session_id), com entradas obsoletas
+        self._bytes = 0
+        self._sweeper: Optional[asyncio.Task] = None
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    @property
+    def approx_bytes(self) -> int:
+        return self._bytes
+
+    def session_ids(self) -> List[str]:
+        return list(self._sessions)
+
+    def last_seen(self, session_id: str) -> Optional[float]:
+        return self._last_seen.get(session_id)
+
+    def get(self, session_id: str) -> Optional[ConversationHistory]:
+        return self._sessions.get(session_id)
+
+    def get_or_create(self, session_id: str) -> ConversationHistory:
+        """Retorna (ou cria) o histórico e renova o TTL da sessão"""
+        now = time.time()
+        sess = self._sessions.get(session_id)
+        if sess is not None and now - self._last_seen[session_id] > self.ttl_seconds:
+            # Venceu antes da próxima varredura: começa do zero
+            self._remove(session_id, "expirada")
+            sess = None
+
+        if sess is None:
+            sess = self.history_factory()
+            sess.on_resize = self._on_resize
+            self._sessions[session_id] = sess
+            heapq.heappush(self._expiry, (now + self.ttl_seconds, session_id))
+            logger.info(f"Sessão criada: {session_id}")
+        else:
+            self._sessions.move_to_end(session_id)
+        self._last_seen[session_id] = now
+        self._update_gauges()
+        self._ensure_sweeper()
+        return sess
+
+    def remove(self, session_id: str) -> bool:
+        """Remove a sessão (encerramento explícito)"""
+        if session_id not in self._sessions:
+            return False
+        self._remove(session_id, "encerrada")
+        return True
+
+    def _remove(self, session_id: str, reason: str):
+        sess = self._sessions.pop(session_id)
+        self._last_seen.pop(session_id, None)
+        sess.on_resize = None
+        self._bytes -= sess.approx_bytes()
+        if self.on_remove is not None:
+            self.on_remove(session_id)
+        self._update_gauges()
+        logger.info(f"Sessão {reason} e removida: {session_id}")
+
+    def _on_resize(self, delta: int):
+        self._bytes += delta
+        self._enforce_budget()
+        self._update_gauges()
+
+    def _enforce_budget(self):
+        """
+        Remove as sessões menos usadas até caber no orçamento
+
+        A mais recente sempre fica, assim como as sessões com turno em andamento;
+        se só restarem essas, o orçamento fica estourado até o próximo ajuste.
+        """
+        if self._bytes <= self.memory_budget_bytes:
+            return
+        for session_id in list(self._sessions)[:-1]:
+            if self._bytes <= self.memory_budget_bytes:
+                break
+            if self.is_busy is not None and self.is_busy(session_id):
+                metrics.inc("sessions.evict_skipped_busy")
+                continue
+            metrics.inc("sessions.evicted")
+            self._remove(session_id, "despejada (orçamento de memória)")
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """
+        Remove as sessões vencidas
+
+        Só olha o topo do heap: entradas de sessões renovadas são reagendadas
+        para o prazo atual, e as de sessões já removidas são descartadas.
+
+        Returns:
+            Quantidade de sessões expiradas
+        """
+        now = time.time() if now is None else now
+        expired = 0
+        while self._expiry and self._expiry[0][0] <= now:
+            _, session_id = heapq.heappop(self._expiry)
+            last_seen = self._last_seen.get(session_id)
+            if last_seen is None:
+                continue  # já removida
+            deadline = last_seen + self.ttl_seconds
+            if deadline > now:
+                heapq.heappush(self._expiry, (deadline, session_id))
+                continue
+            self._remove(session_id, "expirada")
+            expired += 1
+        if expired:
+            metrics.inc("sessions.expired", expired)
+        return expired
+
+    def _update_gauges(self):
+        metrics.set_gauge("sessions.count", len(self._sessions))
+        metrics.set_gauge("sessions.approx_bytes", self._bytes)
+
+    def _ensure_sweeper(self):
+        """Inicia a varredura em segundo plano no loop atual (se ainda não estiver rodando)"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._sweeper is not None and not self._sweeper.done() and self._sweeper.get_loop() is loop:
+            return
+        self._sweeper = loop.create_task(self._sweep_loop())
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval_seconds)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Erro na varredura de sessões: {e}")
+
+    async def close(self):
+        """Para a varredura em segundo plano (desligamento)"""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except (asyncio.CancelledError, RuntimeError):
+                pass
+            self._sweeper = None
+
+
+def _history_factory() -> ConversationHistory:
+    settings = get_settings()
+    return ConversationHistory(
+        token_budget=settings.get('llm.history_token_budget', 1500),
+        keep_recent_turns=settings.get('llm.history_keep_recent_turns', 4),
+        max_turns=settings.get('sessions.max_history_turns', 20)
+    )
+
+
+def create_session_store(
+    on_remove: Optional[Callable[[str], None]] = None,
+    is_busy: Optional[Callable[[str], bool]] = None
+) -> SessionStore:
+    """SessionStore conforme a seção sessions das configurações"""
+    settings = get_settings()
+    return SessionStore(
+        ttl_seconds=settings.get('sessions.ttl_seconds', 180),
+        memory_budget_bytes=int(settings.get('sessions.memory_budget_mb', 64) * 1024 * 1024),
+        sweep_interval_seconds=settings.get('sessions.sweep_interval_seconds', 15),
+        history_factory=_history_factory,
+        on_remove=on_remove,
+        is_busy=is_busy
+    )
@@ -2,34 +2,37 @@ import datetime
 import json
 import os
 from dotenv import load_dotenv
-import google.generativeai as genai
 from loguru import logger
-import sys
 import time
-from typing import Dict, Optional, Any
+from typing import Awaitable, Callable, Dict, List, Optional, Any
 import asyncio
-import httpx
 from stella.messaging.publisher import publish
+from stella.agent.session_identity import session_identities
+from stella.agent.stock_cache import get_stock_cache, get_stock_snapshot, set_snapshot_interceptor
+from stella.agent.stock_context import get_stock_context_selector
+from stella.agent.conversation import ConversationHistory
+from stella.agent.product_index import ProductIndex, get_product_index
+from stella.agent.intent_classifier import get_local_responder
+from stella.agent.turn_log import log_turn
+from stella.agent.offline_parser import get_offline_parser, parse_withdraw
+from stella.agent.stock_query import answer_stock_query, is_stock_question
+from stella.agent.response_cache import get_response_cache, prompt_version, stock_fingerprint
+from stella.agent.json_stream import ResponseFieldStreamer
+from stella.agent.metrics import metrics
+from stella.agent.cart import WithdrawalCart, carts, is_cancellation, is_confirmation
+from stella.agent.session_store import create_session_store
+from stella.agent.session_concurrency import device_sessions, session_locks
+from stella.agent.session_backend import create_session_state_sync
+from stella.agent.structured_output import SchemaViolation, lenient_parse, parse_structured, repair_contents, response_schema
+from stella.agent.context_cache import configure_context_cache, get_context_cache
+from stella.agent.llm_client import AsyncLLMClient, PRIORITY_CONFIRM, PRIORITY_DEFAULT, PRIORITY_QUERY
+from stella.agent.llm_provider import build_model, create_llm_provider
+from stella.agent.cassette import configure_cassette, get_cassette
+from stella.config.settings import get_settings
 
 ENV_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '.env'))
 load_dotenv(dotenv_path=ENV_PATH)
 
-def require_gemini_env() -> str:
-    """Garante que a GEMINI_API_KEY exista; encerra o processo se faltar."""
-    api_key = os.environ.get("GEMINI_API_KEY")
-    if not api_key:
-        logger.error(
-            "GEMINI_API_KEY ausente. Defina no .env ({}) ou no ambiente e reinicie."
-            .format(ENV_PATH)
-        )
-        sys.exit(1)
-    logger.success("Variável de ambiente GEMINI_API_KEY carregada.")
-    return api_key
-
-api_key = require_gemini_env()
-
-genai.configure(api_key=api_key)
-
 MODEL_ID = 'gemini-2.5-flash'
 SYSTEM_INSTRUCTION = (
     "Você é Stella, uma assistente de almoxarifado dos laboratórios DASA. Sua função é ser "
@@ -52,37 +55,47 @@ SYSTEM_INSTRUCTION = (
     "Depois da confirmação deixe claro ao usuário que você confirmou a retirada. Exemplo de resposta: 'Retirada de x itens confirmada. Obrigada!'"
     "Após uma withdraw confirm, SOMENTE EM CASO em que o usuário peça para cancelar a última requisição, instrua ele a falar com o gerente de estoque"
 )
-model = genai.GenerativeModel(MODEL_ID, system_instruction=SYSTEM_INSTRUCTION)
-
-# Armazenamento simples em memória para sessões Gemini
-_SESSIONS: Dict[str, Any] = {}  # Any porque ChatSession não está em genai.types
-_LAST_SEEN: Dict[str, float] = {}
-_SESSION_TTL_SECONDS = 3 * 60  # 3 minutos
-ACTIVE_SESSION_ID: Optional[str] = None  # sessão ativa exclusiva
-
-def _gc_sessions():
-    """Coleta sessões inativas (TTL)."""
-    now = time.time()
-    expired = [sid for sid, ts in _LAST_SEEN.items() if now - ts > _SESSION_TTL_SECONDS]
-    for sid in expired:
-        _SESSIONS.pop(sid, None)
-        _LAST_SEEN.pop(sid, None)
-        logger.info(f"Sessão expirada e removida: {sid}")
-
-def get_or_create_session(session_id: str) -> Any:
-    """Retorna ou cria uma ChatSession por session_id."""
+# Saída estruturada: JSON puro validado por esquema derivado de StellaSpeechResponse
+GENERATION_CONFIG = (
+    {"response_mime_type": "application/json", "response_schema": response_schema()}
+    if get_settings().get('llm.structured_output', True) else None
+)
+# Provedor do LLM (llm.provider): Gemini ou substituto local para testes/carga
+llm_provider = create_llm_provider()
+model = build_model(llm_provider, MODEL_ID, SYSTEM_INSTRUCTION, GENERATION_CONFIG)
+PROMPT_VERSION = prompt_version(llm_provider.name, MODEL_ID, SYSTEM_INSTRUCTION, json.dumps(GENERATION_CONFIG, sort_keys=True))
+configure_context_cache(model, MODEL_ID, SYSTEM_INSTRUCTION, GENERATION_CONFIG, llm_provider)
+llm_client = AsyncLLMClient(
+    model,
+    max_concurrency=get_settings().get('llm.max_concurrency', 4),
+    max_queue=get_settings().get('llm.max_queue', 64)
+)
+# Cassete (cassette.mode): grava ou reproduz as chamadas ao LLM e as leituras do estoque
+cassette = configure_cassette()
+if cassette is not None:
+    llm_client.model_wrapper = cassette.wrap_model
+    set_snapshot_interceptor(cassette.intercept_stock)
+
+def _discard_session_state(session_id: str):
+    """Estado associado à sessão que sai junto com o histórico"""
+    # Cancela reconhecimento facial especulativo em andamento
+    session_identities.cancel(session_id)
+    carts.pop(session_id)
+    device_sessions.release(session_id)
+
+
+# Históricos compactos por sessão (TTL por heap, orçamento de memória com LRU)
+session_store = create_session_store(on_remove=_discard_session_state, is_busy=session_locks.is_held)
+# Estado compartilhado entre workers/reinícios (histórico + carrinho), conforme sessions.backend
+session_state = create_session_state_sync(session_store, carts)
+
+def get_or_create_session(session_id: str) -> ConversationHistory:
+    """Retorna ou cria o histórico de conversa por session_id."""
     if not session_id:
         raise ValueError("session_id é obrigatório para manter contexto.")
-    sess = _SESSIONS.get(session_id)
-    if sess is None:
-        sess = model.start_chat(history=[])
-        _SESSIONS[session_id] = sess
-        logger.info(f"Sessão criada: {session_id}")
-    _LAST_SEEN[session_id] = time.time()
-    _gc_sessions()
-    return sess
-
-def end_session(session_id: str) -> bool:
+    return session_store.get_or_create(session_id)
+
+async def end_session(session_id: str) -> bool:
     """
     Encerra uma sessão específica do Gemini
     
@@ -92,91 +105,104 @@ def end_session(session_id: str) -> bool:
     Returns:
         True se sessão foi encontrada e removida
     """
-    global _SESSIONS, _LAST_SEEN
-    
-    if session_id in _SESSIONS:
-        del _SESSIONS[session_id]
-        if session_id in _LAST_SEEN:
-            del _LAST_SEEN[session_id]
+    await session_state.delete(session_id)
+    if session_store.remove(session_id):
         logger.info(f"🗑️ Sessão Gemini encerrada: {session_id}")
         return True
     
+    # Sem histórico (ex: sessão só iniciada), mas pode haver identidade/carrinho pendentes
+    _discard_session_state(session_id)
     logger.warning(f"⚠️ Sessão não encontrada para encerrar: {session_id}")
     return False
 
-def switch_active_session(session_id: str):
-    """Garante sessão exclusiva: ao trocar de session_id, apaga histórico anterior."""
-    global ACTIVE_SESSION_ID
-    if ACTIVE_SESSION_ID and ACTIVE_SESSION_ID != session_id:
-        for sid in list(_SESSIONS.keys()):
-            if sid != session_id:
-                end_session(sid)
-        logger.info(f"Alternando sessão ativa de {ACTIVE_SESSION_ID} para {session_id}")
-    ACTIVE_SESSION_ID = session_id
+async def claim_device_session(session_id: str, device_id: Optional[str]):
+    """Exclusividade por quiosque: uma sessão nova no dispositivo encerra a anterior dele."""
+    if not device_id or not get_settings().get('sessions.exclusive_per_device', True):
+        return
+    previous = device_sessions.claim(device_id, session_id)
+    if previous is not None:
+        logger.info(f"Alternando sessão do dispositivo {device_id} de {previous} para {session_id}")
+        await end_session(previous)
+
 async def load_external_stock(base_url: Optional[str] = None) -> Dict[str, Any]:
     """
-    Busca estoque da API externa e retorna um dicionário indexado por nome normalizado.
-    Estrutura da API externa (GET /products):
-    [
-      {
-        "id": "string",
-        "name": "string",
-        "description": "string",
-        "quantity": 0,
-        "createdAt": "2025-09-24T04:12:55.092Z",
-        "updatedAt": "2025-09-24T04:12:55.093Z",
-        "categoryName": "string"
-      }
-    ]
+    Retorna o estoque da API externa indexado por nome normalizado.
+    
+    Usa o snapshot em cache (ver stella.agent.stock_cache): na maioria das
+    chamadas não há espera pela API de inventário.
     """
-    # Permite configurar via variável de ambiente INVENTORY_API_URL
-    base = (base_url or os.environ.get("INVENTORY_API_URL") or "http://localhost:8080").rstrip('/')
-    url = base + "/products"
-    try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            resp = await client.get(url)
-            resp.raise_for_status()
-            items = resp.json() or []
-            def _norm(s: str) -> str:
-                s = (s or "").strip().lower()
-                # normaliza espaços e separadores comuns
-                for ch in [" ", ",", ".", ";", ":", "/", "\\"]:
-                    s = s.replace(ch, "_")
-                while "__" in s:
-                    s = s.replace("__", "_")
-                return s.strip("_")
-            stock_map: Dict[str, Any] = {}
-            for it in items:
-                name = it.get("name") or ""
-                norm = _norm(name)
-                stock_map[norm] = {
-                    "id": it.get("id"),
-                    "name": name,
-                    "description": it.get("description"),
-                    "quantity": int(it.get("quantity", 0)),
-                    "createdAt": it.get("createdAt"),
-                    "updatedAt": it.get("updatedAt"),
-                    "categoryName": it.get("categoryName"),
-                }
-            return stock_map
-    except httpx.HTTPError as e:
-        logger.error(f"Erro ao consultar estoque externo: {e}")
-        return {}
-    except Exception as e:
-        logger.error(f"Erro inesperado ao consultar estoque externo: {e}")
-        return {}
+    snapshot = await get_stock_snapshot(base_url)
+    return snapshot.items
     
     
-async def publish_withdraw_confirm(session_id: str, items: list):
+def check_items_against_stock(items: list, external_stock: Dict[str, Any], index: ProductIndex) -> Dict[str, Any]:
+    """
+    Resolve os itens pedidos contra o estoque e separa disponíveis, insuficientes e não encontrados
+    
+    Args:
+        items: Itens no formato {'productName', 'quantity'}
+        external_stock: Estoque indexado por nome normalizado
+        index: Índice de nomes do snapshot atual
+        
+    Returns:
+        Dict com 'disponiveis', 'insuficientes', 'faltantes' e 'items' (productName trocado
+        pela chave do estoque quando o produto foi resolvido)
+    """
+    min_score = get_settings().get('inventory.name_match_min_score', 0.75)
+    faltantes = []
+    insuficientes = []
+    disponiveis = []
+    resolvidos = []
+    for it in items:
+        name = it.get("productName") or ""
+        qty = int(it.get("quantity", 0))
+        candidate = index.best(name, min_score)
+        if candidate is None:
+            sugestoes = index.resolve(name, limit=1)
+            if sugestoes:
+                faltantes.append(f"{name} (quis dizer {sugestoes[0].key}?)")
+            else:
+                faltantes.append(name)
+            resolvidos.append(it)
+            continue
+        
+        resolvidos.append({**it, "productName": candidate.key})
+        available = int(external_stock[candidate.key].get("quantity", 0))
+        detalhe = {
+            "name": candidate.key,
+            "requested": qty,
+            "available": available
+        }
+        if qty > available:
+            insuficientes.append(detalhe)
+        else:
+            disponiveis.append(detalhe)
+    
+    return {
+        "disponiveis": disponiveis,
+        "insuficientes": insuficientes,
+        "faltantes": faltantes,
+        "items": resolvidos,
+    }
+    
+async def publish_withdraw_confirm(session_id: str, items: list, withdraw_by: Optional[str] = None):
     """
     Publica confirmação de retirada no RabbitMQ de forma assíncrona
+    
+    Args:
+        session_id: ID da sessão
+        items: Itens confirmados
+        withdraw_by: Usuário identificado pelo reconhecimento facial (padrão: session_id)
     """
+    cassette = get_cassette()
+    if cassette is not None and cassette.replaying:
+        logger.info(f"📼 Reprodução de cassete: retirada não publicada | Sessão: {session_id} | {items}")
+        return
+    
     try:
-        
-        
         payload = {
             "itens": items,
-            "withdrawBy": session_id 
+            "withdrawBy": withdraw_by or session_id
         }
         
         logger.debug(f"Preparando para publicar confirmação de retirada | `{payload}`")
@@ -187,168 +213,529 @@ async def publish_withdraw_confirm(session_id: str, items: list):
     except Exception as e:
         logger.error(f"❌ Erro ao publicar confirmação: {e}")
 
-async def command_interpreter(comando: str, session_id: str):
-    switch_active_session(session_id)
-    sess = get_or_create_session(session_id)
-    # Carrega estoque da API externa
-    external_stock = await load_external_stock()
-    
-    # Formatar estoque de forma legível para a IA
-    estoque_formatado = ""
-    for norm_name, item in external_stock.items():
-        quantidade_atual = item.get('quantity', 0)
-        categoria = item.get('categoryName') or 'N/A'
-        estoque_formatado += (
-            f"\n• {norm_name}: {item.get('name')}\n"
-            f"- Quantidade atual: {quantidade_atual} unidade(s)\n"
-            f"- Categoria: {categoria}\n"
+async def validate_result(
+    resultado: Dict[str, Any],
+    session_id: str,
+    external_stock: Dict[str, Any],
+    product_index: ProductIndex
+) -> Dict[str, Any]:
+    """
+    Pós-validação comum a todas as origens de resposta (LLM ou interpretador offline)
+    
+    Confere pedidos de retirada contra o estoque e publica confirmações válidas.
+    """
+    # Fora do fluxo de retirada (dúvida, consulta, cancelamento) o carrinho pendente perde a validade
+    if carts.clear_unless_withdraw(session_id, resultado.get("intention")):
+        logger.info(f"🛒 Carrinho descartado ({resultado.get('intention')}) | Sessão: {session_id}")
+
+    if resultado.get("intention") == "withdraw_confirm":
+        cart = carts.get(session_id)
+        pedidos = resultado.get("items") or []
+        if cart is None:
+            # Só o carrinho validado pode ser publicado
+            resultado["intention"] = "doubt"
+            resultado["stella_analysis"] = "ambiguous"
+            resultado["items"] = []
+            resultado["response"] = "Não há retirada pendente para confirmar. O que você precisa retirar?"
+        elif pedidos and not cart.matches(check_items_against_stock(pedidos, external_stock, product_index)["items"]):
+            # Modelo confirmou itens diferentes do carrinho: vira edição e pede nova confirmação
+            logger.info(f"🛒 Confirmação com itens diferentes do carrinho, tratada como edição | Sessão: {session_id}")
+            resultado["intention"] = "withdraw_request"
+            resultado["stella_analysis"] = "ambiguous"
+            resultado["response"] = "Antes de publicar, confirme o pedido atualizado."
+        else:
+            await _publish_cart(resultado, session_id, cart, external_stock, product_index)
+
+    # Pré-validação para pedidos de retirada: informa disponibilidade antes da confirmação
+    if resultado.get("intention") == "withdraw_request":
+        pedidos = resultado.get("items", [])
+        if pedidos:
+            checagem = check_items_against_stock(pedidos, external_stock, product_index)
+            disponiveis = checagem["disponiveis"]
+            insuficientes = checagem["insuficientes"]
+            faltantes = checagem["faltantes"]
+            resultado["items"] = checagem["items"]
+            # Carrinho da sessão: só itens resolvidos e com estoque suficiente, confirmados localmente depois
+            carts.set(session_id, [
+                {"productName": d["name"], "quantity": d["requested"]} for d in disponiveis
+            ])
+
+            info_msgs = []
+            if disponiveis:
+                info_msgs.append(
+                    "Disponível: " + ", ".join([f"{d['name']} ({d['requested']}/{d['available']})" for d in disponiveis])
+                )
+            if insuficientes:
+                info_msgs.append(
+                    "Estoque insuficiente: " + ", ".join([f"{d['name']} (solicitado {d['requested']}, disponível {d['available']})" for d in insuficientes])
+                )
+            if faltantes:
+                info_msgs.append("Não encontrado(s): " + ", ".join(faltantes))
+
+            if info_msgs:
+                complemento = " | ".join(info_msgs)
+                resultado["stella_analysis"] = resultado.get("stella_analysis", "normal")
+                resultado["response"] = f"{resultado.get('response', '')} (Checagem de estoque: {complemento})".strip()
+    return resultado
+
+
+async def _publish_cart(
+    resultado: Dict[str, Any],
+    session_id: str,
+    cart: WithdrawalCart,
+    external_stock: Dict[str, Any],
+    product_index: ProductIndex
+):
+    """Revalida o carrinho contra o estoque atual e publica; revertido para 'doubt' se o estoque mudou"""
+    checagem = check_items_against_stock(cart.items, external_stock, product_index)
+    faltantes = checagem["faltantes"]
+    insuficientes = checagem["insuficientes"]
+    items_confirmados = checagem["items"]
+    resultado["items"] = items_confirmados
+
+    if faltantes or insuficientes:
+        # Não publica e orienta usuário
+        msg_parts = []
+        if faltantes:
+            msg_parts.append(f"Itens não encontrados: {', '.join(faltantes)}")
+        if insuficientes:
+            det = ", ".join([f"{d['name']} (solicitado {d['requested']}, disponível {d['available']})" for d in insuficientes])
+            msg_parts.append(f"Itens com estoque insuficiente: {det}")
+        resultado["intention"] = "doubt"
+        resultado["stella_analysis"] = "ambiguous"
+        resultado["response"] = (
+            "Não consegui confirmar a retirada. " + "; ".join(msg_parts) + 
+            ". Deseja ajustar a quantidade ou escolher outro item?"
         )
+        return
+
+    # Identidade normalmente já resolvida pelo reconhecimento especulativo
+    withdraw_by = await session_identities.resolve(
+        session_id,
+        timeout=get_settings().get('speculative_auth.resolve_timeout_seconds', 5)
+    )
+    await publish_withdraw_confirm(session_id, items_confirmados, withdraw_by)
+    carts.pop(session_id)
+    # Quantidades desses produtos mudaram: respostas em cache que os citam ficam inválidas
+    response_cache = get_response_cache()
+    if response_cache is not None:
+        response_cache.invalidate_products(it["productName"] for it in items_confirmados)
+    logger.info(f"📤 Publicação de confirmação iniciada | Sessão: {session_id}")
+
+
+# Confirmações podem ser revertidas pela pós-validação (ex: estoque insuficiente),
+# então o texto só vai para o quiosque no evento final
+NON_STREAMED_INTENTIONS = {"withdraw_confirm"}
+
+PartialCallback = Callable[[str], Awaitable[None]]
+
+
+def _split_partial(pending: str, min_chars: int) -> int:
+    """Posição de corte do texto pendente em fronteira de palavra (0 = ainda não envia)"""
+    if len(pending) < min_chars:
+        return 0
+    cut = max(pending.rfind(ch) for ch in (" ", ",", ".", "!", "?", "\n"))
+    return cut + 1 if cut >= 0 else 0
+
+
+async def generate_streaming(
+    contents: List[Dict[str, Any]],
+    on_partial: PartialCallback,
+    priority: int = PRIORITY_DEFAULT,
+    timeout: Optional[float] = None,
+    model: Any = None
+) -> str:
+    """
+    Consome o stream do Gemini e repassa o campo "response" em pedaços
     
-    prompt = f"""
-        Analise este comando: "{comando}"
+    Args:
+        contents: Histórico + prompt do turno
+        on_partial: Chamado com cada novo trecho do texto da resposta
+        priority: Prioridade na fila do LLM
+        timeout: Prazo total da requisição (fila + geração)
+        model: Modelo que referencia o cache de contexto (padrão: modelo global)
+        
+    Returns:
+        Texto completo gerado (para o parse final)
+    """
+    min_chars = get_settings().get('llm.stream_min_chunk_chars', 24)
+    streamer = ResponseFieldStreamer("response")
+    chunks: List[str] = []
+    pending = ""
+    started_at = time.perf_counter()
+    first_partial = True
+    
+    def _streamable() -> bool:
+        intention = streamer.fields.get("intention")
+        return intention is not None and intention not in NON_STREAMED_INTENTIONS
+    
+    async for item in llm_client.stream(contents, priority=priority, timeout=timeout, model=model):
+        chunks.append(item)
+        pending += streamer.feed(item)
+        if not _streamable():
+            continue
+        cut = _split_partial(pending, min_chars)
+        if cut:
+            if first_partial:
+                metrics.observe("llm.time_to_first_partial_ms", (time.perf_counter() - started_at) * 1000)
+                first_partial = False
+            await on_partial(pending[:cut])
+            pending = pending[cut:]
+    
+    if pending and _streamable():
+        await on_partial(pending)
+    return "".join(chunks)
 
-        ESTOQUE ATUAL:
-        {estoque_formatado}
-        """
+
+async def generate_validated(
+    contents: List[Dict[str, Any]],
+    priority: int = PRIORITY_DEFAULT,
+    timeout: Optional[float] = None,
+    on_partial: Optional[PartialCallback] = None,
+    model: Any = None
+) -> Dict[str, Any]:
+    """
+    Chama o LLM dentro do orçamento de latência e valida a resposta no esquema
+    
+    Se a primeira tentativa não responder até o atraso de hedge (percentil
+    recente da latência), uma tentativa paralela é disparada e a primeira
+    resposta válida vence. Violações do esquema em todas as tentativas disparam
+    reparos, até llm.schema_max_retries vezes, dentro do mesmo orçamento.
+    
+    Raises:
+        asyncio.TimeoutError: orçamento esgotado
+        ValueError: resposta inutilizável mesmo após os reparos
+    """
+    settings = get_settings()
+    max_retries = settings.get('llm.schema_max_retries', 1)
+    streaming = on_partial is not None and settings.get('llm.streaming_enabled', True)
+    hedge_enabled = settings.get('llm.hedge_enabled', True)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    started = time.perf_counter()
+    partial_sent = False
+    
+    def _remaining() -> Optional[float]:
+        return None if deadline is None else max(0.0, deadline - time.monotonic())
     
+    async def _track_partial(text: str):
+        nonlocal partial_sent
+        partial_sent = True
+        await on_partial(text)
+    
+    async def _attempt(n: int):
+        # Só a tentativa principal faz stream; hedges são respostas completas
+        if n == 0 and streaming:
+            raw = await generate_streaming(contents, _track_partial, priority, _remaining(), model)
+        else:
+            raw = await llm_client.generate(contents, priority=priority, timeout=_remaining(), model=model)
+        try:
+            return raw, parse_structured(raw), None
+        except SchemaViolation as violation:
+            return raw, None, violation
+    
+    raw_text = ""
+    metrics.inc("llm.turns")
     try:
-        # ✅ Usar asyncio.to_thread para operação síncrona do Gemini
-        response = await asyncio.to_thread(sess.send_message, prompt)
+        raw_text, resultado, violation = await llm_client.hedged(
+            _attempt,
+            is_valid=lambda attempt: attempt[1] is not None,
+            hedge_delay=AsyncLLMClient.hedge_delay(
+                percentile=settings.get('llm.hedge_percentile', 95),
+                min_samples=settings.get('llm.hedge_min_samples', 20),
+                default_seconds=settings.get('llm.hedge_default_delay_seconds', 3.0),
+                min_seconds=settings.get('llm.hedge_min_delay_seconds', 0.5)
+            ) if hedge_enabled else None,
+            timeout=timeout,
+            max_attempts=settings.get('llm.hedge_max_attempts', 2) if hedge_enabled else 1,
+            # Com texto parcial já enviado ao quiosque, não troca de resposta no meio
+            should_hedge=lambda: not partial_sent
+        )
+        if resultado is not None:
+            return resultado
+        
+        for attempt in range(max_retries):
+            metrics.inc("llm.schema_retries")
+            logger.warning(f"🔧 Resposta fora do esquema, pedindo reparo: {violation}")
+            raw_text = await llm_client.generate(
+                repair_contents(contents, raw_text, str(violation)),
+                priority=priority,
+                timeout=_remaining(),
+                model=model
+            )
+            try:
+                return parse_structured(raw_text)
+            except SchemaViolation as new_violation:
+                violation = new_violation
         
-        # Limpa a resposta
-        clean_text = response.text.strip()
-        if clean_text.startswith('```json'):
-            clean_text = clean_text[7:-3]
-        elif clean_text.startswith('```'):
-            clean_text = clean_text[3:-3]
+        # Reparos esgotados: aproveita o JSON se possível (valores inválidos viram not_understood)
+        logger.warning(f"Resposta fora do esquema após {max_retries} reparo(s): {violation}")
+        metrics.inc("llm.turns_failed")
+        return lenient_parse(raw_text)
+    except ValueError:
+        logger.error(f"Resposta do LLM inutilizável: {raw_text[:200]}")
+        raise
+    finally:
+        metrics.observe("llm.turn_ms", (time.perf_counter() - started) * 1000)
+        metrics.set_gauge(
+            "llm.failed_turn_rate",
+            metrics.counter("llm.turns_failed") / max(1, metrics.counter("llm.turns"))
+        )
 
-        logger.debug(f"Resposta limpa do Gemini: {clean_text}")
 
-        resultado = json.loads(clean_text)
-        
-        valid_intentions = ["withdraw_request", "withdraw_confirm", "doubt", "stock_query", "not_understood", "normal"]
-        valid_analyses = ["normal", "low_stock_alert", "critical_stock_alert", "outlier_withdraw_request", "ambiguous", "not_understood", "greeting", "farewell"]
+async def confirm_cart(session_id: str, external_stock: Dict[str, Any], product_index: ProductIndex) -> Optional[Dict[str, Any]]:
+    """
+    Confirma localmente o carrinho da sessão, sem ida ao LLM
+    
+    Returns:
+        Resultado validado (publicado, ou revertido para 'doubt' se o estoque mudou),
+        ou None se a sessão não tem carrinho
+    """
+    cart = carts.get(session_id)
+    if cart is None or not cart.items:
+        return None
+    resultado = {
+        "intention": "withdraw_confirm",
+        "items": list(cart.items),
+        "response": f"Retirada de {cart.describe(external_stock)} confirmada. Obrigada!",
+        "stella_analysis": "normal",
+        "reason": "Confirmação do carrinho pendente"
+    }
+    metrics.inc("cart.local_confirmations")
+    return await validate_result(resultado, session_id, external_stock, product_index)
+
+
+def cancel_cart(session_id: str) -> Dict[str, Any]:
+    """Descarta o carrinho pendente da sessão ("não", "pode cancelar")"""
+    carts.pop(session_id)
+    metrics.inc("cart.local_cancellations")
+    logger.info(f"🛒 Carrinho cancelado pelo usuário | Sessão: {session_id}")
+    return {
+        "intention": "normal",
+        "items": [],
+        "response": "Tudo bem, cancelei a retirada. Posso ajudar com outra coisa?",
+        "stella_analysis": "normal",
+        "reason": "Cancelamento do carrinho pendente"
+    }
+
+
+def is_complete_command(comando: str) -> bool:
+    """
+    A fala já é um comando completo? (usado para não esperar por mais fragmentos)
+
+    Confirmações, cancelamentos e pedidos simples que o interpretador offline
+    resolve sozinho contra o snapshot em memória (sem consultar a API).
+    """
+    if is_confirmation(comando) or is_cancellation(comando):
+        return True
+    try:
+        snapshot = get_stock_cache().snapshot
+    except Exception:
+        return False
+    if snapshot is None:
+        return False
+    parse = parse_withdraw(comando, get_product_index(snapshot), get_offline_parser().min_score)
+    return parse is not None and parse.simple
+
+
+def request_priority(comando: str, session_id: str) -> int:
+    """Prioridade na fila do LLM: continuações de retirada antes de consultas de estoque"""
+    if session_id in carts:
+        return PRIORITY_CONFIRM
+    if is_stock_question(comando):
+        return PRIORITY_QUERY
+    return PRIORITY_DEFAULT
+
+
+def processing_error_response() -> Dict[str, Any]:
+    return {
+        "intention": "not_understood",
+        "items": [],
+        "response": "Houve um erro no processamento. Pode repetir sua solicitação?",
+        "stella_analysis": "not_understood",
+        "processing_error": True  # não é reenviada a retries (ver idempotency)
+    }
+
+
+def is_processing_error(resultado: Any) -> bool:
+    """O turno terminou com a resposta de erro de processamento (LLM/inventário indisponível)"""
+    return isinstance(resultado, dict) and bool(resultado.get("processing_error"))
+
+
+async def command_interpreter(
+    comando: str,
+    session_id: str,
+    on_partial: Optional[PartialCallback] = None,
+    device_id: Optional[str] = None
+):
+    """
+    Interpreta a fala do usuário no contexto da sessão
+    
+    Turnos da mesma sessão são processados em ordem; sessões diferentes
+    (vários quiosques) seguem em paralelo.
+    
+    Args:
+        comando: Texto transcrito
+        session_id: ID da sessão
+        on_partial: Se informado (e llm.streaming_enabled), recebe o texto da resposta
+            em pedaços enquanto o Gemini gera; o resultado final validado é o retorno
+        device_id: Quiosque de origem (exclusividade de sessão por dispositivo)
+    """
+    await claim_device_session(session_id, device_id)
+    async with session_locks.hold(session_id):
+        started = time.perf_counter()
+        # Turno anterior pode ter sido atendido por outro worker; o lock do backend
+        # impede que dois workers gravem versões diferentes da mesma sessão
+        async with session_state.locked(session_id):
+            await session_state.restore(session_id)
+            try:
+                resultado = await _interpret(comando, session_id, on_partial)
+            finally:
+                await session_state.persist(session_id)
         
-        if resultado.get("intention") not in valid_intentions:
-            logger.warning(f"IA retornou intention inválida: {resultado.get('intention')}")
-            resultado["intention"] = "not_understood"
+        cassette = get_cassette()
+        if cassette is not None and cassette.recording:
+            cassette.record_turn(session_id, comando, resultado, (time.perf_counter() - started) * 1000)
+        return resultado
+
+
+async def _interpret(comando: str, session_id: str, on_partial: Optional[PartialCallback] = None):
+    """Turno de command_interpreter (com o lock da sessão)"""
+    sess = get_or_create_session(session_id)
+    
+    # "Não, pode cancelar" com carrinho pendente: descarta o carrinho, sem LLM
+    if session_id in carts and is_cancellation(comando):
+        resultado = cancel_cart(session_id)
+        sess.add_exchange(comando, resultado)
+        return resultado
+    
+    # "Sim, confirmo" com carrinho pendente: publica o carrinho já validado, sem LLM
+    if session_id in carts and is_confirmation(comando):
+        snapshot = await get_stock_snapshot()
+        resultado = await confirm_cart(session_id, snapshot.items, get_product_index(snapshot))
+        if resultado is not None:
+            logger.info(f"🛒 Carrinho confirmado localmente | Sessão: {session_id}")
+            sess.add_exchange(comando, resultado)
+            return resultado
+    
+    # Turnos triviais (saudação, despedida) respondidos localmente, sem ida ao LLM
+    local_responder = get_local_responder()
+    if local_responder is not None:
+        resposta_local = local_responder.respond(comando)
+        if resposta_local is not None:
+            carts.clear_unless_withdraw(session_id, resposta_local.get("intention"))
+            sess.add_exchange(comando, resposta_local)
+            return resposta_local
+    
+    # Carrega estoque da API externa (snapshot em cache)
+    snapshot = await get_stock_snapshot()
+    external_stock = snapshot.items
+    product_index = get_product_index(snapshot)
+    offline_parser = get_offline_parser()
+    
+    # Consultas de estoque reconhecidas são respondidas direto do snapshot
+    resposta_estoque = answer_stock_query(snapshot, comando)
+    if resposta_estoque is not None:
+        logger.info(f"⚡ Consulta de estoque respondida localmente | Sessão: {session_id}")
+        carts.clear_unless_withdraw(session_id, resposta_estoque.get("intention"))
+        sess.add_exchange(comando, resposta_estoque)
+        return resposta_estoque
+    
+    # Pedidos de retirada simples e sem ambiguidade podem dispensar o LLM
+    if offline_parser.fast_path:
+        resultado = offline_parser.interpret(comando, product_index, external_stock, require_simple=True)
+        if resultado is not None:
+            logger.info(f"⚡ Pedido interpretado offline (caminho rápido) | Sessão: {session_id}")
+            resultado = await validate_result(resultado, session_id, external_stock, product_index)
+            sess.add_exchange(comando, resultado)
+            return resultado
+    
+    # Apenas os produtos relevantes para a fala e para os itens pendentes da sessão
+    stock_context = get_stock_context_selector().select(
+        external_stock,
+        comando,
+        pending=carts.pending_names(session_id),
+        version=snapshot.version
+    )
+    estoque_formatado = stock_context.text
+    logger.debug(
+        f"Estoque no prompt: {len(stock_context.items)}/{len(external_stock)} itens | "
+        f"~{stock_context.tokens_sent}/{stock_context.tokens_full} tokens"
+    )
+    
+    # Com cache de contexto, o catálogo completo já está no prefixo em cache
+    context_cache = get_context_cache()
+    cached_context = await context_cache.get(snapshot) if context_cache is not None else None
+    if cached_context is not None:
+        prompt = f"""
+        Analise este comando: "{comando}"
+
+        (Use o ESTOQUE ATUAL versão {cached_context.version}, já fornecido no contexto.)
+        """
+    else:
+        prompt = f"""
+        Analise este comando: "{comando}"
+
+        ESTOQUE ATUAL:
+        {estoque_formatado}
+        """
+    
+    # Com carrinho pendente, a fala é uma edição: o modelo parte do carrinho atual
+    cart = carts.get(session_id)
+    if cart is not None:
+        prompt += f"""
+        CARRINHO PENDENTE (aguardando confirmação): {json.dumps(cart.items, ensure_ascii=False)}
+        Se o usuário alterar o pedido, responda withdraw_request com o carrinho completo atualizado.
+        """
+    
+    # Turnos repetíveis vêm do cache; com retirada pendente a fala depende do contexto
+    response_cache = get_response_cache() if session_id not in carts else None
+    cache_key = None
+    resultado = None
+    if response_cache is not None:
+        cache_key = response_cache.make_key(comando, stock_fingerprint(stock_context.items), PROMPT_VERSION)
+        resultado = response_cache.get(cache_key)
+        if resultado is not None:
+            logger.info(f"♻️ Resposta reaproveitada do cache | Sessão: {session_id}")
+    
+    if resultado is None:
+        try:
+            # Histórico compacto + prompt do turno (o estoque vai apenas uma vez, no turno atual)
+            contents = sess.build_contents(prompt)
             
-        if resultado.get("stella_analysis") not in valid_analyses:
-            logger.warning(f"IA retornou stella_analysis inválida: {resultado.get('stella_analysis')}")
-            resultado["stella_analysis"] = "not_understood"
+            # Prazo total (fila + geração) e prioridade na fila compartilhada do LLM
+            timeout = get_settings().get('llm.request_timeout_seconds', 15)
+            priority = request_priority(comando, session_id)
+            resultado = await generate_validated(
+                contents,
+                priority,
+                timeout,
+                on_partial,
+                model=cached_context.model if cached_context is not None else None
+            )
             
-        # Pré-validação para pedidos de retirada: informa disponibilidade antes da confirmação
-        if resultado.get("intention") == "withdraw_request":
-            pedidos = resultado.get("items", [])
-            if pedidos:
-                def _norm(s: str) -> str:
-                    s = (s or "").strip().lower()
-                    for ch in [" ", ",", ".", ";", ":", "/", "\\"]:
-                        s = s.replace(ch, "_")
-                    while "__" in s:
-                        s = s.replace("__", "_")
-                    return s.strip("_")
-
-                faltantes = []
-                insuficientes = []
-                disponiveis = []
-                for it in pedidos:
-                    name = it.get("productName") or ""
-                    qty = int(it.get("quantity", 0))
-                    norm = _norm(name)
-                    stock_item = external_stock.get(norm)
-                    if not stock_item:
-                        faltantes.append(name)
-                        continue
-                    available = int(stock_item.get("quantity", 0))
-                    if qty > available:
-                        insuficientes.append({
-                            "name": name,
-                            "requested": qty,
-                            "available": available
-                        })
-                    else:
-                        disponiveis.append({
-                            "name": name,
-                            "requested": qty,
-                            "available": available
-                        })
-
-                info_msgs = []
-                if disponiveis:
-                    info_msgs.append(
-                        "Disponível: " + ", ".join([f"{d['name']} ({d['requested']}/{d['available']})" for d in disponiveis])
-                    )
-                if insuficientes:
-                    info_msgs.append(
-                        "Estoque insuficiente: " + ", ".join([f"{d['name']} (solicitado {d['requested']}, disponível {d['available']})" for d in insuficientes])
-                    )
-                if faltantes:
-                    info_msgs.append("Não encontrado(s): " + ", ".join(faltantes))
-
-                if info_msgs:
-                    complemento = " | ".join(info_msgs)
-                    resultado["stella_analysis"] = resultado.get("stella_analysis", "normal")
-                    resultado["response"] = f"{resultado.get('response', '')} (Checagem de estoque: {complemento})".strip()
-
-        if resultado.get("intention") == "withdraw_confirm":
-            items_confirmados = resultado.get("items", [])
-            if items_confirmados:
-                # valida itens contra estoque externo
-                def _norm(s: str) -> str:
-                    s = (s or "").strip().lower()
-                    for ch in [" ", ",", ".", ";", ":", "/", "\\"]:
-                        s = s.replace(ch, "_")
-                    while "__" in s:
-                        s = s.replace("__", "_")
-                    return s.strip("_")
-
-                faltantes = []
-                insuficientes = []
-                for it in items_confirmados:
-                    name = it.get("productName") or ""
-                    qty = int(it.get("quantity", 0))
-                    norm = _norm(name)
-                    stock_item = external_stock.get(norm)
-                    if not stock_item:
-                        faltantes.append(name)
-                        continue
-                    if qty > int(stock_item.get("quantity", 0)):
-                        insuficientes.append({
-                            "name": name,
-                            "requested": qty,
-                            "available": int(stock_item.get("quantity", 0))
-                        })
-
-                if faltantes or insuficientes:
-                    # Não publica e orienta usuário
-                    msg_parts = []
-                    if faltantes:
-                        msg_parts.append(f"Itens não encontrados: {', '.join(faltantes)}")
-                    if insuficientes:
-                        det = ", ".join([f"{d['name']} (solicitado {d['requested']}, disponível {d['available']})" for d in insuficientes])
-                        msg_parts.append(f"Itens com estoque insuficiente: {det}")
-                    resultado["intention"] = "doubt"
-                    resultado["stella_analysis"] = "ambiguous"
-                    resultado["response"] = (
-                        "Não consegui confirmar a retirada. " + "; ".join(msg_parts) + 
-                        ". Deseja ajustar a quantidade ou escolher outro item?"
-                    )
-                else:
-                    await publish_withdraw_confirm(session_id, items_confirmados)
-                    logger.info(f"📤 Publicação de confirmação iniciada | Sessão: {session_id}")
+            # Base de treino do classificador local (interpretação original do LLM)
+            log_turn(comando, resultado)
+            if response_cache is not None:
+                response_cache.put(cache_key, resultado, stock_context.items)
+            
+        except Exception as e:
+            logger.error(f"Erro ao interpretar (sessão {session_id}): {e!r}")
+            # LLM indisponível: pedidos de retirada seguem pelo interpretador offline
+            resultado = offline_parser.interpret(comando, product_index, external_stock)
+            if resultado is None:
+                return processing_error_response()
+            logger.warning(f"🔌 LLM indisponível, pedido interpretado offline | Sessão: {session_id}")
+    
+    try:
+        resultado = await validate_result(resultado, session_id, external_stock, product_index)
+        sess.add_exchange(comando, resultado)
         
         logger.success(f"SessionID: {session_id} - Comando interpretado: {resultado.get('intention', 'N/A')}")
         return resultado
         
     except Exception as e:
-        logger.error(f"Erro ao interpretar (sessão {session_id}): {e}")
-        return {
-            "intention": "not_understood",
-            "items": [],
-            "response": "Houve um erro no processamento. Pode repetir sua solicitação?",
-            "stella_analysis": "not_understood"
-        }
+        logger.error(f"Erro ao validar resposta (sessão {session_id}): {e}")
+        return processing_error_response()
 
 if __name__ == "__main__":
     """
@@ -400,18 +787,20 @@ if __name__ == "__main__":
             elif comando == "/session":
                 sess = get_or_create_session(current_session_id)
                 print(f"📊 Sessão: {current_session_id}")
-                print(f"📝 Mensagens na sessão: {len(sess.history) if hasattr(sess, 'history') else 'N/A'}")
-                print(f"⏰ Último acesso: {_LAST_SEEN.get(current_session_id, 'N/A')}")
+                print(f"📝 Mensagens na sessão: {len(sess)} (~{sess.estimated_tokens()} tokens)")
+                print(f"⏰ Último acesso: {session_store.last_seen(current_session_id) or 'N/A'}")
                 print()
                 continue
                 
             elif comando == "/history":
                 sess = get_or_create_session(current_session_id)
-                if hasattr(sess, 'history') and sess.history:
+                if sess.turns or sess.summary:
                     print("📜 Histórico da conversa:")
-                    for i, msg in enumerate(sess.history):
-                        role = "👤 Você" if msg.role == "user" else "🤖 Stella"
-                        content = msg.parts[0].text[:100] + "..." if len(msg.parts[0].text) > 100 else msg.parts[0].text
+                    if sess.summary:
+                        print(f"  Resumo: {sess.summary}")
+                    for i, msg in enumerate(sess.turns):
+                        role = "👤 Você" if msg["role"] == "user" else "🤖 Stella"
+                        content = msg["text"][:100] + "..." if len(msg["text"]) > 100 else msg["text"]
                         print(f"  {i+1}. {role}: {content}")
                 else:
                     print("📜 Nenhum histórico ainda.")
@@ -419,7 +808,7 @@ if __name__ == "__main__":
                 continue
                 
             elif comando == "/clear":
-                if end_session(current_session_id):
+                if asyncio.run(end_session(current_session_id)):
                     print(f"🗑️ Histórico da sessão {current_session_id} limpo.")
                     # Cria nova sessão
                     current_session_id = str(uuid.uuid4())[:8]
@@ -439,7 +828,7 @@ if __name__ == "__main__":
             print("🤖 Stella está pensando...")
             
             start_time = time.time()
-            resultado = command_interpreter(comando, current_session_id)
+            resultado = asyncio.run(command_interpreter(comando, current_session_id))
             end_time = time.time()
             
             # Mostra resultado
@@ -0,0 +1,249 @@
+"""
+Cache em memória do snapshot de estoque da API externa
+
+Evita que cada comando espere pela API de inventário:
+- snapshot reaproveitado durante `cache_ttl_seconds`
+- depois disso, o snapshot antigo continua sendo servido (até `stale_ttl_seconds`)
+  enquanto uma atualização roda em background (stale-while-revalidate)
+- requisições condicionais com ETag/If-Modified-Since
+- versão do snapshot derivada do hash do conteúdo
+- um único httpx.AsyncClient com keep-alive para todo o processo
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional
+import httpx
+from loguru import logger
+from stella.config.settings import get_settings
+
+
+def normalize_product_name(s: str) -> str:
+    """Normaliza nome de produto para chave do estoque (ex: 'Seringa 10ml' -> 'seringa_10ml')"""
+    s = (s or "").strip().lower()
+    # normaliza espaços e separadores comuns
+    for ch in [" ", ",", ".", ";", ":", "/", "\\"]:
+        s = s.replace(ch, "_")
+    while "__" in s:
+        s = s.replace("__", "_")
+    return s.strip("_")
+
+
+@dataclass
+class StockSnapshot:
+    """Estoque indexado por nome normalizado, com metadados de versão"""
+    items: Dict[str, Any] = field(default_factory=dict)
+    version: str = ""
+    fetched_at: float = 0.0
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    def age(self) -> float:
+        return time.time() - self.fetched_at
+
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Cliente HTTP compartilhado com pool de conexões keep-alive"""
+    global _client
+    if _client is None or _client.is_closed:
+        settings = get_settings()
+        _client = httpx.AsyncClient(
+            timeout=settings.get('inventory.request_timeout_seconds', 10.0),
+            limits=httpx.Limits(
+                max_connections=settings.get('inventory.max_connections', 10),
+                max_keepalive_connections=settings.get('inventory.max_connections', 10),
+                keepalive_expiry=settings.get('inventory.keepalive_expiry_seconds', 30.0)
+            )
+        )
+    return _client
+
+
+async def close_http_client():
+    """Fecha o cliente HTTP compartilhado"""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+
+class StockCache:
+    """Cache do snapshot de estoque de uma API de inventário"""
+
+    def __init__(self, base_url: str, ttl_seconds: float = 30, stale_ttl_seconds: float = 300):
+        self.base_url = base_url.rstrip('/')
+        self.ttl_seconds = ttl_seconds
+        self.stale_ttl_seconds = stale_ttl_seconds
+        self._snapshot: Optional[StockSnapshot] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+        # Métricas simples
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    @property
+    def snapshot(self) -> Optional[StockSnapshot]:
+        return self._snapshot
+
+    async def get(self) -> StockSnapshot:
+        """
+        Retorna o snapshot atual, esperando pela API apenas quando não há
+        snapshot utilizável em memória
+        """
+        snap = self._snapshot
+        if snap is not None:
+            age = snap.age()
+            if age <= self.ttl_seconds:
+                self.hits += 1
+                return snap
+            if age <= self.stale_ttl_seconds:
+                self.stale_hits += 1
+                self._schedule_refresh()
+                return snap
+
+        self.misses += 1
+        return await self.refresh()
+
+    async def refresh(self) -> StockSnapshot:
+        """Atualiza o snapshot (requisições simultâneas compartilham a mesma busca)"""
+        task = self._schedule_refresh()
+        return await asyncio.shield(task)
+
+    def invalidate(self):
+        """Força nova busca na próxima leitura (mantém ETag para requisição condicional)"""
+        if self._snapshot is not None:
+            self._snapshot.fetched_at = 0.0
+
+    def _schedule_refresh(self) -> asyncio.Task:
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.get_running_loop().create_task(self._fetch())
+        return self._refresh_task
+
+    async def _fetch(self) -> StockSnapshot:
+        """
+        Busca o estoque da API externa (GET /products).
+        Estrutura da API externa:
+        [
+          {
+            "id": "string",
+            "name": "string",
+            "description": "string",
+            "quantity": 0,
+            "createdAt": "2025-09-24T04:12:55.092Z",
+            "updatedAt": "2025-09-24T04:12:55.093Z",
+            "categoryName": "string"
+          }
+        ]
+        """
+        url = self.base_url + "/products"
+        previous = self._snapshot
+        headers = {}
+        if previous is not None:
+            if previous.etag:
+                headers["If-None-Match"] = previous.etag
+            if previous.last_modified:
+                headers["If-Modified-Since"] = previous.last_modified
+
+        try:
+            resp = await get_http_client().get(url, headers=headers)
+            if resp.status_code == 304 and previous is not None:
+                self.not_modified += 1
+                previous.fetched_at = time.time()
+                logger.debug(f"Estoque inalterado (304) | versão {previous.version}")
+                return previous
+
+            resp.raise_for_status()
+            items = resp.json() or []
+            stock_map: Dict[str, Any] = {}
+            for it in items:
+                name = it.get("name") or ""
+                norm = normalize_product_name(name)
+                stock_map[norm] = {
+                    "id": it.get("id"),
+                    "name": name,
+                    "description": it.get("description"),
+                    "quantity": int(it.get("quantity", 0)),
+                    "createdAt": it.get("createdAt"),
+                    "updatedAt": it.get("updatedAt"),
+                    "categoryName": it.get("categoryName"),
+                }
+
+            version = hashlib.sha1(
+                json.dumps(stock_map, sort_keys=True, ensure_ascii=False).encode("utf-8")
+            ).hexdigest()[:12]
+            if previous is not None and previous.version == version:
+                # Conteúdo igual: mantém o mesmo objeto (índices derivados continuam válidos)
+                previous.fetched_at = time.time()
+                previous.etag = resp.headers.get("ETag") or previous.etag
+                previous.last_modified = resp.headers.get("Last-Modified") or previous.last_modified
+                return previous
+
+            self._snapshot = StockSnapshot(
+                items=stock_map,
+                version=version,
+                fetched_at=time.time(),
+                etag=resp.headers.get("ETag"),
+                last_modified=resp.headers.get("Last-Modified"),
+            )
+            logger.info(f"📦 Snapshot de estoque atualizado | {len(stock_map)} itens | versão {version}")
+            return self._snapshot
+
+        except httpx.HTTPError as e:
+            logger.error(f"Erro ao consultar estoque externo: {e}")
+        except Exception as e:
+            logger.error(f"Erro inesperado ao consultar estoque externo: {e}")
+
+        # Em caso de falha, segue com o último snapshot conhecido
+        if previous is not None:
+            logger.warning(f"Usando snapshot de estoque anterior (versão {previous.version})")
+            return previous
+        return StockSnapshot(fetched_at=0.0)
+
+
+_caches: Dict[str, StockCache] = {}
+
+
+def get_stock_cache(base_url: Optional[str] = None) -> StockCache:
+    """Retorna o cache de estoque da API (um por URL base)"""
+    settings = get_settings()
+    # Permite configurar via variável de ambiente INVENTORY_API_URL
+    base = (
+        base_url
+        or os.environ.get("INVENTORY_API_URL")
+        or settings.get('inventory.api_url')
+        or "http://localhost:8080"
+    ).rstrip('/')
+    cache = _caches.get(base)
+    if cache is None:
+        cache = StockCache(
+            base,
+            ttl_seconds=settings.get('inventory.cache_ttl_seconds', 30),
+            stale_ttl_seconds=settings.get('inventory.stale_ttl_seconds', 300)
+        )
+        _caches[base] = cache
+    return cache
+
+
+# Intercepta as leituras do snapshot (ex: gravação/reprodução de cassetes); recebe a leitura real
+SnapshotInterceptor = Callable[[Callable[[], Awaitable[StockSnapshot]]], Awaitable[StockSnapshot]]
+_interceptor: Optional[SnapshotInterceptor] = None
+
+
+def set_snapshot_interceptor(interceptor: Optional[SnapshotInterceptor]):
+    global _interceptor
+    _interceptor = interceptor
+
+
+async def get_stock_snapshot(base_url: Optional[str] = None) -> StockSnapshot:
+    """Atalho para o snapshot atual do estoque"""
+    fetch = get_stock_cache(base_url).get
+    if _interceptor is not None:
+        return await _interceptor(fetch)
+    return await fetch()
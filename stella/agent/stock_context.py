@@ -0,0 +1,194 @@
+"""
+Seleção do estoque relevante para o prompt do LLM
+
+Em vez de colar o inventário inteiro em todo prompt, escolhe só os produtos
+relacionados à fala e aos itens pendentes da sessão (casamento léxico/aproximado
+em nomes normalizados, categorias e apelidos). Catálogos pequenos, ou falas sem
+nenhum produto reconhecível, recebem o catálogo completo.
+
+Os tokens do catálogo ficam num índice invertido de n-gramas, montado uma vez
+por versão do snapshot: cada fala só é comparada com os tokens que compartilham
+n-gramas com ela, e não com todo o catálogo.
+"""
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from loguru import logger
+from stella.agent.metrics import metrics
+from stella.agent.text_utils import char_ngrams, estimate_tokens, tokenize
+from stella.config.settings import get_settings
+
+
+def format_stock_for_prompt(stock: Dict[str, Any]) -> str:
+    """Formata o estoque de forma legível para a IA"""
+    estoque_formatado = ""
+    for norm_name, item in stock.items():
+        quantidade_atual = item.get('quantity', 0)
+        categoria = item.get('categoryName') or 'N/A'
+        estoque_formatado += (
+            f"\n• {norm_name}: {item.get('name')}\n"
+            f"- Quantidade atual: {quantidade_atual} unidade(s)\n"
+            f"- Categoria: {categoria}\n"
+        )
+    return estoque_formatado
+
+
+@dataclass
+class StockContext:
+    """Estoque escolhido para o prompt e métricas da seleção"""
+    items: Dict[str, Any]
+    text: str
+    full_catalog: bool
+    tokens_full: int
+    tokens_sent: int
+
+
+class StockContextSelector:
+    """Recorte do estoque por relevância, com índice de tokens pré-computado por versão do snapshot"""
+
+    def __init__(
+        self,
+        top_k: int = 25,
+        min_score: float = 0.5,
+        full_catalog_fallback: bool = True,
+        aliases: Optional[Dict[str, List[str]]] = None
+    ):
+        self.top_k = top_k
+        self.min_score = min_score
+        self.full_catalog_fallback = full_catalog_fallback
+        self.aliases = aliases or {}
+        self._version: Optional[str] = None
+        self._token_products: Dict[str, List[str]] = {}
+        self._ngram_postings: Dict[str, List[str]] = {}
+        self._ngram_sizes: Dict[str, int] = {}
+        self._full_text = ""
+
+    def _prepare(self, stock: Dict[str, Any], version: Optional[str]):
+        """Indexa os tokens do catálogo uma vez por versão do snapshot"""
+        if version is not None and version == self._version:
+            return
+        token_products: Dict[str, List[str]] = {}
+        for norm_name, item in stock.items():
+            text = " ".join([
+                norm_name,
+                item.get("name") or "",
+                item.get("categoryName") or "",
+                " ".join(self.aliases.get(norm_name, [])),
+            ])
+            for token in set(tokenize(text)):
+                token_products.setdefault(token, []).append(norm_name)
+
+        ngram_postings: Dict[str, List[str]] = {}
+        ngram_sizes: Dict[str, int] = {}
+        for token in token_products:
+            grams = char_ngrams(token)
+            ngram_sizes[token] = len(grams)
+            for gram in grams:
+                ngram_postings.setdefault(gram, []).append(token)
+
+        self._token_products = token_products
+        self._ngram_postings = ngram_postings
+        self._ngram_sizes = ngram_sizes
+        self._full_text = format_stock_for_prompt(stock)
+        self._version = version
+
+    def _similar_tokens(self, query_token: str) -> List[Tuple[str, float]]:
+        """Tokens do catálogo com similaridade de n-gramas >= min_score (só os que compartilham n-gramas)"""
+        grams = char_ngrams(query_token)
+        shared: Counter = Counter()
+        for gram in grams:
+            shared.update(self._ngram_postings.get(gram, ()))
+
+        similar = []
+        for token, common in shared.items():
+            # Jaccard entre os n-gramas (1.0 para o token idêntico)
+            similarity = common / (len(grams) + self._ngram_sizes[token] - common)
+            if similarity >= self.min_score:
+                similar.append((token, similarity))
+        return similar
+
+    def _score(self, query_tokens: List[str]) -> Dict[str, float]:
+        """Score por produto: soma, por token da fala, da melhor similaridade com os tokens do produto"""
+        scores: Dict[str, float] = {}
+        for query_token in query_tokens:
+            best: Dict[str, float] = {}
+            for token, similarity in self._similar_tokens(query_token):
+                for norm_name in self._token_products[token]:
+                    if similarity > best.get(norm_name, 0.0):
+                        best[norm_name] = similarity
+            for norm_name, similarity in best.items():
+                scores[norm_name] = scores.get(norm_name, 0.0) + similarity
+        return scores
+
+    def select(
+        self,
+        stock: Dict[str, Any],
+        utterance: str,
+        pending: Iterable[str] = (),
+        version: Optional[str] = None
+    ) -> StockContext:
+        """
+        Escolhe os produtos relevantes para a fala
+
+        Args:
+            stock: Estoque indexado por nome normalizado
+            utterance: Fala do usuário
+            pending: Nomes normalizados de itens pendentes na sessão (sempre incluídos)
+            version: Versão do snapshot (para reaproveitar o índice do catálogo)
+
+        Returns:
+            StockContext com o recorte e a contagem de tokens antes/depois
+        """
+        self._prepare(stock, version)
+        full_text = self._full_text if version is not None else format_stock_for_prompt(stock)
+        tokens_full = estimate_tokens(full_text)
+
+        def _full() -> StockContext:
+            return StockContext(stock, full_text, True, tokens_full, tokens_full)
+
+        if len(stock) <= self.top_k:
+            return self._record(_full())
+
+        query_tokens = [t for t in tokenize(utterance, drop_stopwords=True) if not t.isdigit()]
+        scored = [(score, norm_name) for norm_name, score in self._score(query_tokens).items() if score > 0]
+
+        pending_names = [name for name in pending if name in stock]
+        if not scored and not pending_names:
+            if self.full_catalog_fallback:
+                logger.debug("Nenhum produto relevante na fala, enviando catálogo completo")
+                return self._record(_full())
+            return self._record(StockContext({}, "", False, tokens_full, 0))
+
+        scored.sort(key=lambda x: (-x[0], x[1]))
+        selected: Dict[str, Any] = {name: stock[name] for name in pending_names}
+        for _, norm_name in scored:
+            if len(selected) >= self.top_k:
+                break
+            selected.setdefault(norm_name, stock[norm_name])
+
+        text = format_stock_for_prompt(selected)
+        return self._record(StockContext(selected, text, False, tokens_full, estimate_tokens(text)))
+
+    @staticmethod
+    def _record(context: StockContext) -> StockContext:
+        metrics.observe("prompt.stock_tokens_full", context.tokens_full)
+        metrics.observe("prompt.stock_tokens_sent", context.tokens_sent)
+        metrics.inc("prompt.stock_full_catalog" if context.full_catalog else "prompt.stock_filtered")
+        return context
+
+
+_selector: Optional[StockContextSelector] = None
+
+
+def get_stock_context_selector() -> StockContextSelector:
+    """Seletor compartilhado, configurado pela seção llm do stella_config.yaml"""
+    global _selector
+    if _selector is None:
+        settings = get_settings()
+        _selector = StockContextSelector(
+            top_k=settings.get('llm.stock_context_top_k', 25),
+            min_score=settings.get('llm.stock_context_min_score', 0.5),
+            full_catalog_fallback=settings.get('llm.stock_context_full_fallback', True),
+            aliases=settings.get('llm.stock_aliases', {}) or {}
+        )
+    return _selector
@@ -0,0 +1,296 @@
+"""
+Respostas locais para consultas de estoque (stock_query)
+
+Perguntas como "quantas máscaras temos?", "o que tem de EPI?" ou "o que está
+acabando?" só dependem do snapshot de estoque. Este módulo mantém, por versão
+do snapshot, índices por nome, por categoria e de itens abaixo do mínimo, e
+responde essas perguntas com templates em português, sinalizando nível baixo
+ou crítico a partir de quantidade_minima/quantidade_critica (stella/data/stock.json).
+
+Consultas que não casam com nenhum padrão, ou que casam com produtos demais,
+seguem para o LLM.
+"""
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+from loguru import logger
+from stella.agent.metrics import metrics
+from stella.agent.product_index import ProductIndex, canonical_name, get_product_index
+from stella.agent.stock_cache import StockSnapshot, normalize_product_name
+from stella.agent.text_utils import singularize, tokenize
+from stella.config.settings import get_settings
+
+DEFAULT_THRESHOLDS_PATH = Path(__file__).parent.parent / "data" / "stock.json"
+
+
+def _forms(*words: str) -> Set[str]:
+    return {singularize(w) for w in words}
+
+
+QUERY_MARKERS = _forms(
+    "quanto", "quantos", "quantas", "tem", "temos", "ha", "existe", "existem", "sobrou",
+    "sobrando", "resta", "restam", "disponivel", "disponiveis", "estoque", "saldo", "quais",
+)
+LOW_STOCK_MARKERS = _forms(
+    "acabando", "baixo", "baixos", "baixa", "minimo", "critico", "criticos", "critica",
+    "faltando", "repor", "reposicao",
+)
+WITHDRAW_MARKERS = _forms("retirar", "tirar", "pegar", "separa", "separe", "confirmo", "confirma")
+FILLERS = _forms(
+    "o", "que", "qual", "item", "itens", "produto", "produtos", "categoria", "ainda", "hoje",
+    "agora", "aqui", "almoxarifado", "saber", "pode", "dizer", "quantidade", "sabe", "ta",
+    "esta", "estao", "tudo", "nivel", "abaixo", "stella", "temos", "tem",
+) | QUERY_MARKERS | LOW_STOCK_MARKERS
+
+
+def is_stock_question(utterance: str) -> bool:
+    """A fala parece uma consulta de estoque (e não um pedido de retirada)?"""
+    tokens = tokenize(utterance)
+    if any(t in WITHDRAW_MARKERS for t in tokens):
+        return False
+    return "?" in utterance or any(t in QUERY_MARKERS or t in LOW_STOCK_MARKERS for t in tokens)
+
+
+@dataclass
+class StockThreshold:
+    """Limites de estoque de um produto (stella/data/stock.json)"""
+    minimum: Optional[int] = None
+    critical: Optional[int] = None
+    unit: str = "unidade"
+
+
+def load_stock_thresholds(path: Path) -> Dict[str, StockThreshold]:
+    """
+    Lê quantidade_minima/quantidade_critica por produto, indexados pela forma canônica do nome
+
+    Returns:
+        Dict vazio se o arquivo não existir ou for inválido
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning(f"Não foi possível ler limites de estoque em {path}: {e}")
+        return {}
+
+    thresholds: Dict[str, StockThreshold] = {}
+    for key, item in (data.get("estoque") or {}).items():
+        threshold = StockThreshold(
+            minimum=item.get("quantidade_minima"),
+            critical=item.get("quantidade_critica"),
+            unit=item.get("unidade") or "unidade",
+        )
+        for name in (key, item.get("nome_completo") or ""):
+            form = canonical_name(normalize_product_name(name))
+            if form:
+                thresholds.setdefault(form, threshold)
+    return thresholds
+
+
+def stock_level(quantity: int, threshold: Optional[StockThreshold]) -> str:
+    """'critical', 'low' ou 'normal' para a quantidade atual"""
+    if quantity <= 0:
+        return "critical"
+    if threshold is None:
+        return "normal"
+    if threshold.critical is not None and quantity <= threshold.critical:
+        return "critical"
+    if threshold.minimum is not None and quantity < threshold.minimum:
+        return "low"
+    return "normal"
+
+
+class StockQueryEngine:
+    """Índices de consulta sobre um snapshot de estoque"""
+
+    def __init__(
+        self,
+        stock: Dict[str, Any],
+        index: ProductIndex,
+        thresholds: Dict[str, StockThreshold],
+        version: Optional[str] = None,
+        max_listed: int = 8
+    ):
+        self.stock = stock
+        self.index = index
+        self.version = version
+        self.max_listed = max_listed
+        self.thresholds: Dict[str, StockThreshold] = {}
+        self._by_token: Dict[str, Set[str]] = {}
+        self._by_category: Dict[str, List[str]] = {}
+        self._category_names: Dict[str, str] = {}
+
+        for key, item in stock.items():
+            threshold = thresholds.get(canonical_name(key)) or thresholds.get(canonical_name(item.get("name") or ""))
+            if threshold is not None:
+                self.thresholds[key] = threshold
+            for token in set(tokenize(f"{key} {item.get('name') or ''}")):
+                self._by_token.setdefault(token, set()).add(key)
+            category = item.get("categoryName")
+            if category:
+                form = canonical_name(category)
+                self._by_category.setdefault(form, []).append(key)
+                self._category_names.setdefault(form, category)
+
+        self.below_minimum = sorted(
+            (key for key in stock if self.level(key) != "normal"),
+            key=lambda k: int(stock[k].get("quantity", 0))
+        )
+
+    def level(self, key: str) -> str:
+        return stock_level(int(self.stock[key].get("quantity", 0)), self.thresholds.get(key))
+
+    def answer(self, utterance: str) -> Optional[Dict[str, Any]]:
+        """
+        Resposta local para uma consulta de estoque
+
+        Args:
+            utterance: Fala do usuário
+
+        Returns:
+            Dict no contrato de StellaSpeechResponse, ou None para seguir ao LLM
+        """
+        tokens = tokenize(utterance)
+        if not tokens or any(t.isdigit() for t in tokens) or any(t in WITHDRAW_MARKERS for t in tokens):
+            return None
+        is_query = "?" in utterance or any(t in QUERY_MARKERS for t in tokens)
+        if not is_query and not any(t in LOW_STOCK_MARKERS for t in tokens):
+            return None
+
+        content = [t for t in tokenize(utterance, drop_stopwords=True) if t not in FILLERS]
+
+        if not content and any(t in LOW_STOCK_MARKERS for t in tokens):
+            return self._answer_below_minimum()
+        if not content or not is_query:
+            return None
+
+        category_form = "".join(content)
+        if category_form in self._by_category:
+            return self._answer_listing(
+                f"Itens de {self._category_names[category_form]}", self._by_category[category_form]
+            )
+
+        keys = self._match_products(content)
+        if not keys:
+            return None
+        if len(keys) == 1:
+            return self._answer_product(keys[0])
+        return self._answer_listing("Temos", keys)
+
+    def _match_products(self, content: List[str]) -> List[str]:
+        """Produtos cujo nome contém todos os termos da fala; senão, o melhor nome aproximado"""
+        postings = [self._by_token.get(t) for t in content]
+        if all(postings):
+            keys = set.intersection(*postings)
+            if keys:
+                return sorted(keys) if len(keys) <= self.max_listed else []
+        candidate = self.index.best(" ".join(content), get_settings().get('inventory.name_match_min_score', 0.75))
+        return [candidate.key] if candidate else []
+
+    def _describe(self, key: str) -> str:
+        item = self.stock[key]
+        unit = self.thresholds[key].unit if key in self.thresholds else "unidade"
+        return f"{item.get('name') or key} ({int(item.get('quantity', 0))} {unit}(s))"
+
+    def _analysis(self, keys: List[str]) -> str:
+        levels = {self.level(k) for k in keys}
+        if "critical" in levels:
+            return "critical_stock_alert"
+        if "low" in levels:
+            return "low_stock_alert"
+        return "normal"
+
+    def _alerts(self, keys: List[str]) -> str:
+        alertas = []
+        for key in keys:
+            level = self.level(key)
+            name = self.stock[key].get("name") or key
+            threshold = self.thresholds.get(key)
+            if level == "critical":
+                alertas.append(f"{name} em nível crítico")
+            elif level == "low":
+                alertas.append(f"{name} abaixo do mínimo ({threshold.minimum})")
+        return f" Atenção: {'; '.join(alertas)}." if alertas else ""
+
+    def _response(self, text: str, keys: List[str], reason: str) -> Dict[str, Any]:
+        return {
+            "intention": "stock_query",
+            "items": [],
+            "response": text,
+            "stella_analysis": self._analysis(keys),
+            "reason": reason,
+        }
+
+    def _answer_product(self, key: str) -> Dict[str, Any]:
+        item = self.stock[key]
+        quantity = int(item.get("quantity", 0))
+        name = item.get("name") or key
+        if quantity <= 0:
+            text = f"No momento não temos {name} em estoque."
+        else:
+            unit = self.thresholds[key].unit if key in self.thresholds else "unidade"
+            text = f"Temos {quantity} {unit}(s) de {name} em estoque."
+        return self._response(text + self._alerts([key]), [key], "Consulta local de estoque por produto")
+
+    def _answer_listing(self, title: str, keys: List[str]) -> Dict[str, Any]:
+        shown = keys[:self.max_listed]
+        text = f"{title}: " + ", ".join(self._describe(k) for k in shown)
+        if len(keys) > len(shown):
+            text += f" e mais {len(keys) - len(shown)} item(ns)"
+        return self._response(text + "." + self._alerts(keys), keys, "Consulta local de estoque")
+
+    def _answer_below_minimum(self) -> Optional[Dict[str, Any]]:
+        if not self.thresholds:
+            return None
+        if not self.below_minimum:
+            return self._response(
+                "Nenhum item está abaixo do estoque mínimo no momento.", [], "Consulta local de itens abaixo do mínimo"
+            )
+        keys = self.below_minimum
+        shown = keys[:self.max_listed]
+        partes = []
+        for key in shown:
+            threshold = self.thresholds.get(key)
+            minimo = f", mínimo {threshold.minimum}" if threshold and threshold.minimum is not None else ""
+            partes.append(f"{self.stock[key].get('name') or key} ({int(self.stock[key].get('quantity', 0))}{minimo})")
+        text = "Itens abaixo do mínimo: " + ", ".join(partes)
+        if len(keys) > len(shown):
+            text += f" e mais {len(keys) - len(shown)} item(ns)"
+        return self._response(text + ".", keys, "Consulta local de itens abaixo do mínimo")
+
+
+_engine: Optional[StockQueryEngine] = None
+_thresholds: Optional[Dict[str, StockThreshold]] = None
+
+
+def get_stock_query_engine(snapshot: StockSnapshot) -> Optional[StockQueryEngine]:
+    """Motor de consultas do snapshot atual (reconstruído apenas quando a versão muda), ou None se desativado"""
+    global _engine, _thresholds
+    settings = get_settings()
+    if not settings.get('stock_query.enabled', True):
+        return None
+    if _thresholds is None:
+        path = settings.get('stock_query.thresholds_path') or DEFAULT_THRESHOLDS_PATH
+        _thresholds = load_stock_thresholds(Path(path))
+    if _engine is None or _engine.version != snapshot.version or not snapshot.version:
+        _engine = StockQueryEngine(
+            snapshot.items,
+            get_product_index(snapshot),
+            _thresholds,
+            snapshot.version,
+            max_listed=settings.get('stock_query.max_listed_items', 8)
+        )
+    return _engine
+
+
+def answer_stock_query(snapshot: StockSnapshot, utterance: str) -> Optional[Dict[str, Any]]:
+    """Resposta local para a fala, registrando se a consulta foi atendida localmente"""
+    engine = get_stock_query_engine(snapshot)
+    if engine is None:
+        return None
+    resposta = engine.answer(utterance)
+    metrics.inc("stock_query.local_answered" if resposta is not None else "stock_query.not_matched")
+    return resposta
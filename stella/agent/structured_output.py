@@ -0,0 +1,152 @@
+"""
+Saída estruturada do Gemini (JSON com esquema)
+
+O modelo é chamado com response_mime_type="application/json" e um esquema
+derivado de StellaSpeechResponse, então a resposta já chega como JSON puro.
+O parse é um único model_validate_json direto no modelo pydantic; só uma
+violação do esquema dispara um reparo (o erro volta ao modelo pedindo o JSON
+corrigido), limitado a poucas tentativas.
+"""
+import copy
+import json
+from typing import Any, Dict, List
+from pydantic import BaseModel, ValidationError
+from stella.api.models.speech import StellaSpeechResponse
+
+# Valores que o LLM pode produzir ('error' e 'safety_check' são só do backend)
+LLM_INTENTIONS = ["withdraw_request", "withdraw_confirm", "doubt", "stock_query", "not_understood", "normal"]
+LLM_ANALYSES = [
+    "normal", "low_stock_alert", "critical_stock_alert", "outlier_withdraw_request",
+    "ambiguous", "not_understood", "greeting", "farewell",
+]
+
+_ITEM_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "productName": {"type": "string"},
+        "quantity": {"type": "integer"},
+    },
+    "required": ["productName", "quantity"],
+}
+
+# Chaves do JSON Schema do pydantic que o Gemini não aceita
+_UNSUPPORTED_KEYS = {"title", "default", "additionalProperties", "$defs"}
+
+
+class LLMItem(BaseModel):
+    productName: str
+    quantity: int
+
+
+class SchemaViolation(ValueError):
+    """Resposta do LLM fora do esquema esperado"""
+
+
+def _resolve(node: Any, defs: Dict[str, Any]) -> Any:
+    """Inlines $ref, troca Optional (anyOf com null) por nullable e remove chaves não suportadas"""
+    if isinstance(node, list):
+        return [_resolve(n, defs) for n in node]
+    if not isinstance(node, dict):
+        return node
+    if "$ref" in node:
+        return _resolve(copy.deepcopy(defs[node["$ref"].split("/")[-1]]), defs)
+    if "anyOf" in node:
+        options = [o for o in node["anyOf"] if o.get("type") != "null"]
+        resolved = _resolve(options[0], defs) if len(options) == 1 else {"anyOf": _resolve(options, defs)}
+        if len(options) < len(node["anyOf"]):
+            resolved["nullable"] = True
+        if "description" in node:
+            resolved["description"] = node["description"]
+        return resolved
+    return {k: _resolve(v, defs) for k, v in node.items() if k not in _UNSUPPORTED_KEYS}
+
+
+def response_schema() -> Dict[str, Any]:
+    """Esquema (subconjunto OpenAPI aceito pelo Gemini) derivado de StellaSpeechResponse"""
+    raw = StellaSpeechResponse.model_json_schema()
+    schema = _resolve(raw, raw.get("$defs", {}))
+    props = schema["properties"]
+    props["intention"]["enum"] = LLM_INTENTIONS
+    props["stella_analysis"]["enum"] = LLM_ANALYSES
+    props["items"] = {**props["items"], "type": "array", "items": _ITEM_SCHEMA}
+    schema["required"] = ["intention", "response", "stella_analysis"]
+    return schema
+
+
+def _strip_fences(text: str) -> str:
+    clean = text.strip()
+    if clean.startswith("```"):
+        clean = clean.split("\n", 1)[1] if "\n" in clean else clean[3:]
+        if clean.rstrip().endswith("```"):
+            clean = clean.rstrip()[:-3]
+    return clean
+
+
+def _violations(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(p) for p in e['loc']) or 'resposta'}: {e['msg']}" for e in error.errors()[:5]
+    )
+
+
+def parse_structured(text: str) -> Dict[str, Any]:
+    """
+    Valida a resposta do LLM direto no modelo pydantic
+
+    Returns:
+        Dict no contrato de StellaSpeechResponse
+
+    Raises:
+        SchemaViolation: JSON inválido ou fora do esquema (mensagem lista as violações)
+    """
+    try:
+        parsed = StellaSpeechResponse.model_validate_json(text)
+    except ValidationError as first_error:
+        # Modo sem esquema (ou modelo que ignorou o mime type): tenta sem as cercas de markdown
+        stripped = _strip_fences(text)
+        if stripped == text.strip():
+            raise SchemaViolation(_violations(first_error)) from first_error
+        try:
+            parsed = StellaSpeechResponse.model_validate_json(stripped)
+        except ValidationError as e:
+            raise SchemaViolation(_violations(e)) from e
+
+    resultado = parsed.model_dump(mode="json", warnings=False)
+    if resultado["intention"] not in LLM_INTENTIONS:
+        raise SchemaViolation(f"intention: valor não permitido '{resultado['intention']}'")
+    if resultado["stella_analysis"] not in LLM_ANALYSES:
+        raise SchemaViolation(f"stella_analysis: valor não permitido '{resultado['stella_analysis']}'")
+    try:
+        resultado["items"] = [LLMItem.model_validate(it).model_dump() for it in resultado.get("items") or []]
+    except ValidationError as e:
+        raise SchemaViolation(f"items: {_violations(e)}") from e
+    return resultado
+
+
+def lenient_parse(text: str) -> Dict[str, Any]:
+    """
+    Último recurso após as tentativas de reparo: aceita o JSON e troca valores
+    desconhecidos de intention/stella_analysis por not_understood
+
+    Raises:
+        json.JSONDecodeError: se nem JSON for
+        SchemaViolation: se não houver texto de resposta aproveitável
+    """
+    resultado = json.loads(_strip_fences(text))
+    if not isinstance(resultado, dict) or not isinstance(resultado.get("response"), str) or not resultado["response"]:
+        raise SchemaViolation("resposta sem o campo 'response'")
+    if resultado.get("intention") not in LLM_INTENTIONS:
+        resultado["intention"] = "not_understood"
+    if resultado.get("stella_analysis") not in LLM_ANALYSES:
+        resultado["stella_analysis"] = "not_understood"
+    return resultado
+
+
+def repair_contents(contents: List[Dict[str, Any]], raw: str, violation: str) -> List[Dict[str, Any]]:
+    """Conversa de reparo: resposta inválida + pedido de correção com as violações"""
+    return contents + [
+        {"role": "model", "parts": [raw]},
+        {"role": "user", "parts": [
+            f"A resposta anterior não seguiu o esquema JSON ({violation}). "
+            "Responda novamente apenas com o JSON corrigido, sem texto fora dele."
+        ]},
+    ]
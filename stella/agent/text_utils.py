@@ -0,0 +1,72 @@
+"""
+Utilitários de normalização de texto em português para casar falas com nomes de produtos
+"""
+import re
+import unicodedata
+from typing import List, Set
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+STOPWORDS: Set[str] = {
+    "a", "o", "as", "os", "um", "uma", "uns", "umas", "de", "da", "do", "das", "dos",
+    "e", "em", "no", "na", "nos", "nas", "para", "pra", "por", "com", "que", "quero",
+    "preciso", "precisa", "queria", "gostaria", "me", "eu", "voce", "stella", "tem",
+    "temos", "ter", "quanto", "quantos", "quantas", "qual", "quais", "ai", "la",
+    "mais", "favor", "pegar", "retirar", "tirar", "unidade", "unidades", "sim", "nao",
+}
+
+
+def fold_accents(s: str) -> str:
+    """Remove acentos e converte para minúsculas (ex: 'Máscara' -> 'mascara')"""
+    decomposed = unicodedata.normalize("NFKD", s or "")
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch)).lower()
+
+
+def singularize(token: str) -> str:
+    """Reduz plurais simples do português (seringas -> seringa, luvas -> luva, papeis -> papel)"""
+    if len(token) <= 3 or token.isdigit():
+        return token
+    if token.endswith("oes") or token.endswith("aes"):
+        return token[:-3] + "ao"
+    if token.endswith("eis") and len(token) > 4:
+        return token[:-3] + "el"
+    if token.endswith("ns"):
+        return token[:-2] + "m"
+    if token.endswith("res"):
+        return token[:-2]
+    if token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(s: str, drop_stopwords: bool = False) -> List[str]:
+    """Quebra o texto em tokens sem acento, no singular (mantém tokens como '10ml')"""
+    tokens = _TOKEN_RE.findall(fold_accents(s).replace("_", " "))
+    if drop_stopwords:
+        # Antes do singular: 'quantas' e 'temos' viram 'quanta' e 'temo' e escapariam da lista
+        tokens = [t for t in tokens if t not in STOPWORDS]
+    return [singularize(t) for t in tokens]
+
+
+def char_ngrams(s: str, n: int = 3) -> Set[str]:
+    """N-gramas de caracteres com bordas (usados em comparações aproximadas)"""
+    padded = f" {s} "
+    if len(padded) <= n:
+        return {padded}
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+def ngram_similarity(a: str, b: str, n: int = 3) -> float:
+    """Similaridade de Jaccard entre os n-gramas de dois textos (0 a 1)"""
+    if a == b:
+        return 1.0
+    grams_a, grams_b = char_ngrams(a, n), char_ngrams(b, n)
+    union = grams_a | grams_b
+    if not union:
+        return 0.0
+    return len(grams_a & grams_b) / len(union)
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimativa barata de tokens do LLM (~4 caracteres por token)"""
+    return max(1, len(text) // 4) if text else 0
@@ -0,0 +1,169 @@
+"""
+Log de turnos interpretados pelo LLM (JSONL)
+
+Cada linha guarda a fala do usuário e a classificação devolvida pelo LLM.
+É a base de treino do classificador local de intenções (ver intent_classifier).
+
+Desativado por padrão (intent_classifier.turn_log_enabled). Quando ativo, o
+turno só entra numa fila limitada: a escrita acontece numa thread separada,
+fora do event loop, e o arquivo é rotacionado ao passar de turn_log_max_bytes
+(turn_log.jsonl -> turn_log.jsonl.1 ...). Com a fila cheia o turno é descartado.
+"""
+import json
+import queue
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+from loguru import logger
+from stella.agent.metrics import metrics
+from stella.config.settings import get_settings
+
+DEFAULT_TURN_LOG_PATH = Path(__file__).parent.parent / "data" / "turn_log.jsonl"
+
+
+def get_turn_log_path() -> Optional[Path]:
+    """Caminho do log de turnos ou None se desativado"""
+    settings = get_settings()
+    if not settings.get('intent_classifier.turn_log_enabled', False):
+        return None
+    path = settings.get('intent_classifier.turn_log_path')
+    return Path(path) if path else DEFAULT_TURN_LOG_PATH
+
+
+def rotated_paths(path: Path, backups: int) -> List[Path]:
+    """Arquivos rotacionados, do mais antigo ao mais recente (sem o atual)"""
+    return [path.with_name(f"{path.name}.{n}") for n in range(backups, 0, -1)]
+
+
+class TurnLogWriter:
+    """Grava os turnos numa thread própria, com fila limitada e rotação por tamanho"""
+
+    def __init__(self, path: Path, max_bytes: int = 10 * 1024 * 1024, backups: int = 3, queue_size: int = 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, line: str) -> bool:
+        """Enfileira uma linha sem bloquear; False se a fila está cheia"""
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(line)
+            return True
+        except queue.Full:
+            metrics.inc("turn_log.dropped")
+            return False
+
+    def _ensure_thread(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._write_loop, name="turn-log-writer", daemon=True)
+                self._thread.start()
+
+    def _write_loop(self):
+        while True:
+            line = self._queue.get()
+            if line is None:
+                return
+            lines = [line]
+            # Agrupa o que já estiver na fila numa única abertura do arquivo
+            while True:
+                try:
+                    line = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if line is None:
+                    self._write(lines)
+                    return
+                lines.append(line)
+            self._write(lines)
+
+    def _write(self, lines: List[str]):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.writelines(lines)
+                size = f.tell()
+            if size >= self.max_bytes:
+                self._rotate()
+        except Exception as e:
+            logger.warning(f"Não foi possível registrar turno no log: {e}")
+
+    def _rotate(self):
+        if self.backups <= 0:
+            self.path.unlink(missing_ok=True)
+            return
+        paths = rotated_paths(self.path, self.backups)
+        paths[0].unlink(missing_ok=True)
+        for older, newer in zip(paths, paths[1:]):
+            if newer.exists():
+                newer.replace(older)
+        self.path.replace(paths[-1])
+        logger.info(f"🗂️ Log de turnos rotacionado ({self.path.name})")
+
+    def close(self, timeout: float = 5):
+        """Grava o que ainda está na fila e para a thread (desligamento)"""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._queue.put(None)
+        self._thread.join(timeout=timeout)
+
+
+_writer: Optional[TurnLogWriter] = None
+
+
+def get_turn_log_writer() -> Optional[TurnLogWriter]:
+    """Escritor do log de turnos ou None se desativado"""
+    global _writer
+    path = get_turn_log_path()
+    if path is None:
+        return None
+    if _writer is None or _writer.path != path:
+        settings = get_settings()
+        _writer = TurnLogWriter(
+            path,
+            max_bytes=int(settings.get('intent_classifier.turn_log_max_mb', 10) * 1024 * 1024),
+            backups=settings.get('intent_classifier.turn_log_backups', 3),
+            queue_size=settings.get('intent_classifier.turn_log_queue_size', 1024)
+        )
+    return _writer
+
+
+def close_turn_log():
+    """Esvazia a fila do log de turnos (desligamento)"""
+    if _writer is not None:
+        _writer.close()
+
+
+def log_turn(utterance: str, resultado: Dict[str, Any]):
+    """Registra a fala e a interpretação do LLM (sem bloquear o event loop)"""
+    writer = get_turn_log_writer()
+    if writer is None:
+        return
+    record = {
+        "timestamp": datetime.now().isoformat(),
+        "text": utterance,
+        "intention": resultado.get("intention"),
+        "stella_analysis": resultado.get("stella_analysis"),
+    }
+    writer.submit(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def read_turns(path: Path) -> Iterator[Dict[str, Any]]:
+    """Lê os turnos registrados (arquivos rotacionados inclusos), ignorando linhas inválidas"""
+    backups = get_settings().get('intent_classifier.turn_log_backups', 3)
+    for file_path in rotated_paths(path, backups) + [path]:
+        if not file_path.exists():
+            continue
+        with open(file_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
@@ -0,0 +1,136 @@
+"""
+Agrupamento de falas fragmentadas por sessão (debounce)
+
+O speech-to-text do quiosque muitas vezes envia uma frase em pedaços
+("preciso de cinco", depois "seringas de dez ml"), cada um num
+/speech/process. Cada pedaço virava um turno completo (estoque + LLM), e a
+resposta ao primeiro pedaço estava errada de qualquer forma.
+
+Aqui as falas de uma sessão que chegam dentro da janela de debounce são
+juntadas num único turno: cada fala nova reinicia a janela (limitada por
+`max_wait_seconds` desde a primeira), o turno pendente anterior é descartado
+e todas as requisições do grupo recebem o resultado do turno combinado.
+Turnos já em andamento não são interrompidos (podem ter publicado retiradas).
+
+Desativado por padrão (speech_coalescing.enabled), pois a janela soma latência
+ao turno. Quando ativo, uma fala que já forma um comando completo (ver
+`is_complete`) é processada na hora, sem esperar a janela.
+"""
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from loguru import logger
+from stella.agent.metrics import metrics
+from stella.config.settings import get_settings
+
+PartialCallback = Callable[[str], Awaitable[None]]
+TurnRunner = Callable[[str, Optional[PartialCallback]], Awaitable[Any]]
+
+
+@dataclass
+class _PendingTurn:
+    """Falas aguardando o fim da janela de debounce"""
+    run: TurnRunner
+    on_partial: Optional[PartialCallback]
+    future: asyncio.Future
+    texts: List[str] = field(default_factory=list)
+    first_at: float = field(default_factory=time.monotonic)
+    timer: Optional[asyncio.TimerHandle] = None
+
+
+class UtteranceCoalescer:
+    """Junta as falas de uma sessão recebidas dentro da janela de debounce"""
+
+    def __init__(self, enabled: bool = False, debounce_seconds: float = 0.5, max_wait_seconds: float = 1.5):
+        self.enabled = enabled
+        self.debounce_seconds = debounce_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self._pending: Dict[str, _PendingTurn] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, session_id: str, text: str, run: TurnRunner,
+                     on_partial: Optional[PartialCallback] = None,
+                     is_complete: Optional[Callable[[str], bool]] = None) -> Any:
+        """
+        Agenda a fala e aguarda o resultado do turno (possivelmente combinado)
+
+        Args:
+            session_id: ID da sessão
+            text: Fala recebida
+            run: Executa o turno com o texto combinado (ex: command_interpreter)
+            on_partial: Trechos da resposta; vale o da fala mais recente do grupo
+            is_complete: Diz se o texto combinado já é um comando completo
+                (processado sem esperar a janela)
+
+        Returns:
+            Resultado de `run` para o texto combinado
+        """
+        metrics.inc("speech.utterances")
+        if not self.enabled or self.debounce_seconds <= 0:
+            metrics.inc("speech.turns")
+            return await run(text, on_partial)
+
+        loop = asyncio.get_running_loop()
+        pending = self._pending.get(session_id)
+        if pending is None:
+            pending = _PendingTurn(run=run, on_partial=on_partial, future=loop.create_future())
+            self._pending[session_id] = pending
+        else:
+            # Fala nova dentro da janela: o turno pendente é substituído pelo combinado
+            pending.timer.cancel()
+            pending.run = run
+            pending.on_partial = on_partial
+            metrics.inc("speech.coalesced")
+            logger.info(f"🧩 Fala agrupada ao turno pendente | Sessão: {session_id}")
+        pending.texts.append(text.strip())
+
+        remaining = pending.first_at + self.max_wait_seconds - time.monotonic()
+        delay = max(0.0, min(self.debounce_seconds, remaining))
+        if delay and is_complete is not None and is_complete(" ".join(t for t in pending.texts if t)):
+            metrics.inc("speech.complete_flushes")
+            delay = 0.0
+        pending.timer = loop.call_later(delay, self._flush, session_id, pending)
+        # Uma requisição cancelada não cancela o turno das demais do grupo
+        return await asyncio.shield(pending.future)
+
+    def _flush(self, session_id: str, pending: _PendingTurn):
+        if self._pending.get(session_id) is pending:
+            del self._pending[session_id]
+        # Referência forte até o fim: o loop só guarda referências fracas das tasks
+        task = asyncio.ensure_future(self._run(pending))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    async def _run(pending: _PendingTurn):
+        metrics.inc("speech.turns")
+        metrics.set_gauge(
+            "speech.turns_per_utterance",
+            metrics.counter("speech.turns") / max(1, metrics.counter("speech.utterances"))
+        )
+        try:
+            result = await pending.run(" ".join(t for t in pending.texts if t), pending.on_partial)
+        except BaseException as e:
+            if not pending.future.done():
+                pending.future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+        else:
+            if not pending.future.done():
+                pending.future.set_result(result)
+
+
+_coalescer: Optional[UtteranceCoalescer] = None
+
+
+def get_utterance_coalescer() -> UtteranceCoalescer:
+    global _coalescer
+    if _coalescer is None:
+        settings = get_settings()
+        _coalescer = UtteranceCoalescer(
+            enabled=settings.get('speech_coalescing.enabled', False),
+            debounce_seconds=settings.get('speech_coalescing.debounce_seconds', 0.5),
+            max_wait_seconds=settings.get('speech_coalescing.max_wait_seconds', 1.5)
+        )
+    return _coalescer
@@ -4,6 +4,8 @@ Modelos Pydantic para validação de requests e responses da API Stella
 
 from stella.api.models.speech import (
     SpeechResponse,
+    SpeechPartialData,
+    SpeechPartialResponse,
     UserIntentions,
     StellaAnalysis,
     StellaSpeechResponse,
@@ -36,6 +38,8 @@ __all__ = [
     # Speech models
     "SpeechRequest",
     "SpeechResponse",
+    "SpeechPartialData",
+    "SpeechPartialResponse",
     "StellaSpeechResponse",
     "StellaAnalysis",
     "UserIntentions",
@@ -1,7 +1,14 @@
 from pydantic import BaseModel, Field
+from typing import Optional
 
 class SessionStartRequest(BaseModel):
     session_id: str = Field(..., description="ID da sessão a ser criada")
+    speculative_auth: Optional[bool] = Field(
+        None,
+        description="Inicia o reconhecimento facial em background (padrão definido em speculative_auth.enabled)"
+    )
+    camera_id: Optional[str] = Field(None, description="Câmera usada no reconhecimento especulativo (padrão: primeira configurada)")
+    device_id: Optional[str] = Field(None, description="Quiosque da sessão (encerra a sessão anterior do mesmo dispositivo)")
 
 class SessionEndRequest(BaseModel):
     session_id: str = Field(..., description="ID da sessão a ser encerrada")
@@ -9,6 +16,7 @@ class SessionEndRequest(BaseModel):
 class SessionStartResponse(BaseModel):
     success: bool = Field(..., description="Indica se a sessão foi criada com sucesso")
     session_id: str = Field(..., description="ID da nova sessão criada")
+    speculative_auth: bool = Field(False, description="Indica se o reconhecimento facial especulativo foi iniciado")
     
 class SessionEndResponse(BaseModel):
     success: bool = Field(..., description="Indica se a sessão foi encerrada com sucesso")
@@ -43,10 +43,18 @@ class StellaSpeechResponse(BaseModel):
 
 class SpeechResponse(BaseResponse):
     data: StellaSpeechResponse
+
+class SpeechPartialData(BaseModel):
+    text: str = Field(..., description="Trecho do texto da resposta, na ordem de geração")
+    sequence: int = Field(..., ge=0, description="Posição do trecho na resposta (0, 1, 2...)")
+
+class SpeechPartialResponse(BaseResponse):
+    data: SpeechPartialData
     
 class SpeechDataRequest(BaseModel):
     text: str = Field(..., min_length=1, description="Texto transcrito do speech")
     userId: Optional[str] = Field(None, description="ID do usuário que fez a solicitação")
 
 class SpeechRequest(BaseRequest):
-    data: SpeechDataRequest = Field(..., description="Dados do speech")
\ No newline at end of file
+    data: SpeechDataRequest = Field(..., description="Dados do speech")
+    device_id: Optional[str] = Field(None, description="Quiosque de origem (uma sessão ativa por dispositivo)")
\ No newline at end of file
@@ -21,7 +21,7 @@ def create_session_router() -> APIRouter:
         try:
             logger.info("🚀 Solicitação para iniciar nova sessão")
             
-            result = session_service.start_new_session(request)
+            result = await session_service.start_new_session(request)
             
             return result
             
@@ -47,7 +47,7 @@ def create_session_router() -> APIRouter:
                     detail="ID da sessão não pode estar vazio"
                 )
             
-            result = session_service.end_session(request.session_id)
+            result = await session_service.end_session(request)
             
             return result
             
@@ -2,16 +2,72 @@
 Serviço de reconhecimento facial
 """
 
+import asyncio
 from datetime import datetime
+from typing import Optional
 from loguru import logger
 from stella.api.models import FaceAuthResponse
 from stella.api.models.face import FaceAuthRequest, FaceCadRequest, FaceCadResponse
 from stella.face_id.face_recognizer import FaceRecognizer
+from stella.face_id.camera_pool import MultiCameraRecognizer
 from stella.websocket.websocket_manager import get_default_channel, send_event
 
+# Reconhecedor multi-câmera compartilhado (câmeras abertas no primeiro uso)
+_camera_recognizer: Optional[MultiCameraRecognizer] = None
+_camera_recognizer_lock = asyncio.Lock()
+
 class FaceService:
     """Serviço responsável pelo reconhecimento facial"""
 
+    @staticmethod
+    async def get_camera_recognizer() -> MultiCameraRecognizer:
+        """Retorna o reconhecedor multi-câmera compartilhado, iniciando-o se necessário"""
+        global _camera_recognizer
+        async with _camera_recognizer_lock:
+            if _camera_recognizer is None:
+                recognizer = MultiCameraRecognizer()
+                await recognizer.start()
+                _camera_recognizer = recognizer
+        return _camera_recognizer
+
+    @staticmethod
+    async def release_camera_recognizer() -> bool:
+        """
+        Fecha as câmeras do reconhecedor compartilhado, se não houver validação em andamento
+
+        Returns:
+            True se as câmeras foram liberadas
+        """
+        global _camera_recognizer
+        async with _camera_recognizer_lock:
+            if _camera_recognizer is None or _camera_recognizer.validating:
+                return False
+            recognizer, _camera_recognizer = _camera_recognizer, None
+        await recognizer.stop()
+        logger.info("📷 Câmeras do reconhecimento especulativo liberadas")
+        return True
+
+    @staticmethod
+    async def recognize_user(camera_id: Optional[str] = None) -> Optional[str]:
+        """
+        Reconhece o usuário em frente a uma câmera
+
+        Args:
+            camera_id: Câmera a usar (padrão: primeira configurada)
+
+        Returns:
+            Nome do usuário reconhecido ou None
+        """
+        recognizer = await FaceService.get_camera_recognizer()
+        if camera_id is None:
+            if not recognizer.sources:
+                logger.error("Nenhuma câmera configurada para reconhecimento")
+                return None
+            camera_id = next(iter(recognizer.sources))
+
+        result = await recognizer.validate_face(camera_id)
+        return result.user_name if result.recognized else None
+
     @staticmethod
     def process_face_recognition(request: FaceAuthRequest) -> FaceAuthResponse:
         """
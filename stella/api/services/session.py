@@ -4,13 +4,19 @@ Serviço de gerenciamento de sessões
 import uuid
 from loguru import logger
 from stella.api.models import SessionEndRequest, SessionEndResponse, SessionStartResponse, SessionStartRequest
-from stella.agent.speech_processor import end_session as end_speech_session
+from stella.agent.speech_processor import claim_device_session, end_session as end_speech_session
+from stella.agent.session_identity import session_identities
+from stella.api.services.face import FaceService
+from stella.config.settings import get_settings
+
+# Sem sessões especulativas pendentes, as câmeras são fechadas (reabertas na próxima)
+session_identities.set_idle_callback(FaceService.release_camera_recognizer)
 
 class SessionService:
     """Serviço responsável pelo gerenciamento de sessões de usuário"""
     
     @staticmethod
-    def start_new_session(request: SessionStartRequest) -> SessionStartResponse:
+    async def start_new_session(request: SessionStartRequest) -> SessionStartResponse:
         """
         Inicia uma nova sessão de usuário
         
@@ -24,10 +30,24 @@ class SessionService:
                 session_id = request.session_id
                 
             logger.info(f"🚀 Nova sessão criada: {session_id}")
+            await claim_device_session(session_id, request.device_id)
+            
+            speculative = request.speculative_auth
+            if speculative is None:
+                speculative = get_settings().get('speculative_auth.enabled', False)
+            
+            started = False
+            if speculative:
+                # Reconhecimento em background: a identidade fica pronta antes do withdraw_confirm
+                started = session_identities.start(
+                    session_id,
+                    lambda: FaceService.recognize_user(request.camera_id)
+                )
             
             return SessionStartResponse(
                 success=True,
-                session_id=session_id
+                session_id=session_id,
+                speculative_auth=started
             )
             
         except Exception as e:
@@ -37,7 +57,8 @@ class SessionService:
                 session_id=session_id,
             )
 
-    def end_session(request: SessionEndRequest) -> SessionEndResponse:
+    @staticmethod
+    async def end_session(request: SessionEndRequest) -> SessionEndResponse:
         """
         Finaliza uma sessão específica
         
@@ -47,10 +68,9 @@ class SessionService:
         Returns:
             SessionEndRequest confirmando o encerramento
         """
+        session_id = request.session_id
         try:
-            session_id = request.session_id
-            
-            session_ended = end_speech_session(session_id)
+            session_ended = await end_speech_session(session_id)
             
             if session_ended:
                 logger.info(f"🔚 Sessão encerrada: {session_id}")
@@ -5,9 +5,18 @@ import asyncio
 from datetime import datetime
 from loguru import logger
 from pydantic import ValidationError
-from stella.api.models import SpeechRequest, SpeechResponse, StellaSpeechResponse
-from stella.agent.speech_processor import command_interpreter
+from stella.api.models import (
+    SpeechRequest,
+    SpeechResponse,
+    SpeechPartialData,
+    SpeechPartialResponse,
+    StellaSpeechResponse
+)
+from stella.agent.speech_processor import command_interpreter, is_complete_command, is_processing_error
+from stella.agent.utterance_coalescer import get_utterance_coalescer
+from stella.agent.idempotency import get_idempotent_turns
 from stella.websocket.websocket_manager import send_event, get_default_channel
+from stella.config.settings import get_settings
 
 class SpeechService:
     """Serviço responsável pelo processamento de voz e interação com IA"""
@@ -20,9 +29,29 @@ class SpeechService:
         try:
             logger.info(f"🗣️ Processando async | Sessão: {request.session_id} | Corr: {request.correlation_id}")
 
-            ai_response = await command_interpreter(
-                request.data.text,
-                request.session_id
+            # Fragmentos da mesma frase (dentro da janela de debounce) viram um único turno;
+            # cada correlation_id recebe a resposta do turno combinado
+            def _turn():
+                return get_utterance_coalescer().submit(
+                    request.session_id,
+                    request.data.text,
+                    lambda texto, on_partial: command_interpreter(
+                        texto,
+                        request.session_id,
+                        on_partial=on_partial,
+                        device_id=request.device_id
+                    ),
+                    on_partial=SpeechService._partial_sender(request),
+                    is_complete=is_complete_command
+                )
+            
+            # Repetições da mesma requisição (retry do quiosque) não geram novo turno
+            # nem nova publicação de retirada: recebem o resultado do turno original
+            # (respostas de erro de processamento não são reenviadas: o retry processa de novo)
+            ai_response = await get_idempotent_turns().run(
+                SpeechService._idempotency_key(request),
+                _turn,
+                cacheable=lambda resultado: not is_processing_error(resultado)
             )
             
             if ai_response:
@@ -55,6 +84,40 @@ class SpeechService:
             logger.error(f"❌ Erro no processamento: {e}")
             await SpeechService._send_processing_error(request.session_id, request.correlation_id, e)
 
+    @staticmethod
+    def _idempotency_key(request: SpeechRequest):
+        """(session_id, correlation_id); sem correlation_id não há deduplicação"""
+        if not request.correlation_id or not get_settings().get('idempotency.enabled', True):
+            return None
+        return (request.session_id, request.correlation_id)
+
+    @staticmethod
+    def _partial_sender(request: SpeechRequest):
+        """Callback que envia cada trecho da resposta como server-speech-partial"""
+        sequence = 0
+        
+        async def _send(text: str):
+            nonlocal sequence
+            partial = SpeechPartialResponse(
+                session_id=request.session_id,
+                correlation_id=request.correlation_id,
+                timestamp=datetime.now(),
+                data=SpeechPartialData(text=text, sequence=sequence)
+            )
+            sequence += 1
+            try:
+                # Pusher é síncrono: fora do event loop para não atrasar o stream
+                await asyncio.to_thread(
+                    send_event,
+                    get_default_channel(),
+                    "server-speech-partial",
+                    partial.model_dump()
+                )
+            except Exception as e:
+                logger.warning(f"⚠️ Falha ao enviar trecho parcial: {e}")
+        
+        return _send
+
     @staticmethod
     async def _send_validation_error(session_id: str, correlation_id: str, validation_error: ValidationError):
         """Envia erro de validação via WebSocket"""
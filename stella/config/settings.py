@@ -8,6 +8,7 @@ Gerencia todas as configurações da aplicação incluindo:
 """
 
 import os
+from functools import lru_cache
 from typing import Dict, Any
 import yaml
 from pathlib import Path
@@ -60,6 +61,153 @@ class Settings:
                 "speaker_device_id": None
             },
             
+            # Configurações de reconhecimento facial (multi-câmera)
+            "face_recognition": {
+                "cameras": [
+                    {"camera_id": "cam_0", "camera_index": 0, "kiosk_id": "UNIT_001"}
+                ],
+                "inference_workers": 1,
+                "inference_queue_size": 8,
+                "max_pending_per_camera": 2,
+                "frame_interval_seconds": 0.1,
+                "validation_timeout_seconds": 10,
+                "multi_face_enabled": False,
+                "identity_precache_enabled": False,
+                "identity_precache_ttl_seconds": 15,
+                "identity_precache_margin": 0.75,
+                "adaptive_templates_enabled": False,
+                "adaptive_reservoir_size": 10,
+                "adaptive_update_margin": 0.5,
+                "adaptive_min_gap": 0.1,
+                "adaptive_max_drift": 0.15,
+                "adaptive_min_interval_seconds": 300
+            },
+            
+            # Reconhecimento facial especulativo no início da sessão
+            "speculative_auth": {
+                "enabled": False,
+                "ttl_seconds": 120,
+                "resolve_timeout_seconds": 5,
+                "sweep_interval_seconds": 30
+            },
+            
+            # API externa de inventário (cache do snapshot de estoque)
+            "inventory": {
+                "api_url": None,
+                "cache_ttl_seconds": 30,
+                "stale_ttl_seconds": 300,
+                "request_timeout_seconds": 10,
+                "max_connections": 10,
+                "keepalive_expiry_seconds": 30,
+                "name_match_min_score": 0.75
+            },
+            
+            # Configurações do LLM (Gemini)
+            "llm": {
+                "stock_context_top_k": 25,
+                "stock_context_min_score": 0.5,
+                "stock_context_full_fallback": True,
+                "stock_aliases": {},
+                "history_token_budget": 1500,
+                "history_keep_recent_turns": 4,
+                "request_timeout_seconds": 15,
+                "streaming_enabled": True,
+                "stream_min_chunk_chars": 24,
+                "max_concurrency": 4,
+                "max_queue": 64,
+                "structured_output": True,
+                "schema_max_retries": 1,
+                "hedge_enabled": True,
+                "hedge_percentile": 95,
+                "hedge_min_samples": 20,
+                "hedge_default_delay_seconds": 3.0,
+                "hedge_min_delay_seconds": 0.5,
+                "hedge_max_attempts": 2,
+                "context_cache_enabled": False,
+                "context_cache_backend": "gemini",
+                "context_cache_ttl_seconds": 3600,
+                "context_cache_min_tokens": 1024,
+                "provider": "gemini",
+                "local_script_path": None,
+                "local_latency_ms": 0,
+                "local_latency_jitter_ms": 0,
+                "local_failure_rate": 0.0,
+                "local_seed": 0
+            },
+            
+            # Sessões de conversa em memória
+            "sessions": {
+                "ttl_seconds": 180,
+                "sweep_interval_seconds": 15,
+                "memory_budget_mb": 64,
+                "max_history_turns": 20,
+                "exclusive_per_device": True,
+                "backend": "memory",
+                "sqlite_path": None,
+                "redis_db": 0,
+                "redis_prefix": "stella:session:",
+                "lock_ttl_seconds": 30,
+                "lock_wait_seconds": 20
+            },
+            
+            # Agrupamento de falas fragmentadas por sessão
+            "speech_coalescing": {
+                "enabled": False,
+                "debounce_seconds": 0.5,
+                "max_wait_seconds": 1.5
+            },
+            
+            # Deduplicação de requisições repetidas (session_id, correlation_id)
+            "idempotency": {
+                "enabled": True,
+                "ttl_seconds": 300,
+                "max_entries": 2048,
+                "in_flight_ttl_seconds": 30
+            },
+            
+            # Gravação/reprodução das interações com o LLM e o inventário
+            "cassette": {
+                "mode": "off",
+                "path": None,
+                "replay_latency": False
+            },
+            
+            # Consultas de estoque respondidas localmente
+            "stock_query": {
+                "enabled": True,
+                "thresholds_path": None,
+                "max_listed_items": 8
+            },
+            
+            # Cache de respostas do LLM para intenções sem estado
+            "response_cache": {
+                "enabled": True,
+                "max_entries": 512,
+                "ttl_seconds": 300,
+                "intents": ["stock_query", "doubt"],
+                "analyses": ["greeting"]
+            },
+            
+            # Interpretador offline de pedidos de retirada
+            "offline_parser": {
+                "enabled": True,
+                "fast_path_simple_commands": False
+            },
+            
+            # Classificador local de intenções triviais
+            "intent_classifier": {
+                "enabled": False,
+                "model_path": None,
+                "confidence_threshold": 0.9,
+                "local_labels": ["greeting", "farewell"],
+                "max_chars": 60,
+                "turn_log_enabled": False,
+                "turn_log_path": None,
+                "turn_log_max_mb": 10,
+                "turn_log_backups": 3,
+                "turn_log_queue_size": 1024
+            },
+            
             # Configurações de sistema
             "system": {
                 "unit_id": "UNIT_001",
@@ -161,3 +309,9 @@ class Settings:
         
         self.set('authentication.default_pin', value)
         self.save()
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Retorna a instância compartilhada de Settings (carregada uma única vez)"""
+    return Settings()
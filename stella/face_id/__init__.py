@@ -5,8 +5,10 @@ This module manages:
 - Facial processing and recognition
 - New user registration
 - Face validation
+- Multiple cameras sharing a single inference pool
 """
 
 from .face_recognizer import FaceRecognizer
+from .camera_pool import CameraSource, RecognitionResult, MultiCameraRecognizer
 
-__all__ = ['FaceRecognizer']
\ No newline at end of file
+__all__ = ['FaceRecognizer', 'CameraSource', 'RecognitionResult', 'MultiCameraRecognizer']
\ No newline at end of file
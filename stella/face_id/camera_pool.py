@@ -0,0 +1,446 @@
+"""
+Pool de câmeras com inferência compartilhada
+
+Permite que um único processo gerencie várias câmeras (uma por ponto de entrada
+do almoxarifado). Cada câmera tem sua própria thread de captura e seu próprio
+estado de validação, e todas alimentam uma fila de inferência limitada e
+compartilhada, atendida em round-robin para que nenhuma câmera monopolize o
+modelo. Como só existe um FaceRecognizer, a memória escala com o número de
+modelos e não com o número de câmeras.
+"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from loguru import logger
+
+from stella.config.settings import get_settings
+from stella.face_id.face_recognizer import FaceRecognizer
+
+
+@dataclass
+class CameraSource:
+    """Fonte de frames de um quiosque"""
+    camera_id: str
+    camera_index: Any = 0  # Índice do dispositivo ou URL de stream
+    kiosk_id: Optional[str] = None
+
+
+@dataclass
+class RecognitionResult:
+    """Resultado de reconhecimento marcado com a câmera/quiosque de origem"""
+    camera_id: str
+    kiosk_id: Optional[str]
+    recognized: bool
+    user_name: Optional[str] = None
+    distance: float = float('inf')
+    timestamp: datetime = field(default_factory=datetime.now)
+
+
+class InferencePool:
+    """
+    Fila de inferência limitada e compartilhada entre câmeras
+
+    Cada câmera tem uma fila própria de no máximo `max_pending_per_camera` frames
+    (o mais antigo é descartado quando chega um novo), e o total de frames
+    pendentes é limitado por `queue_size`. Os workers escolhem a próxima câmera
+    em round-robin, garantindo escalonamento justo.
+    """
+
+    def __init__(
+        self,
+        recognizer: FaceRecognizer,
+        on_result: Callable[[str, Optional[str], float, Optional[np.ndarray]], None],
+        workers: int = 1,
+        queue_size: int = 8,
+        max_pending_per_camera: int = 2
+    ):
+        self.recognizer = recognizer
+        self.on_result = on_result
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.max_pending_per_camera = max(1, max_pending_per_camera)
+
+        self._queues: "OrderedDict[str, Deque[np.ndarray]]" = OrderedDict()
+        self._pending = 0
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._running = False
+
+        # Métricas simples
+        self.processed = 0
+        self.dropped = 0
+
+    def start(self):
+        """Inicia as threads de inferência"""
+        if self._running:
+            return
+        self._running = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"face-inference-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Pool de inferência iniciado com {self.workers} worker(s)")
+
+    def stop(self):
+        """Para as threads de inferência e descarta frames pendentes"""
+        with self._cond:
+            self._running = False
+            self._queues.clear()
+            self._pending = 0
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads.clear()
+        logger.info("Pool de inferência parado")
+
+    def submit(self, camera_id: str, frame: np.ndarray) -> bool:
+        """
+        Enfileira um frame para inferência
+
+        Args:
+            camera_id: Câmera de origem
+            frame: Frame capturado
+
+        Returns:
+            True se o frame foi enfileirado, False se a fila global está cheia
+        """
+        with self._cond:
+            if not self._running:
+                return False
+
+            queue = self._queues.setdefault(camera_id, deque())
+            if len(queue) >= self.max_pending_per_camera:
+                # Mantém apenas os frames mais recentes desta câmera
+                queue.popleft()
+                self._pending -= 1
+                self.dropped += 1
+            elif self._pending >= self.queue_size:
+                self.dropped += 1
+                return False
+
+            queue.append(frame)
+            self._pending += 1
+            self._cond.notify()
+            return True
+
+    def discard(self, camera_id: str):
+        """Descarta frames pendentes de uma câmera"""
+        with self._cond:
+            queue = self._queues.get(camera_id)
+            if queue:
+                self._pending -= len(queue)
+                queue.clear()
+
+    @property
+    def pending(self) -> int:
+        """Quantidade de frames aguardando inferência"""
+        return self._pending
+
+    def _next_job(self) -> Optional[Tuple[str, np.ndarray]]:
+        """Retira o próximo frame em round-robin entre as câmeras"""
+        with self._cond:
+            while self._running and self._pending == 0:
+                self._cond.wait()
+            if not self._running:
+                return None
+
+            for camera_id, queue in self._queues.items():
+                if queue:
+                    frame = queue.popleft()
+                    self._pending -= 1
+                    # Câmera atendida vai para o fim da fila de prioridade
+                    self._queues.move_to_end(camera_id)
+                    return camera_id, frame
+            return None
+
+    def _worker_loop(self):
+        """Loop de inferência: detecta, extrai embedding e compara"""
+        while True:
+            job = self._next_job()
+            if job is None:
+                if not self._running:
+                    break
+                continue
+
+            camera_id, frame = job
+            try:
+                user_name, distance, embedding = self.recognizer.identify_frame(frame)
+            except Exception as e:
+                logger.error(f"Erro na inferência da câmera {camera_id}: {e}")
+                continue
+
+            self.processed += 1
+            try:
+                self.on_result(camera_id, user_name, distance, embedding)
+            except Exception as e:
+                logger.error(f"Erro ao entregar resultado da câmera {camera_id}: {e}")
+
+
+class _ValidationState:
+    """Estado de uma validação em andamento em uma câmera"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_attempts: int):
+        self.loop = loop
+        self.future: asyncio.Future = loop.create_future()
+        self.max_attempts = max_attempts
+        self.attempts = 0
+        self.started_at = time.time()
+
+
+class _CameraWorker:
+    """Thread de captura de uma câmera"""
+
+    def __init__(self, source: CameraSource, pool: InferencePool, frame_interval: float):
+        self.source = source
+        self.pool = pool
+        self.frame_interval = frame_interval
+        self.camera = None
+        self.active = False  # Envia frames ao pool somente durante uma validação
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    def open(self) -> bool:
+        """Abre a câmera e configura a resolução"""
+        try:
+            logger.info(f"Inicializando câmera {self.source.camera_id} (índice {self.source.camera_index})...")
+            self.camera = cv2.VideoCapture(self.source.camera_index)
+            if self.camera is None or not self.camera.isOpened():
+                logger.error(f"Não foi possível abrir a câmera {self.source.camera_id}.")
+                if self.camera is not None:
+                    self.camera.release()
+                self.camera = None
+                return False
+
+            self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+            self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+            return True
+        except Exception as e:
+            logger.error(f"Erro ao inicializar câmera {self.source.camera_id}: {e}")
+            self.camera = None
+            return False
+
+    def start(self):
+        """Inicia a thread de captura"""
+        self._running = True
+        self._thread = threading.Thread(
+            target=self._capture_loop,
+            name=f"camera-{self.source.camera_id}",
+            daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Para a captura e libera a câmera"""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self.camera is not None:
+            self.camera.release()
+            self.camera = None
+
+    def _capture_loop(self):
+        """Lê frames continuamente, enviando ao pool quando há validação ativa"""
+        while self._running:
+            ret, frame = self.camera.read()
+            if not ret:
+                logger.warning(f"Falha ao capturar frame da câmera {self.source.camera_id}")
+                time.sleep(self.frame_interval)
+                continue
+
+            if self.active:
+                self.pool.submit(self.source.camera_id, frame)
+
+            time.sleep(self.frame_interval)
+
+
+class MultiCameraRecognizer:
+    """
+    Gerencia várias câmeras com um único modelo de reconhecimento facial
+
+    Exemplo:
+        recognizer = MultiCameraRecognizer()
+        await recognizer.start()
+        result = await recognizer.validate_face("cam_0")
+    """
+
+    def __init__(
+        self,
+        sources: Optional[List[CameraSource]] = None,
+        recognizer: Optional[FaceRecognizer] = None
+    ):
+        settings = get_settings()
+
+        if sources is None:
+            sources = [
+                CameraSource(
+                    camera_id=str(cam.get("camera_id", f"cam_{i}")),
+                    camera_index=cam.get("camera_index", i),
+                    kiosk_id=cam.get("kiosk_id")
+                )
+                for i, cam in enumerate(settings.get('face_recognition.cameras', []))
+            ]
+
+        self.sources: Dict[str, CameraSource] = {src.camera_id: src for src in sources}
+        self.recognizer = recognizer or FaceRecognizer()
+        self.max_attempts = settings.get('validation.max_face_id_attempts', 3)
+        self.validation_timeout = settings.get('face_recognition.validation_timeout_seconds', 10)
+
+        self.pool = InferencePool(
+            self.recognizer,
+            on_result=self._on_result,
+            workers=settings.get('face_recognition.inference_workers', 1),
+            queue_size=settings.get('face_recognition.inference_queue_size', 8),
+            max_pending_per_camera=settings.get('face_recognition.max_pending_per_camera', 2)
+        )
+
+        frame_interval = settings.get('face_recognition.frame_interval_seconds', 0.1)
+        self._workers: Dict[str, _CameraWorker] = {
+            camera_id: _CameraWorker(src, self.pool, frame_interval)
+            for camera_id, src in self.sources.items()
+        }
+        self._validations: Dict[str, _ValidationState] = {}
+        self._lock = threading.Lock()
+
+        logger.success(f"MultiCameraRecognizer configurado com {len(self.sources)} câmera(s)")
+
+    async def start(self) -> Dict[str, bool]:
+        """
+        Abre todas as câmeras e inicia captura e inferência
+
+        Returns:
+            Dicionário camera_id -> True se a câmera foi aberta
+        """
+        status = {}
+        for camera_id, worker in self._workers.items():
+            opened = await asyncio.to_thread(worker.open)
+            status[camera_id] = opened
+            if opened:
+                worker.start()
+        self.pool.start()
+        logger.success(f"Câmeras ativas: {[cid for cid, ok in status.items() if ok]}")
+        return status
+
+    async def stop(self):
+        """Para captura, inferência e cancela validações pendentes"""
+        with self._lock:
+            validations = list(self._validations.values())
+            self._validations.clear()
+        for state in validations:
+            if not state.future.done():
+                state.future.cancel()
+
+        for worker in self._workers.values():
+            await asyncio.to_thread(worker.stop)
+        self.pool.stop()
+        logger.info("MultiCameraRecognizer finalizado")
+
+    async def validate_face(self, camera_id: str, timeout: Optional[float] = None) -> RecognitionResult:
+        """
+        Valida o rosto em frente a uma câmera
+
+        Args:
+            camera_id: Câmera onde a validação acontece
+            timeout: Tempo máximo em segundos (padrão da configuração)
+
+        Returns:
+            RecognitionResult marcado com camera_id/kiosk_id
+        """
+        source = self.sources.get(camera_id)
+        worker = self._workers.get(camera_id)
+        if source is None or worker is None or worker.camera is None:
+            logger.error(f"Câmera {camera_id} não está ativa")
+            return RecognitionResult(camera_id=camera_id, kiosk_id=None, recognized=False)
+
+        with self._lock:
+            if camera_id in self._validations:
+                raise RuntimeError(f"Já existe uma validação em andamento na câmera {camera_id}")
+            state = _ValidationState(asyncio.get_running_loop(), self.max_attempts)
+            self._validations[camera_id] = state
+
+        logger.info(f"🔍 Iniciando validação facial na câmera {camera_id}...")
+        worker.active = True
+        try:
+            return await asyncio.wait_for(state.future, timeout or self.validation_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Timeout na validação da câmera {camera_id}")
+            return RecognitionResult(camera_id=camera_id, kiosk_id=source.kiosk_id, recognized=False)
+        finally:
+            worker.active = False
+            self.pool.discard(camera_id)
+            with self._lock:
+                self._validations.pop(camera_id, None)
+
+    @property
+    def validating(self) -> bool:
+        """True se há validação em andamento em alguma câmera"""
+        with self._lock:
+            return bool(self._validations)
+
+    def get_status(self) -> Dict[str, Any]:
+        """Retorna o estado das câmeras e da fila de inferência"""
+        return {
+            "cameras": {
+                camera_id: {
+                    "kiosk_id": worker.source.kiosk_id,
+                    "active": worker.camera is not None,
+                    "validating": camera_id in self._validations
+                }
+                for camera_id, worker in self._workers.items()
+            },
+            "pending_frames": self.pool.pending,
+            "processed_frames": self.pool.processed,
+            "dropped_frames": self.pool.dropped
+        }
+
+    def _on_result(self, camera_id: str, user_name: Optional[str], distance: float, embedding: Optional[np.ndarray]):
+        """Recebe o resultado de um worker (thread de inferência)"""
+        with self._lock:
+            state = self._validations.get(camera_id)
+        if state is None or state.future.done():
+            return
+
+        source = self.sources[camera_id]
+        if user_name is None and distance == float('inf'):
+            return  # Nenhum rosto no frame, segue aguardando
+
+        if user_name and distance < self.recognizer.threshold:
+            logger.success(f"✅ [{camera_id}] Usuário identificado: {user_name} (distância: {distance:.4f})")
+            self.recognizer.mark_validated(user_name, embedding)
+            result = RecognitionResult(
+                camera_id=camera_id,
+                kiosk_id=source.kiosk_id,
+                recognized=True,
+                user_name=user_name,
+                distance=distance
+            )
+        else:
+            state.attempts += 1
+            logger.warning(
+                f"❌ [{camera_id}] Rosto não reconhecido (distância: {distance:.4f}) "
+                f"- tentativa {state.attempts}/{state.max_attempts}"
+            )
+            if state.attempts < state.max_attempts:
+                return
+            result = RecognitionResult(
+                camera_id=camera_id,
+                kiosk_id=source.kiosk_id,
+                recognized=False,
+                distance=distance
+            )
+
+        state.loop.call_soon_threadsafe(self._resolve, state, result)
+
+    @staticmethod
+    def _resolve(state: _ValidationState, result: RecognitionResult):
+        """Conclui a validação no event loop"""
+        if not state.future.done():
+            state.future.set_result(result)
@@ -1,12 +1,31 @@
 import json
+import threading
 import cv2
 import numpy as np
 import time
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Optional, List, Any, Tuple
+from typing import Optional, List, Any, Tuple, Dict
 from pathlib import Path
 from deepface import DeepFace
 from loguru import logger
+from stella.config.settings import get_settings
+
+
+@dataclass
+class FaceMatch:
+    """Resultado de reconhecimento de um rosto dentro de um frame"""
+    bbox: Dict[str, int]  # {"x", "y", "w", "h"} no frame original
+    user_name: Optional[str]
+    distance: float
+    recognized: bool
+    embedding: Optional[np.ndarray] = None
+    timestamp: float = field(default_factory=time.time)
+
+    @property
+    def area(self) -> int:
+        return int(self.bbox.get("w", 0)) * int(self.bbox.get("h", 0))
+
 
 class FaceRecognizer:
     """Gerenciador de reconhecimento facial"""
@@ -29,6 +48,27 @@ class FaceRecognizer:
         self.embeddings_per_user = 6  # Quantos embeddings capturar por usuário
         self.capture_interval = 2  # Segundos entre capturas
         
+        # Processamento de múltiplos rostos por frame
+        settings = get_settings()
+        self.multi_face = settings.get('face_recognition.multi_face_enabled', False)
+        self.identity_precache = settings.get('face_recognition.identity_precache_enabled', False)
+        self.identity_precache_ttl = settings.get('face_recognition.identity_precache_ttl_seconds', 15)
+        self.identity_precache_margin = settings.get('face_recognition.identity_precache_margin', 0.75)
+        self._precached_identities: Dict[str, FaceMatch] = {}
+        self._lock = threading.RLock()  # identify_frame/mark_validated rodam nas threads do pool de inferência
+        
+        # Templates adaptativos (reservatório de embeddings recentes por usuário)
+        self.adaptive_templates = settings.get('face_recognition.adaptive_templates_enabled', False)
+        self.adaptive_reservoir_size = settings.get('face_recognition.adaptive_reservoir_size', 10)
+        self.adaptive_update_margin = settings.get('face_recognition.adaptive_update_margin', 0.5)
+        self.adaptive_min_gap = settings.get('face_recognition.adaptive_min_gap', 0.1)
+        self.adaptive_max_drift = settings.get('face_recognition.adaptive_max_drift', 0.15)
+        self.adaptive_min_interval = settings.get('face_recognition.adaptive_min_interval_seconds', 300)
+        
+        # Matriz de templates (média normalizada por usuário), reconstruída quando o banco muda
+        self._template_names: List[str] = []
+        self._template_matrix: Optional[np.ndarray] = None
+        
         # Carregar banco DEPOIS de definir model_name
         self.face_encodings = self._load_faces_database()
         
@@ -46,40 +86,57 @@ class FaceRecognizer:
             logger.error(f"Erro no DeepFace: {e}")
             return False
     
-    def _detect_face_in_frame(self, frame: np.ndarray) -> Optional[np.ndarray]:
+    def _detect_faces_in_frame(self, frame: np.ndarray) -> List[Tuple[np.ndarray, Dict[str, int]]]:
         """
-        Detecta e extrai rosto do frame usando DeepFace
+        Detecta e extrai todos os rostos do frame usando DeepFace
         
         Args:
             frame: Frame da câmera
             
         Returns:
-            Rosto detectado ou None se não encontrou
+            Lista de (rosto, bbox) ordenada do maior para o menor rosto
         """
         try:
-            # Usar DeepFace para extrair rostos
             faces = DeepFace.extract_faces(img_path=frame, enforce_detection=False, detector_backend='opencv')
-            
-            if not faces or len(faces) == 0:
-                return None
-            
-            # Se múltiplos rostos, pegar o maior (mais próximo)
-            if len(faces) > 1:
-                logger.debug(f"Detectados {len(faces)} rostos, usando o maior")
-                # Ordenar por tamanho (área da face)
-                faces = sorted(faces, key=lambda x: x['face'].shape[0] * x['face'].shape[1], reverse=True)
-            
-            face = faces[0]['face']
+        except Exception as e:
+            logger.debug(f"Erro ao detectar rostos: {e}")
+            return []
+        
+        detected = []
+        for face_obj in faces or []:
+            face = face_obj['face']
+            area = face_obj.get('facial_area') or {}
+            bbox = {k: int(area.get(k, 0)) for k in ("x", "y", "w", "h")}
+            if not bbox["w"] or not bbox["h"]:
+                bbox["w"], bbox["h"] = face.shape[1], face.shape[0]
             
             # Converter para uint8 se necessário
             if face.dtype != np.uint8:
                 face = (face * 255).astype(np.uint8)
+            detected.append((face, bbox))
+        
+        detected.sort(key=lambda item: item[1]["w"] * item[1]["h"], reverse=True)
+        return detected
+    
+    def _detect_face_in_frame(self, frame: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Detecta e extrai rosto do frame usando DeepFace
+        
+        Args:
+            frame: Frame da câmera
             
-            return face
-            
-        except Exception as e:
-            logger.debug(f"Erro ao detectar rosto: {e}")
+        Returns:
+            Rosto detectado ou None se não encontrou
+        """
+        faces = self._detect_faces_in_frame(frame)
+        if not faces:
             return None
+        
+        # Se múltiplos rostos, pegar o maior (mais próximo)
+        if len(faces) > 1:
+            logger.debug(f"Detectados {len(faces)} rostos, usando o maior")
+        
+        return faces[0][0]
     
     def _extract_embedding(self, face: np.ndarray) -> Optional[np.ndarray]:
         """
@@ -109,6 +166,34 @@ class FaceRecognizer:
             logger.error(f"Erro ao extrair embedding: {e}")
             return None
     
+    def _extract_embeddings_batch(self, faces: List[np.ndarray]) -> Tuple[List[int], Optional[np.ndarray]]:
+        """
+        Extrai os embeddings de vários rostos para a comparação em lote
+        
+        Cada rosto passa pelo DeepFace.represent, com o mesmo alinhamento e
+        normalização usados no cadastro; o lote está na comparação matricial.
+        Rostos cujo embedding falha (ex: desfocados) são ignorados sem
+        descartar os demais.
+        
+        Args:
+            faces: Imagens dos rostos
+            
+        Returns:
+            (índices dos rostos com embedding, matriz n_ok x dimensão ou None se nenhum)
+        """
+        indices = []
+        embeddings = []
+        for idx, face in enumerate(faces):
+            embedding = self._extract_embedding(face)
+            if embedding is None:
+                continue
+            indices.append(idx)
+            embeddings.append(embedding)
+        
+        if not embeddings:
+            return [], None
+        return indices, np.vstack(embeddings)
+    
     async def initialize_camera(self) -> bool:
         """
         Initialize camera for face recognition.
@@ -257,9 +342,12 @@ class FaceRecognizer:
                     "threshold": self.threshold
                 }
                 
-                self.face_encodings["users"][user_name] = user_data
+                with self._lock:
+                    self.face_encodings["users"][user_name] = user_data
+                    self._invalidate_templates()
+                    saved = self._save_faces_database()
                 
-                if self._save_faces_database():
+                if saved:
                     logger.success(f"🎉 Usuário {user_name} cadastrado com sucesso!")
                     cv2.destroyAllWindows()
                     return True
@@ -314,25 +402,334 @@ class FaceRecognizer:
         Returns:
             (nome_usuario, distancia) ou (None, inf) se não encontrou match
         """
-        best_match = None
-        best_distance = float('inf')
+        return self._match_embeddings(np.asarray(current_embedding).reshape(1, -1))[0]
+    
+    def _get_template_matrix(self) -> Tuple[List[str], Optional[np.ndarray]]:
+        """
+        Retorna os nomes e a matriz de templates normalizados (média dos embeddings de cada usuário)
         
-        for user_name, user_data in self.face_encodings.get("users", {}).items():
-            embeddings = user_data.get("embeddings", [])
+        A matriz é construída uma vez e reaproveitada até o banco ser alterado.
+        """
+        with self._lock:
+            return self._build_template_matrix()
+    
+    def _build_template_matrix(self) -> Tuple[List[str], Optional[np.ndarray]]:
+        if self._template_matrix is None:
+            names = []
+            templates = []
+            for user_name, user_data in self.face_encodings.get("users", {}).items():
+                template = self._user_template(user_data, include_recent=self.adaptive_templates)
+                if template is not None:
+                    names.append(user_name)
+                    templates.append(template)
             
-            # Calcular média dos embeddings do usuário
-            if embeddings:
-                embeddings_array = np.array(embeddings)
-                mean_embedding = np.mean(embeddings_array, axis=0)
-                
-                # Calcular distância
-                distance = self._calculate_distance(current_embedding, mean_embedding)
-                
-                if distance < best_distance:
-                    best_distance = distance
-                    best_match = user_name
+            if templates:
+                matrix = np.vstack(templates)
+                matrix = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+                self._template_matrix = matrix
+            else:
+                self._template_matrix = np.empty((0, 0))
+            self._template_names = names
+        
+        return self._template_names, self._template_matrix
+    
+    def _invalidate_templates(self):
+        """Força a reconstrução da matriz de templates na próxima comparação"""
+        with self._lock:
+            self._template_matrix = None
+            self._template_names = []
+    
+    def _match_embeddings(self, embeddings: np.ndarray) -> List[Tuple[Optional[str], float]]:
+        """
+        Compara vários embeddings com todos os usuários em um único produto matricial
+        
+        Args:
+            embeddings: Matriz (n x dimensão)
+            
+        Returns:
+            Lista de (nome_usuario, distancia) por embedding, ou (None, inf) sem usuários
+        """
+        with self._lock:
+            names, matrix = self._get_template_matrix()
+            if not names:
+                return [(None, float('inf'))] * len(embeddings)
+            matrix = matrix.copy()  # Atualizações adaptativas alteram linhas no lugar
+        
+        try:
+            normalized = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+            distances = 1 - normalized @ matrix.T
+        except Exception as e:
+            logger.error(f"Erro ao calcular distâncias: {e}")
+            return [(None, float('inf'))] * len(embeddings)
+        
+        best = np.argmin(distances, axis=1)
+        return [(names[idx], float(distances[row, idx])) for row, idx in enumerate(best)]
+    
+    def recognize_faces(self, frame: np.ndarray) -> List[FaceMatch]:
+        """
+        Reconhece todos os rostos do frame em uma única passada em lote
+        
+        Args:
+            frame: Frame da câmera
+            
+        Returns:
+            Lista de FaceMatch (com bbox) ordenada do maior para o menor rosto
+        """
+        detected = self._detect_faces_in_frame(frame)
+        if not detected:
+            return []
         
-        return best_match, best_distance
+        indices, embeddings = self._extract_embeddings_batch([face for face, _ in detected])
+        return self._build_matches(detected, indices, embeddings)
+    
+    def _build_matches(
+        self,
+        detected: List[Tuple[np.ndarray, Dict[str, int]]],
+        indices: List[int],
+        embeddings: Optional[np.ndarray]
+    ) -> List[FaceMatch]:
+        """
+        Compara em lote os rostos que tiveram embedding extraído
+        
+        Args:
+            detected: Rostos detectados (rosto, bbox)
+            indices: Posição em detected de cada linha de embeddings
+            embeddings: Matriz de embeddings (ou None)
+            
+        Returns:
+            Lista de FaceMatch na ordem de detected (rostos sem embedding ficam de fora)
+        """
+        if embeddings is None:
+            return []
+        
+        matches = []
+        for idx, embedding, (user_name, distance) in zip(indices, embeddings, self._match_embeddings(embeddings)):
+            matches.append(FaceMatch(
+                bbox=detected[idx][1],
+                user_name=user_name,
+                distance=distance,
+                recognized=bool(user_name) and distance < self.threshold,
+                embedding=embedding
+            ))
+        return matches
+    
+    def _precache_identities(self, matches: List[FaceMatch]):
+        """
+        Guarda identidades de pessoas na fila (rostos secundários reconhecidos com folga)
+        
+        Apenas matches com distância abaixo de threshold * identity_precache_margin entram no cache.
+        """
+        limit = self.threshold * self.identity_precache_margin
+        for match in matches:
+            if match.recognized and match.distance < limit:
+                with self._lock:
+                    self._precached_identities[match.user_name] = match
+                logger.debug(f"Identidade pré-carregada: {match.user_name} (distância: {match.distance:.4f})")
+    
+    def _distance_to_user(self, user_name: str, embedding: np.ndarray) -> float:
+        """Distância do embedding ao template de um único usuário (inf se não cadastrado)"""
+        with self._lock:
+            names, matrix = self._get_template_matrix()
+            if user_name not in names:
+                return float('inf')
+            template = matrix[names.index(user_name)].copy()
+        normalized = embedding / np.linalg.norm(embedding)
+        return float(1 - template @ normalized)
+    
+    def _take_precached_identity(self, embedding: np.ndarray) -> Optional[Tuple[str, float]]:
+        """
+        Consome a identidade pré-carregada, se houver exatamente uma válida
+        
+        O cache só indica quem provavelmente está à frente: a identidade só é
+        aceita se o embedding atual passar pelo threshold contra o template
+        desse usuário. Com mais de uma pessoa na fila não há como saber quem
+        chegou à frente, então a validação segue o caminho normal.
+        
+        Returns:
+            (nome_usuario, distancia) ou None para seguir com a comparação completa
+        """
+        now = time.time()
+        with self._lock:
+            self._precached_identities = {
+                name: match for name, match in self._precached_identities.items()
+                if now - match.timestamp <= self.identity_precache_ttl
+            }
+            if len(self._precached_identities) != 1:
+                return None
+            user_name = next(iter(self._precached_identities))
+        
+        # Só consome a identidade se conferir: um frame ruim não descarta o cache
+        distance = self._distance_to_user(user_name, embedding)
+        if distance >= self.threshold:
+            logger.debug(f"Identidade pré-carregada {user_name} não confere (distância: {distance:.4f})")
+            return None
+        with self._lock:
+            self._precached_identities.pop(user_name, None)
+        return user_name, distance
+    
+    def _match_primary_face(self, frame: np.ndarray) -> Tuple[bool, Optional[str], float, Optional[np.ndarray]]:
+        """
+        Identifica o rosto principal (maior) do frame
+        
+        Com multi_face ativo, todos os rostos são processados em lote e os
+        secundários são pré-carregados para a próxima validação.
+        
+        Returns:
+            (rosto_encontrado, nome_usuario, distancia, embedding)
+        """
+        if not self.multi_face:
+            face = self._detect_face_in_frame(frame)
+            if face is None:
+                return False, None, float('inf'), None
+            embedding = self._extract_embedding(face)
+            if embedding is None:
+                return False, None, float('inf'), None
+            logger.info("Comparando com usuários cadastrados...")
+            best_match, distance = self._find_best_match(embedding)
+            return True, best_match, distance, embedding
+        
+        # Detecção e embeddings uma única vez, usados pela pré-carga e pela comparação em lote
+        detected = self._detect_faces_in_frame(frame)
+        if not detected:
+            return False, None, float('inf'), None
+        primary_embedding = self._extract_embedding(detected[0][0])
+        primary_embedded = primary_embedding is not None
+        
+        if primary_embedded and self.identity_precache and self._precached_identities:
+            cached = self._take_precached_identity(primary_embedding)
+            if cached is not None:
+                user_name, distance = cached
+                logger.info(f"Usando identidade pré-carregada: {user_name} (distância: {distance:.4f})")
+                return True, user_name, distance, primary_embedding
+        
+        # Rostos secundários só são processados quando o cache não resolveu
+        other_indices, other_embeddings = self._extract_embeddings_batch([face for face, _ in detected[1:]])
+        indices = [idx + 1 for idx in other_indices]
+        rows = [] if other_embeddings is None else [other_embeddings]
+        if primary_embedded:
+            indices.insert(0, 0)
+            rows.insert(0, primary_embedding[np.newaxis, :])
+        embeddings = np.vstack(rows) if rows else None
+        
+        matches = self._build_matches(detected, indices, embeddings)
+        if len(detected) > 1:
+            logger.debug(f"Detectados {len(detected)} rostos, usando o maior")
+        
+        # O maior rosto sem embedding não é substituído por alguém atrás dele
+        others = matches[1:] if primary_embedded else matches
+        if others and self.identity_precache:
+            self._precache_identities(others)
+        if not primary_embedded:
+            return False, None, float('inf'), None
+        
+        primary = matches[0]
+        with self._lock:
+            self._precached_identities.pop(primary.user_name, None)
+        return True, primary.user_name, primary.distance, primary.embedding
+    
+    def identify_frame(self, frame: np.ndarray) -> Tuple[Optional[str], float, Optional[np.ndarray]]:
+        """
+        Detecta o rosto, extrai o embedding e compara com os usuários cadastrados
+        
+        Segue o mesmo caminho de validate_face (multi_face e pré-carga inclusos).
+        
+        Args:
+            frame: Frame da câmera
+            
+        Returns:
+            (nome_usuario, distancia, embedding) ou (None, inf, None) se não encontrou rosto/match
+        """
+        face_found, best_match, distance, embedding = self._match_primary_face(frame)
+        if not face_found:
+            return None, float('inf'), None
+        return best_match, distance, embedding
+    
+    def mark_validated(self, user_name: str, embedding: Optional[np.ndarray] = None):
+        """
+        Atualiza o último acesso do usuário e persiste o banco
+        
+        Pode ser chamado das threads de inferência do pool de câmeras: o banco,
+        a matriz de templates e a gravação do arquivo ficam sob o mesmo lock.
+        
+        Args:
+            user_name: Usuário validado
+            embedding: Embedding da validação, candidato à atualização adaptativa do template
+        """
+        with self._lock:
+            user_data = self.face_encodings["users"].get(user_name)
+            if user_data is None:
+                logger.warning(f"Usuário {user_name} removido antes de concluir a validação")
+                return
+            user_data["last_validated"] = datetime.now().isoformat()
+            if embedding is not None and self.adaptive_templates:
+                self._adapt_template(user_name, embedding)
+            self._save_faces_database()
+    
+    def _user_template(self, user_data: dict, include_recent: bool = True) -> Optional[np.ndarray]:
+        """Centroide do usuário: embeddings do cadastro mais o reservatório recente"""
+        embeddings = list(user_data.get("embeddings", []))
+        if include_recent:
+            embeddings += user_data.get("recent_embeddings", [])
+        if not embeddings:
+            return None
+        return np.mean(np.array(embeddings), axis=0)
+    
+    def _adapt_template(self, user_name: str, embedding: np.ndarray) -> bool:
+        """
+        Adiciona o embedding de uma validação de alta confiança ao reservatório do usuário
+        
+        Proteções contra envenenamento do template:
+        - distância abaixo de threshold * adaptive_update_margin
+        - vantagem mínima sobre o segundo usuário mais próximo
+        - próximo também do centroide original do cadastro
+        - centroide resultante não se afasta do cadastro além de adaptive_max_drift
+        - intervalo mínimo entre atualizações do mesmo usuário
+        Os embeddings do cadastro nunca são descartados.
+        
+        Returns:
+            True se o template foi atualizado
+        """
+        user_data = self.face_encodings["users"][user_name]
+        names, matrix = self._get_template_matrix()
+        if user_name not in names:
+            return False
+        
+        now = time.time()
+        if now - user_data.get("template_updated_at", 0) < self.adaptive_min_interval:
+            return False
+        
+        normalized = embedding / np.linalg.norm(embedding)
+        distances = 1 - matrix @ normalized
+        idx = names.index(user_name)
+        distance = float(distances[idx])
+        if distance >= self.threshold * self.adaptive_update_margin:
+            return False
+        
+        others = np.delete(distances, idx)
+        if others.size and float(others.min()) - distance < self.adaptive_min_gap:
+            logger.debug(f"Template de {user_name} não atualizado: match ambíguo")
+            return False
+        
+        enrollment = self._user_template(user_data, include_recent=False)
+        if self._calculate_distance(embedding, enrollment) >= self.threshold:
+            logger.debug(f"Template de {user_name} não atualizado: distante do cadastro")
+            return False
+        
+        recent = list(user_data.get("recent_embeddings", []))
+        recent.append(np.asarray(embedding).tolist())
+        recent = recent[-self.adaptive_reservoir_size:]
+        candidate = np.mean(np.array(list(user_data["embeddings"]) + recent), axis=0)
+        if self._calculate_distance(candidate, enrollment) > self.adaptive_max_drift:
+            logger.warning(f"⚠️ Template de {user_name} não atualizado: deriva acima do limite")
+            return False
+        
+        user_data["recent_embeddings"] = recent
+        user_data["template_updated_at"] = now
+        
+        # Atualiza apenas a linha do usuário na matriz de templates
+        matrix[idx] = candidate / np.linalg.norm(candidate)
+        logger.info(f"🔄 Template de {user_name} atualizado ({len(recent)} embedding(s) recentes)")
+        return True
     
     async def validate_face(self) -> Tuple[bool, str]:
         """
@@ -373,29 +770,20 @@ class FaceRecognizer:
                               (10, 70), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
                     cv2.imshow('Validacao - Olhe para a camera', display_frame)
                     
-                    # Detectar rosto
-                    face = self._detect_face_in_frame(frame)
-                    if face is not None:
-                        # Extrair embedding
-                        embedding = self._extract_embedding(face)
-                        if embedding is not None:
-                            logger.info("Comparando com usuários cadastrados...")
+                    # Detectar rosto e encontrar melhor match
+                    face_found, best_match, distance, embedding = self._match_primary_face(frame)
+                    if face_found:
+                        if best_match and distance < self.threshold:
+                            logger.success(f"✅ Usuário identificado: {best_match} (distância: {distance:.4f})")
                             
-                            # Encontrar melhor match
-                            best_match, distance = self._find_best_match(embedding)
+                            # Atualizar último acesso
+                            self.mark_validated(best_match, embedding)
                             
-                            if best_match and distance < self.threshold:
-                                logger.success(f"✅ Usuário identificado: {best_match} (distância: {distance:.4f})")
-                                
-                                # Atualizar último acesso
-                                self.face_encodings["users"][best_match]["last_validated"] = datetime.now().isoformat()
-                                self._save_faces_database()
-                                
-                                cv2.destroyAllWindows()
-                                return True, best_match
-                            else:
-                                logger.warning(f"❌ Rosto não reconhecido (distância: {distance:.4f}, threshold: {self.threshold})")
-                                face_detected = True  # Sair do loop de detecção
+                            cv2.destroyAllWindows()
+                            return True, best_match
+                        else:
+                            logger.warning(f"❌ Rosto não reconhecido (distância: {distance:.4f}, threshold: {self.threshold})")
+                            face_detected = True  # Sair do loop de detecção
                     else:
                         logger.debug("Nenhum rosto detectado, aguardando...")
                     
@@ -455,9 +843,13 @@ class FaceRecognizer:
         Returns:
             True if removal was successful, False otherwise
         """
-        if user_name in self.face_encodings.get("users", {}):
-            del self.face_encodings["users"][user_name]
-            if self._save_faces_database():
+        with self._lock:
+            removed = self.face_encodings.get("users", {}).pop(user_name, None) is not None
+            if removed:
+                self._invalidate_templates()
+                saved = self._save_faces_database()
+        if removed:
+            if saved:
                 logger.success(f"Usuário {user_name} removido com sucesso")
                 return True
             else:
@@ -496,7 +888,7 @@ class FaceRecognizer:
             # Criar diretório se não existe
             self.faces_db_path.parent.mkdir(parents=True, exist_ok=True)
             
-            with open(self.faces_db_path, 'w') as f:
+            with self._lock, open(self.faces_db_path, 'w') as f:
                 json.dump(self.face_encodings, f, indent=2)
             logger.success("Banco de dados salvo com sucesso")
             return True
@@ -0,0 +1,66 @@
+"""
+Testes do carrinho de retirada pendente
+"""
+import pytest
+
+from stella.agent.cart import CartStore, is_cancellation, is_confirmation
+
+
+@pytest.mark.parametrize("fala", ["sim", "sim, confirmo", "pode mandar", "isso mesmo, obrigado", "Confirmo, Stella"])
+def test_confirmacoes_simples(fala):
+    assert is_confirmation(fala)
+
+
+@pytest.mark.parametrize("fala", ["sim, mas troca para 3", "sim, cinco", "não", "quero luvas", ""])
+def test_nao_sao_confirmacoes(fala):
+    assert not is_confirmation(fala)
+
+
+@pytest.mark.parametrize("fala", ["não", "pode cancelar", "deixa pra lá", "não quero mais"])
+def test_cancelamentos(fala):
+    assert is_cancellation(fala)
+
+
+@pytest.mark.parametrize("fala", ["não, quero 3", "não, a luva", "sim", "cancela duas luvas"])
+def test_nao_sao_cancelamentos(fala):
+    assert not is_cancellation(fala)
+
+
+def test_carrinho_guarda_so_itens_com_quantidade():
+    carts = CartStore()
+
+    cart = carts.set("s1", [{"productName": "luva_m", "quantity": "2"}, {"productName": "gaze", "quantity": 0}])
+
+    assert cart.items == [{"productName": "luva_m", "quantity": 2}]
+    assert carts.set("s1", [{"productName": "gaze", "quantity": 0}]) is None
+    assert "s1" not in carts
+
+
+def test_carrinho_compara_itens_sem_depender_da_ordem():
+    carts = CartStore()
+    cart = carts.set("s1", [{"productName": "luva_m", "quantity": 2}, {"productName": "gaze", "quantity": 1}])
+
+    assert cart.matches([{"productName": "gaze", "quantity": 1}, {"productName": "luva_m", "quantity": 2}])
+    assert not cart.matches([{"productName": "luva_m", "quantity": 3}, {"productName": "gaze", "quantity": 1}])
+    assert cart.describe({"luva_m": {"name": "Luva M"}}) == "2 Luva M, 1 gaze"
+
+
+def test_carrinho_descartado_fora_do_fluxo_de_retirada():
+    carts = CartStore()
+    carts.set("s1", [{"productName": "luva_m", "quantity": 2}])
+
+    assert not carts.clear_unless_withdraw("s1", "withdraw_request")
+    assert not carts.clear_unless_withdraw("s1", "withdraw_confirm")
+    assert carts.clear_unless_withdraw("s1", "stock_query")
+    assert "s1" not in carts
+
+
+def test_carrinho_serializado_entre_workers():
+    a, b = CartStore(), CartStore()
+    a.set("s1", [{"productName": "luva_m", "quantity": 2}])
+
+    b.restore("s1", a.to_dict("s1"))
+    assert b.pending_names("s1") == ["luva_m"]
+
+    b.restore("s1", None)
+    assert "s1" not in b
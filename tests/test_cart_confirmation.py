@@ -0,0 +1,100 @@
+"""
+Testes do fluxo de confirmação/cancelamento do carrinho no speech_processor
+"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("dotenv")
+pytest.importorskip("pika")
+
+from stella.agent import speech_processor
+from stella.agent.cart import carts
+from stella.agent.product_index import ProductIndex
+
+STOCK = {
+    "luva_m": {"name": "Luva M", "quantity": 10},
+    "gaze": {"name": "Gaze", "quantity": 1},
+}
+
+
+@pytest.fixture
+def published(monkeypatch):
+    calls = []
+
+    async def publish(session_id, items, withdraw_by=None):
+        calls.append((session_id, items))
+
+    monkeypatch.setattr(speech_processor, "publish_withdraw_confirm", publish)
+    yield calls
+    carts.pop("s1")
+
+
+def _validate(resultado, stock=STOCK):
+    return asyncio.run(speech_processor.validate_result(resultado, "s1", stock, ProductIndex(stock)))
+
+
+def _request(*items):
+    return {
+        "intention": "withdraw_request",
+        "items": [{"productName": name, "quantity": qty} for name, qty in items],
+        "response": "Confirma?",
+        "stella_analysis": "normal",
+    }
+
+
+def _confirm(*items):
+    return {**_request(*items), "intention": "withdraw_confirm", "response": "Confirmado."}
+
+
+def test_carrinho_guarda_so_itens_disponiveis(published):
+    _validate(_request(("luva_m", 2), ("gaze", 5), ("parafuso", 1)))
+
+    assert carts.get("s1").items == [{"productName": "luva_m", "quantity": 2}]
+
+
+def test_confirmacao_local_publica_o_carrinho_guardado(published):
+    _validate(_request(("luvas m", 2)))
+
+    resultado = asyncio.run(speech_processor.confirm_cart("s1", STOCK, ProductIndex(STOCK)))
+
+    assert resultado["intention"] == "withdraw_confirm"
+    assert published == [("s1", [{"productName": "luva_m", "quantity": 2}])]
+    assert "s1" not in carts
+
+
+def test_confirmacao_sem_carrinho_nao_publica(published):
+    resultado = _validate(_confirm(("luva_m", 2)))
+
+    assert resultado["intention"] == "doubt"
+    assert published == []
+
+
+def test_confirmacao_com_itens_diferentes_vira_edicao(published):
+    _validate(_request(("luva_m", 2)))
+
+    resultado = _validate(_confirm(("luva_m", 5)))
+
+    assert resultado["intention"] == "withdraw_request"
+    assert published == []
+    assert carts.get("s1").items == [{"productName": "luva_m", "quantity": 5}]
+
+
+def test_estoque_mudou_antes_da_confirmacao(published):
+    _validate(_request(("luva_m", 2)))
+
+    resultado = _validate(_confirm(), stock={"luva_m": {"name": "Luva M", "quantity": 1}})
+
+    assert resultado["intention"] == "doubt"
+    assert published == []
+
+
+def test_cancelamento_e_mudanca_de_assunto_descartam_o_carrinho(published):
+    _validate(_request(("luva_m", 2)))
+    assert speech_processor.cancel_cart("s1")["intention"] == "normal"
+    assert "s1" not in carts
+
+    _validate(_request(("luva_m", 2)))
+    _validate({"intention": "stock_query", "items": [], "response": "Temos 10.", "stella_analysis": "normal"})
+    assert "s1" not in carts
+    assert published == []
@@ -0,0 +1,66 @@
+"""
+Testes da gravação/reprodução de cassetes
+"""
+import asyncio
+import time
+
+import pytest
+
+from stella.agent.cassette import Cassette, CassetteMiss
+from stella.agent.stock_cache import StockSnapshot
+
+STOCK = {"luva_m": {"name": "Luva M", "quantity": 10}}
+CONTENTS = [{"role": "user", "parts": [{"text": "quero 2 luvas"}]}]
+
+
+def _record(path):
+    cassette = Cassette(path, "record")
+    cassette.record_stock(StockSnapshot(items=STOCK, version="v1", fetched_at=time.time()), 12.0)
+    cassette.record_llm(CONTENTS, '{"intention": "withdraw_request"}', 250.0, chunk_offsets_ms=[100.0, 250.0],
+                        chunks=['{"intention": ', '"withdraw_request"}'])
+    cassette.record_turn("s1", "quero 2 luvas", {"intention": "withdraw_request"}, 300.0)
+    return cassette
+
+
+@pytest.mark.parametrize("name", ["stella.jsonl", "stella.jsonl.gz"])
+def test_grava_em_diretorio_novo_e_reproduz(tmp_path, name):
+    path = tmp_path / "ainda" / "nao" / "existe" / name
+    _record(path).close()
+
+    replay = Cassette(path, "replay")
+
+    async def scenario():
+        response = await replay.replay_llm(CONTENTS)
+        chunks = [chunk.text async for chunk in await replay.replay_llm(CONTENTS, stream=True)]
+        snapshot = await replay.replay_stock()
+        return response.text, chunks, snapshot
+
+    text, chunks, snapshot = asyncio.run(scenario())
+    assert text == '{"intention": "withdraw_request"}'
+    assert chunks == ['{"intention": ', '"withdraw_request"}']
+    assert snapshot.items == STOCK and snapshot.version == "v1"
+    assert [t["utterance"] for t in replay.turns] == ["quero 2 luvas"]
+
+
+def test_gz_sem_close_e_legivel(tmp_path):
+    path = tmp_path / "stella.jsonl.gz"
+    _record(path)  # processo encerrado sem close()
+
+    assert len(Cassette(path, "replay").turns) == 1
+
+
+def test_falha_de_gravacao_nao_interrompe_o_turno(tmp_path):
+    blocker = tmp_path / "arquivo"
+    blocker.write_text("")
+    for name in ("stella.jsonl", "stella.jsonl.gz"):
+        cassette = Cassette(blocker / name, "record")  # diretório pai é um arquivo
+        cassette.record_turn("s1", "quero 2 luvas", {"intention": "withdraw_request"}, 300.0)
+        cassette.close()
+
+
+def test_chamada_sem_gravacao(tmp_path):
+    path = tmp_path / "stella.jsonl"
+    _record(path).close()
+
+    with pytest.raises(CassetteMiss):
+        asyncio.run(Cassette(path, "replay").replay_llm([{"role": "user", "parts": [{"text": "outra"}]}]))
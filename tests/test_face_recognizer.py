@@ -0,0 +1,94 @@
+"""
+Testes do caminho multi-rosto do reconhecimento facial (sem câmera nem modelo)
+"""
+import numpy as np
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("deepface")
+
+from stella.face_id.face_recognizer import FaceMatch, FaceRecognizer
+
+
+def _face(tag: int) -> np.ndarray:
+    return np.full((4, 4, 3), tag, dtype=np.uint8)
+
+
+def _bbox(size: int):
+    return {"x": 0, "y": 0, "w": size, "h": size}
+
+
+@pytest.fixture
+def recognizer(monkeypatch, tmp_path):
+    monkeypatch.setattr(FaceRecognizer, "_load_faces_database", lambda self: {
+        "users": {
+            "ana": {"embeddings": [[1.0, 0.0, 0.0]]},
+            "bia": {"embeddings": [[0.0, 1.0, 0.0]]},
+        }
+    })
+    monkeypatch.setattr(FaceRecognizer, "_save_faces_database", lambda self: True)
+    rec = FaceRecognizer()
+    rec.multi_face = True
+    rec.identity_precache = True
+    return rec
+
+
+def _stub_frame(monkeypatch, rec, faces):
+    """faces: lista de (tag, tamanho, embedding ou None se falhar)"""
+    embeddings = {tag: emb for tag, _, emb in faces}
+    calls = []
+
+    def extract(face):
+        tag = int(face[0, 0, 0])
+        calls.append(tag)
+        emb = embeddings[tag]
+        return None if emb is None else np.array(emb, dtype=float)
+
+    monkeypatch.setattr(rec, "_detect_faces_in_frame", lambda frame: [(_face(tag), _bbox(size)) for tag, size, _ in faces])
+    monkeypatch.setattr(rec, "_extract_embedding", extract)
+    return calls
+
+
+def test_rosto_secundario_sem_embedding_nao_impede_o_principal(monkeypatch, recognizer):
+    _stub_frame(monkeypatch, recognizer, [(1, 100, [1.0, 0.0, 0.0]), (2, 50, None), (3, 40, [0.0, 1.0, 0.0])])
+
+    matches = recognizer.recognize_faces(np.zeros((10, 10, 3)))
+
+    assert [m.user_name for m in matches] == ["ana", "bia"]
+    assert [m.bbox["w"] for m in matches] == [100, 40]
+    assert recognizer.identify_frame(np.zeros((10, 10, 3)))[0] == "ana"
+
+
+def test_principal_sem_embedding_nao_e_trocado_por_quem_esta_atras(monkeypatch, recognizer):
+    _stub_frame(monkeypatch, recognizer, [(1, 100, None), (2, 50, [0.0, 1.0, 0.0])])
+
+    assert recognizer.identify_frame(np.zeros((10, 10, 3))) == (None, float("inf"), None)
+    assert "bia" in recognizer._precached_identities
+
+
+def test_cache_acertado_extrai_so_o_rosto_principal(monkeypatch, recognizer):
+    recognizer._precached_identities["ana"] = FaceMatch(_bbox(50), "ana", 0.01, True)
+    calls = _stub_frame(monkeypatch, recognizer, [(1, 100, [1.0, 0.0, 0.0]), (2, 50, [0.0, 1.0, 0.0])])
+
+    assert recognizer.identify_frame(np.zeros((10, 10, 3)))[0] == "ana"
+    assert calls == [1]
+    assert recognizer._precached_identities == {}
+
+
+def test_cache_errado_extrai_cada_rosto_uma_unica_vez(monkeypatch, recognizer):
+    recognizer._precached_identities["ana"] = FaceMatch(_bbox(50), "ana", 0.01, True)
+    calls = _stub_frame(monkeypatch, recognizer, [(1, 100, [0.0, 1.0, 0.0]), (2, 50, [0.0, 0.0, 1.0])])
+
+    assert recognizer.identify_frame(np.zeros((10, 10, 3)))[0] == "bia"
+    assert sorted(calls) == [1, 2]
+
+
+def test_frame_que_nao_confere_mantem_identidade_pre_carregada(monkeypatch, recognizer):
+    recognizer._precached_identities["ana"] = FaceMatch(_bbox(50), "ana", 0.01, True)
+
+    assert recognizer._take_precached_identity(np.array([0.0, 1.0, 0.0])) is None
+    assert "ana" in recognizer._precached_identities
+
+    user_name, distance = recognizer._take_precached_identity(np.array([1.0, 0.0, 0.0]))
+    assert user_name == "ana" and distance < recognizer.threshold
+    assert recognizer._precached_identities == {}
@@ -0,0 +1,111 @@
+"""
+Testes da deduplicação de requisições repetidas (retries do quiosque)
+"""
+import asyncio
+
+import pytest
+
+from stella.agent.idempotency import IdempotentTurns
+from stella.agent.session_backend import SQLiteSessionBackend
+
+
+def _counting_factory(result, delay: float = 0):
+    calls = []
+
+    async def factory():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return result() if callable(result) else result
+
+    return factory, calls
+
+
+def test_repeticao_simultanea_aguarda_o_mesmo_turno():
+    turns = IdempotentTurns()
+    factory, calls = _counting_factory({"intention": "normal"}, delay=0.05)
+
+    async def scenario():
+        return await asyncio.gather(turns.run(("s1", "c1"), factory), turns.run(("s1", "c1"), factory))
+
+    first, second = asyncio.run(scenario())
+
+    assert first == second == {"intention": "normal"}
+    assert len(calls) == 1
+
+
+def test_repeticao_depois_do_fim_recebe_o_resultado_guardado():
+    turns = IdempotentTurns()
+    factory, calls = _counting_factory({"intention": "normal"})
+
+    async def scenario():
+        await turns.run(("s1", "c1"), factory)
+        await turns.run(("s1", "c1"), factory)
+        await turns.run(("s1", "c2"), factory)
+
+    asyncio.run(scenario())
+
+    assert len(calls) == 2
+
+
+def test_resultado_nao_reenviavel_e_excecao_nao_sao_guardados():
+    turns = IdempotentTurns()
+    factory, calls = _counting_factory({"processing_error": True})
+    cacheable = lambda r: not r.get("processing_error")
+
+    async def failing():
+        calls.append(1)
+        raise RuntimeError("inventário fora")
+
+    async def scenario():
+        await turns.run(("s1", "c1"), factory, cacheable=cacheable)
+        await turns.run(("s1", "c1"), factory, cacheable=cacheable)
+        with pytest.raises(RuntimeError):
+            await turns.run(("s1", "c2"), failing)
+        await turns.run(("s1", "c2"), factory)
+
+    asyncio.run(scenario())
+
+    assert len(calls) == 4
+
+
+def test_workers_diferentes_processam_uma_unica_vez(tmp_path):
+    a = IdempotentTurns(backend=SQLiteSessionBackend(tmp_path / "s.db"))
+    b = IdempotentTurns(backend=SQLiteSessionBackend(tmp_path / "s.db"))
+    factory, calls = _counting_factory({"intention": "withdraw_confirm"}, delay=0.1)
+
+    async def scenario():
+        return await asyncio.gather(a.run(("s1", "c1"), factory), b.run(("s1", "c1"), factory))
+
+    assert asyncio.run(scenario()) == [{"intention": "withdraw_confirm"}] * 2
+    assert len(calls) == 1
+
+
+def test_erro_de_processamento_nao_fica_no_backend(tmp_path):
+    backend = SQLiteSessionBackend(tmp_path / "s.db")
+    a, b = IdempotentTurns(backend=backend), IdempotentTurns(backend=SQLiteSessionBackend(tmp_path / "s.db"))
+    factory, calls = _counting_factory({"processing_error": True})
+    cacheable = lambda r: not r.get("processing_error")
+
+    async def scenario():
+        await a.run(("s1", "c1"), factory, cacheable=cacheable)
+        await b.run(("s1", "c1"), factory, cacheable=cacheable)
+
+    asyncio.run(scenario())
+
+    assert len(calls) == 2
+    assert backend.load_request("s1:c1") == (False, None)
+
+
+def test_turno_mais_longo_que_o_prazo_do_registro_nao_e_reprocessado(tmp_path):
+    a = IdempotentTurns(backend=SQLiteSessionBackend(tmp_path / "s.db"), in_flight_ttl_seconds=0.2)
+    b = IdempotentTurns(backend=SQLiteSessionBackend(tmp_path / "s.db"), in_flight_ttl_seconds=0.2)
+    factory, calls = _counting_factory({"intention": "withdraw_confirm"}, delay=0.8)
+
+    async def scenario():
+        first = asyncio.create_task(a.run(("s1", "c1"), factory))
+        await asyncio.sleep(0.5)  # retry chega em outro worker depois do prazo inicial do registro
+        second = await b.run(("s1", "c1"), factory)
+        return await first, second
+
+    assert asyncio.run(scenario()) == ({"intention": "withdraw_confirm"},) * 2
+    assert len(calls) == 1
@@ -0,0 +1,48 @@
+"""
+Testes da leitura progressiva do campo "response" no JSON do Gemini
+"""
+import json
+
+import pytest
+
+from stella.agent.json_stream import ResponseFieldStreamer
+
+RESPOSTA = {
+    "intention": "withdraw_request",
+    "items": [{"productName": "luva_m", "response": "não é este", "quantity": 2}],
+    "response": "Você confirma a retirada de 2 \"Luva M\"?\nÉ só dizer sim.",
+    "stella_analysis": "normal",
+}
+
+
+def _feed(text: str, size: int):
+    streamer = ResponseFieldStreamer()
+    pieces = [streamer.feed(text[i:i + size]) for i in range(0, len(text), size)]
+    return streamer, pieces
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 1000])
+def test_texto_do_response_em_qualquer_divisao_dos_pedacos(size):
+    text = "```json\n" + json.dumps(RESPOSTA, ensure_ascii=True) + "\n```"
+
+    streamer, pieces = _feed(text, size)
+
+    assert "".join(pieces) == RESPOSTA["response"]
+    assert streamer.fields["intention"] == "withdraw_request"
+    assert streamer.fields["response"] == RESPOSTA["response"]
+
+
+def test_texto_sai_antes_do_fim_do_json():
+    streamer = ResponseFieldStreamer()
+
+    assert streamer.feed('{"intention": "normal", "response": "Bom d') == "Bom d"
+    assert streamer.feed('ia!", "stella_analysis": "nor') == "ia!"
+    assert streamer.fields == {"intention": "normal", "response": "Bom dia!"}
+
+
+def test_campo_aninhado_com_mesmo_nome_nao_e_transmitido():
+    streamer = ResponseFieldStreamer()
+
+    out = streamer.feed('{"items": [{"response": "x"}], "response": "ok"}')
+
+    assert out == "ok"
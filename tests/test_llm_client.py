@@ -0,0 +1,137 @@
+"""
+Testes do cliente assíncrono do LLM (fila por prioridade e hedge)
+"""
+import asyncio
+
+import pytest
+
+from stella.agent.llm_client import (
+    PRIORITY_CONFIRM,
+    AsyncLLMClient,
+    PRIORITY_DEFAULT,
+    PRIORITY_QUERY,
+    LLMOverloadedError,
+    PriorityLimiter,
+)
+
+
+def test_fila_atende_por_prioridade_e_fifo_no_empate():
+    limiter = PriorityLimiter(max_concurrency=1)
+    order = []
+
+    async def call(name, priority):
+        async with limiter.slot(priority, timeout=None):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        first = asyncio.create_task(call("primeira", PRIORITY_DEFAULT))
+        await asyncio.sleep(0)
+        waiting = [
+            asyncio.create_task(call(name, priority))
+            for name, priority in [
+                ("consulta", PRIORITY_QUERY),
+                ("default_1", PRIORITY_DEFAULT),
+                ("confirmacao", PRIORITY_CONFIRM),
+                ("default_2", PRIORITY_DEFAULT),
+            ]
+        ]
+        await asyncio.gather(first, *waiting)
+
+    asyncio.run(scenario())
+
+    assert order == ["primeira", "confirmacao", "default_1", "default_2", "consulta"]
+    assert limiter.in_flight == 0
+
+
+def test_fila_cheia_rejeita_na_hora():
+    limiter = PriorityLimiter(max_concurrency=1, max_queue=1)
+
+    async def scenario():
+        await limiter.acquire(PRIORITY_DEFAULT, None)
+        queued = asyncio.create_task(limiter.acquire(PRIORITY_DEFAULT, None))
+        await asyncio.sleep(0)
+        with pytest.raises(LLMOverloadedError):
+            await limiter.acquire(PRIORITY_CONFIRM, None)
+        limiter.release()
+        await queued
+        limiter.release()
+
+    asyncio.run(scenario())
+
+    assert limiter.in_flight == 0
+
+
+def test_prazo_esgotado_na_fila_nao_consome_vaga():
+    limiter = PriorityLimiter(max_concurrency=1)
+
+    async def scenario():
+        await limiter.acquire(PRIORITY_DEFAULT, None)
+        with pytest.raises(asyncio.TimeoutError):
+            await limiter.acquire(PRIORITY_DEFAULT, timeout=0.01)
+        assert limiter.queue_depth == 0
+        limiter.release()
+        await asyncio.wait_for(limiter.acquire(PRIORITY_DEFAULT, None), 0.1)
+        limiter.release()
+
+    asyncio.run(scenario())
+
+    assert limiter.in_flight == 0
+
+
+def _attempts(*plan):
+    """plan[n] = (atraso, resultado ou exceção) da tentativa n"""
+    started = []
+
+    async def make_attempt(n):
+        started.append(n)
+        delay, outcome = plan[n]
+        await asyncio.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    return make_attempt, started
+
+
+def _hedged(make_attempt, hedge_delay, timeout=None, is_valid=lambda r: r != "invalida"):
+    client = AsyncLLMClient(model=None)
+    return asyncio.run(client.hedged(make_attempt, is_valid, hedge_delay, timeout=timeout))
+
+
+def test_tentativa_lenta_dispara_hedge_e_a_mais_rapida_vence():
+    make_attempt, started = _attempts((1.0, "lenta"), (0.01, "rapida"))
+
+    assert _hedged(make_attempt, hedge_delay=0.05) == "rapida"
+    assert started == [0, 1]
+
+
+def test_resposta_rapida_nao_dispara_hedge():
+    make_attempt, started = _attempts((0.01, "ok"), (0.01, "nao usada"))
+
+    assert _hedged(make_attempt, hedge_delay=0.5) == "ok"
+    assert started == [0]
+
+
+def test_falha_ou_resposta_invalida_antecipa_a_proxima_tentativa():
+    make_attempt, started = _attempts((0.0, RuntimeError("503")), (0.01, "ok"))
+    assert _hedged(make_attempt, hedge_delay=5) == "ok"
+
+    make_attempt, started = _attempts((0.0, "invalida"), (0.01, "invalida"))
+    assert _hedged(make_attempt, hedge_delay=5) == "invalida"
+    assert started == [0, 1]
+
+
+def test_orcamento_esgotado_cancela_as_tentativas():
+    make_attempt, started = _attempts((1.0, "lenta"), (1.0, "lenta"))
+
+    with pytest.raises(asyncio.TimeoutError):
+        _hedged(make_attempt, hedge_delay=0.02, timeout=0.1)
+    assert started == [0, 1]
+
+
+def test_todas_as_tentativas_falham():
+    make_attempt, _ = _attempts((0.0, RuntimeError("503")), (0.0, ValueError("json")))
+
+    with pytest.raises(ValueError):
+        _hedged(make_attempt, hedge_delay=None)
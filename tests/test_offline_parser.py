@@ -0,0 +1,73 @@
+"""
+Testes do interpretador offline de pedidos de retirada
+"""
+import pytest
+
+from stella.agent.offline_parser import OfflineWithdrawParser, _read_number, _tokens, parse_withdraw
+from stella.agent.product_index import ProductIndex
+
+STOCK = {
+    "seringa_10ml": {"name": "Seringa 10ml"},
+    "luva": {"name": "Luva"},
+    "agulha_insulina": {"name": "Agulha Insulina"},
+    "gaze": {"name": "Gaze"},
+}
+
+
+@pytest.fixture
+def index():
+    return ProductIndex(STOCK)
+
+
+def _items(parse):
+    return [(it.product_name, it.quantity) for it in parse.items]
+
+
+@pytest.mark.parametrize("text, value", [
+    ("tres", 3),
+    ("vinte e cinco", 25),
+    ("cento e dez", 110),
+    ("mil e duzentos", 1200),
+    ("dois mil", 2000),
+    ("meia duzia", 6),
+    ("duas duzias", 24),
+    ("15", 15),
+])
+def test_numeros_por_extenso(text, value):
+    assert _read_number(_tokens(text), 0)[0] == value
+
+
+def test_medida_faz_parte_do_nome_e_nao_e_quantidade(index):
+    parse = parse_withdraw("quero cinco seringas de dez ml e duas luvas", index)
+
+    assert _items(parse) == [("seringa_10ml", 5), ("luva", 2)]
+    assert parse.simple
+
+
+def test_varios_itens_com_unidades_e_conectivos(index):
+    parse = parse_withdraw("stella, pegar 2 unidades de luva mais meia dúzia de gaze, 3 agulhas de insulina por favor", index)
+
+    assert _items(parse) == [("luva", 2), ("gaze", 6), ("agulha_insulina", 3)]
+    assert parse.simple
+
+
+@pytest.mark.parametrize("text", ["quantas luvas tem?", "não quero luvas", "quero luva", "bom dia"])
+def test_perguntas_negacoes_e_falas_sem_quantidade_ficam_para_o_llm(index, text):
+    assert parse_withdraw(text, index) is None
+
+
+def test_produto_desconhecido_nao_e_simples(index):
+    parse = parse_withdraw("quero 3 parafusos", index)
+
+    assert _items(parse) == [("parafusos", 3)]
+    assert not parse.resolved
+    assert OfflineWithdrawParser().interpret("quero 3 parafusos", index, STOCK, require_simple=True) is None
+
+
+def test_resposta_no_contrato_do_llm(index):
+    resposta = OfflineWithdrawParser().interpret("quero 2 luvas", index, STOCK)
+
+    assert resposta["intention"] == "withdraw_request"
+    assert resposta["items"] == [{"productName": "luva", "quantity": 2}]
+    assert resposta["response"] == "Você confirma a retirada de 2 Luva?"
+    assert OfflineWithdrawParser(enabled=False).interpret("quero 2 luvas", index, STOCK) is None
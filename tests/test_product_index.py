@@ -0,0 +1,43 @@
+"""
+Testes do índice de resolução de nomes de produtos
+"""
+from stella.agent.product_index import ProductIndex, measures
+
+
+def _index(*keys):
+    return ProductIndex({key: {"name": key.replace("_", " ").capitalize()} for key in keys})
+
+
+def test_measures_extrai_numero_e_unidade():
+    assert measures("Seringa 10 mls") == [("10", "ml")]
+    assert measures("seringa_20ml") == [("20", "ml")]
+    assert measures("luva_m") == []
+
+
+def test_medida_diferente_nao_resolve_para_outro_produto():
+    index = _index("seringa_20ml", "luva_m")
+
+    assert index.resolve("seringa 10ml") == []
+    assert index.best("seringa 10ml") is None
+
+
+def test_medida_igual_resolve_por_aproximacao():
+    index = _index("seringa_10ml", "seringa_20ml")
+
+    candidate = index.best("seringa 10 mls")
+    assert candidate is not None
+    assert candidate.key == "seringa_10ml"
+    assert [c.key for c in index.resolve("seringa 10 mls")] == ["seringa_10ml"]
+
+
+def test_fala_sem_medida_mantem_candidatos():
+    index = _index("seringa_10ml", "seringa_20ml")
+
+    assert {c.key for c in index.resolve("seringa")} == {"seringa_10ml", "seringa_20ml"}
+
+
+def test_nome_exato_e_canonico():
+    index = _index("seringa_20ml")
+
+    assert index.best("Seringa 20ml").method == "exact"
+    assert index.best("seringas 20 ml").method == "canonical"
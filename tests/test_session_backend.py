@@ -0,0 +1,80 @@
+"""
+Testes do estado de sessão compartilhado entre workers (backend SQLite)
+"""
+import asyncio
+
+import pytest
+
+from stella.agent.cart import CartStore
+from stella.agent.session_backend import SessionBusyError, SessionStateSync, SQLiteSessionBackend
+from stella.agent.session_store import SessionStore
+
+
+def _worker(path, **kwargs) -> SessionStateSync:
+    return SessionStateSync(SQLiteSessionBackend(path), SessionStore(), CartStore(), **kwargs)
+
+
+async def _turn(worker: SessionStateSync, session_id: str, utterance: str, items=None):
+    async with worker.locked(session_id):
+        await worker.restore(session_id)
+        worker.store.get_or_create(session_id).add_exchange(utterance, {"intention": "withdraw_request", "stella_analysis": utterance})
+        if items is not None:
+            worker.carts.set(session_id, items)
+        await worker.persist(session_id)
+
+
+def test_turnos_em_workers_diferentes_compartilham_historico_e_carrinho(tmp_path):
+    a, b = _worker(tmp_path / "s.db"), _worker(tmp_path / "s.db")
+
+    async def scenario():
+        await _turn(a, "s1", "quero 2 luvas", items=[{"productName": "luva_m", "quantity": 2}])
+        await _turn(b, "s1", "e uma seringa")
+
+    asyncio.run(scenario())
+
+    assert len(b.store.get("s1")) == 4
+    assert b.carts.get("s1").items == [{"productName": "luva_m", "quantity": 2}]
+
+
+def test_sessao_encerrada_em_outro_worker_nao_volta_no_persist(tmp_path):
+    a, b = _worker(tmp_path / "s.db"), _worker(tmp_path / "s.db")
+
+    async def scenario():
+        await _turn(a, "s1", "quero 2 luvas", items=[{"productName": "luva_m", "quantity": 2}])
+        await b.delete("s1")
+        await _turn(a, "s1", "bom dia")
+
+    asyncio.run(scenario())
+
+    assert "s1" not in a.carts
+    assert len(a.store.get("s1")) == 2  # só o turno novo
+    state = a.backend.load("s1")
+    assert state["cart"] is None
+    assert [role for role, _ in state["history"]["turns"]] == ["user", "model"]
+
+
+def test_lock_entre_workers_serializa_os_turnos(tmp_path):
+    a, b = _worker(tmp_path / "s.db"), _worker(tmp_path / "s.db")
+
+    async def scenario():
+        await asyncio.gather(*(
+            _turn(worker, "s1", f"fala {i}")
+            for i in range(3) for worker in (a, b)
+        ))
+
+    asyncio.run(scenario())
+
+    assert len(a.backend.load("s1")["history"]["turns"]) == 12
+
+
+def test_lock_mantido_por_outro_worker_gera_sessao_ocupada(tmp_path):
+    a = _worker(tmp_path / "s.db")
+    b = _worker(tmp_path / "s.db", lock_wait_seconds=0.05)
+    assert a.backend.acquire_lock("s1", "outro", ttl_seconds=30)
+
+    async def scenario():
+        async with b.locked("s1"):
+            pass
+
+    with pytest.raises(SessionBusyError):
+        asyncio.run(scenario())
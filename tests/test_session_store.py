@@ -0,0 +1,69 @@
+"""
+Testes do armazenamento de sessões (expiração por heap e orçamento de memória)
+"""
+import asyncio
+
+from stella.agent.session_concurrency import SessionLocks
+from stella.agent.session_store import SessionStore
+
+
+def _fill(store: SessionStore, session_id: str, turns: int = 3):
+    history = store.get_or_create(session_id)
+    for i in range(turns):
+        history.add_exchange(f"quero {i} luvas " * 10, {"intention": "withdraw_request", "stella_analysis": "ok " * 20})
+    return history
+
+
+def test_sweep_expira_so_as_sessoes_vencidas():
+    removed = []
+    store = SessionStore(ttl_seconds=10, on_remove=removed.append)
+    store.get_or_create("a")
+    store.get_or_create("b")
+    store._last_seen["b"] += 8  # renovada depois
+
+    assert store.sweep(now=store.last_seen("a") + 11) == 1
+    assert removed == ["a"]
+    assert "b" in store and "a" not in store
+
+
+def test_sessao_vencida_recomeca_do_zero():
+    store = SessionStore(ttl_seconds=10)
+    old = _fill(store, "a")
+    store._last_seen["a"] -= 11
+
+    assert store.get_or_create("a") is not old
+    assert len(store.get("a")) == 0
+
+
+def test_orcamento_despeja_a_menos_usada():
+    store = SessionStore(memory_budget_bytes=10 ** 9)
+    _fill(store, "a")
+    _fill(store, "b")
+    store.get_or_create("a")  # 'b' passa a ser a menos usada
+    store.memory_budget_bytes = store.approx_bytes - 1
+
+    _fill(store, "a", turns=1)
+
+    assert store.session_ids() == ["a"]
+
+
+def test_orcamento_nao_despeja_sessao_com_turno_em_andamento():
+    locks = SessionLocks()
+    store = SessionStore(memory_budget_bytes=10 ** 9, is_busy=locks.is_held)
+    _fill(store, "a")
+    _fill(store, "b")
+    _fill(store, "c")
+    store.memory_budget_bytes = store.approx_bytes - 1
+
+    async def turn():
+        async with locks.hold("a"):
+            history = store.get("a")
+            _fill(store, "c", turns=1)
+            history.add_exchange("mais uma", {"intention": "normal", "stella_analysis": "ok"})
+            return history
+
+    history = asyncio.run(turn())
+
+    assert "a" in store and store.get("a") is history
+    assert "b" not in store
+    assert not locks.is_held("a")
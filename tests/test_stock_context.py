@@ -0,0 +1,63 @@
+"""
+Testes do recorte de estoque enviado ao LLM
+"""
+from stella.agent.stock_context import StockContextSelector
+
+
+def _stock(n_extra: int = 30):
+    stock = {
+        "mascara_n95": {"name": "Máscara N95", "quantity": 10, "categoryName": "EPI"},
+        "seringa_10ml": {"name": "Seringa 10ml", "quantity": 5, "categoryName": "Injetáveis"},
+        "luva_m": {"name": "Luva M", "quantity": 50, "categoryName": "EPI"},
+    }
+    for i in range(n_extra):
+        stock[f"item_generico_{i}"] = {"name": f"Item genérico {i}", "quantity": 1, "categoryName": "Diversos"}
+    return stock
+
+
+def test_fala_com_produto_recebe_so_os_relevantes():
+    selector = StockContextSelector(top_k=5)
+
+    context = selector.select(_stock(), "quantas máscaras temos?", version="v1")
+
+    assert not context.full_catalog
+    assert list(context.items) == ["mascara_n95"]
+    assert context.tokens_sent < context.tokens_full
+
+
+def test_erro_de_digitacao_ainda_casa_por_ngramas():
+    selector = StockContextSelector(top_k=5)
+
+    context = selector.select(_stock(), "quero duas seringgas", version="v1")
+
+    assert "seringa_10ml" in context.items
+
+
+def test_apelido_e_itens_pendentes_entram_no_recorte():
+    selector = StockContextSelector(top_k=5, aliases={"luva_m": ["luvinha"]})
+
+    context = selector.select(_stock(), "me ve uma luvinha", pending=["seringa_10ml"], version="v1")
+
+    assert list(context.items) == ["seringa_10ml", "luva_m"]
+
+
+def test_catalogo_pequeno_ou_fala_sem_produto_recebe_catalogo_completo():
+    selector = StockContextSelector(top_k=50)
+    assert selector.select(_stock(), "quantas máscaras temos?", version="v1").full_catalog
+
+    selector = StockContextSelector(top_k=5)
+    assert selector.select(_stock(), "bom dia stella", version="v1").full_catalog
+
+
+def test_indice_reaproveitado_por_versao_do_snapshot():
+    selector = StockContextSelector(top_k=5)
+    stock = _stock()
+    selector.select(stock, "mascara", version="v1")
+    index = selector._token_products
+
+    selector.select(stock, "luva", version="v1")
+    assert selector._token_products is index
+
+    stock["gaze_esteril"] = {"name": "Gaze estéril", "quantity": 3, "categoryName": "Curativos"}
+    context = selector.select(stock, "gaze", version="v2")
+    assert list(context.items) == ["gaze_esteril"]
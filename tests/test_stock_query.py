@@ -0,0 +1,77 @@
+"""
+Testes das respostas locais a consultas de estoque
+"""
+import json
+
+import pytest
+
+from stella.agent.product_index import ProductIndex
+from stella.agent.stock_query import StockQueryEngine, StockThreshold, is_stock_question, load_stock_thresholds, stock_level
+
+STOCK = {
+    "mascara_n95": {"name": "Máscara N95", "quantity": 3, "categoryName": "EPI"},
+    "luva_m": {"name": "Luva M", "quantity": 50, "categoryName": "EPI"},
+    "seringa_10ml": {"name": "Seringa 10ml", "quantity": 0, "categoryName": "Injetáveis"},
+    "gaze": {"name": "Gaze", "quantity": 20, "categoryName": "Curativos"},
+}
+THRESHOLDS = {
+    "mascaran95": StockThreshold(minimum=10, critical=2, unit="caixa"),
+    "luvam": StockThreshold(minimum=10),
+}
+
+
+@pytest.fixture
+def engine():
+    return StockQueryEngine(STOCK, ProductIndex(STOCK), THRESHOLDS, "v1")
+
+
+def test_quantidade_de_um_produto_com_alerta_de_minimo(engine):
+    resposta = engine.answer("quantas máscaras temos?")
+
+    assert resposta["intention"] == "stock_query"
+    assert resposta["response"] == "Temos 3 caixa(s) de Máscara N95 em estoque. Atenção: Máscara N95 abaixo do mínimo (10)."
+    assert resposta["stella_analysis"] == "low_stock_alert"
+
+
+def test_produto_zerado_e_critico(engine):
+    resposta = engine.answer("tem seringa?")
+
+    assert resposta["response"].startswith("No momento não temos Seringa 10ml em estoque.")
+    assert resposta["stella_analysis"] == "critical_stock_alert"
+
+
+def test_listagem_por_categoria(engine):
+    resposta = engine.answer("o que tem de EPI?")
+
+    assert resposta["response"].startswith("Itens de EPI: Máscara N95 (3 caixa(s)), Luva M (50 unidade(s)).")
+
+
+def test_itens_abaixo_do_minimo_do_mais_vazio_ao_mais_cheio(engine):
+    resposta = engine.answer("o que está acabando?")
+
+    assert resposta["response"] == "Itens abaixo do mínimo: Seringa 10ml (0), Máscara N95 (3, mínimo 10)."
+    assert resposta["stella_analysis"] == "critical_stock_alert"
+
+
+@pytest.mark.parametrize("fala", ["quero retirar 2 luvas", "bom dia", "quantos parafusos tem?"])
+def test_o_que_nao_e_consulta_conhecida_segue_para_o_llm(engine, fala):
+    assert engine.answer(fala) is None
+
+
+def test_is_stock_question():
+    assert is_stock_question("quantas luvas?")
+    assert not is_stock_question("quero pegar luvas")
+
+
+def test_niveis_e_limites_do_arquivo(tmp_path):
+    path = tmp_path / "stock.json"
+    path.write_text(json.dumps({"estoque": {"mascara_n95": {
+        "nome_completo": "Máscara N95", "quantidade_minima": 10, "quantidade_critica": 2, "unidade": "caixa"
+    }}}), encoding="utf-8")
+
+    thresholds = load_stock_thresholds(path)
+    threshold = thresholds["mascaran95"]
+
+    assert (threshold.minimum, threshold.critical, threshold.unit) == (10, 2, "caixa")
+    assert [stock_level(q, threshold) for q in (0, 2, 5, 10)] == ["critical", "critical", "low", "normal"]
+    assert load_stock_thresholds(tmp_path / "nao_existe.json") == {}
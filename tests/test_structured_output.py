@@ -0,0 +1,71 @@
+"""
+Testes do parse e do reparo da saída estruturada do Gemini
+"""
+import json
+
+import pytest
+
+pytest.importorskip("fastapi")  # stella.api.models
+
+from stella.agent.structured_output import (
+    LLM_INTENTIONS,
+    SchemaViolation,
+    lenient_parse,
+    parse_structured,
+    repair_contents,
+    response_schema,
+)
+
+VALIDO = {
+    "intention": "withdraw_request",
+    "items": [{"productName": "luva_m", "quantity": 2}],
+    "response": "Confirma 2 luvas?",
+    "stella_analysis": "normal",
+}
+
+
+def test_json_valido_com_ou_sem_cercas():
+    assert parse_structured(json.dumps(VALIDO))["items"] == [{"productName": "luva_m", "quantity": 2}]
+    assert parse_structured("```json\n" + json.dumps(VALIDO) + "\n```")["intention"] == "withdraw_request"
+
+
+@pytest.mark.parametrize("alteracao, campo", [
+    ({"intention": "error"}, "intention"),
+    ({"stella_analysis": "safety_check"}, "stella_analysis"),
+    ({"items": [{"productName": "luva_m"}]}, "items"),
+    ({"response": None}, "response"),
+])
+def test_violacoes_do_esquema_listam_o_campo(alteracao, campo):
+    with pytest.raises(SchemaViolation, match=campo):
+        parse_structured(json.dumps({**VALIDO, **alteracao}))
+
+
+def test_lenient_parse_troca_valores_desconhecidos():
+    resultado = lenient_parse(json.dumps({**VALIDO, "intention": "pedido", "stella_analysis": "?"}))
+
+    assert resultado["intention"] == "not_understood"
+    assert resultado["stella_analysis"] == "not_understood"
+    with pytest.raises(SchemaViolation):
+        lenient_parse(json.dumps({"intention": "normal"}))
+    with pytest.raises(json.JSONDecodeError):
+        lenient_parse("não é json")
+
+
+def test_conversa_de_reparo_inclui_resposta_e_violacoes():
+    contents = [{"role": "user", "parts": ["quero 2 luvas"]}]
+
+    repaired = repair_contents(contents, "{ruim}", "intention: valor não permitido")
+
+    assert repaired[:1] == contents and len(contents) == 1
+    assert repaired[1] == {"role": "model", "parts": ["{ruim}"]}
+    assert "intention: valor não permitido" in repaired[2]["parts"][0]
+
+
+def test_esquema_sem_chaves_que_o_gemini_recusa():
+    schema = response_schema()
+    raw = json.dumps(schema)
+
+    assert schema["properties"]["intention"]["enum"] == LLM_INTENTIONS
+    assert schema["properties"]["items"]["items"]["required"] == ["productName", "quantity"]
+    assert set(schema["required"]) == {"intention", "response", "stella_analysis"}
+    assert "$ref" not in raw and "$defs" not in raw and '"title"' not in raw
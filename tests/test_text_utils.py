@@ -0,0 +1,20 @@
+"""
+Testes da normalização de texto usada para casar falas com produtos
+"""
+from stella.agent.text_utils import ngram_similarity, singularize, tokenize
+
+
+def test_stopwords_no_plural_sao_removidas_antes_do_singular():
+    assert tokenize("quantas máscaras temos? quais tem mais", drop_stopwords=True) == ["mascara"]
+
+
+def test_tokenize_sem_acento_no_singular():
+    assert tokenize("Seringas_10ml e Luvas") == ["seringa", "10ml", "e", "luva"]
+    assert singularize("papeis") == "papel"
+    assert singularize("algodoes") == "algodao"
+
+
+def test_ngram_similarity():
+    assert ngram_similarity("mascara", "mascara") == 1.0
+    assert ngram_similarity("mascara", "mascar") > 0.5
+    assert ngram_similarity("mascara", "luva") == 0.0
@@ -0,0 +1,99 @@
+"""
+Testes do agrupamento de falas fragmentadas por sessão
+"""
+import asyncio
+import time
+
+from stella.agent.utterance_coalescer import UtteranceCoalescer
+
+
+def _runner():
+    turns = []
+
+    async def run(text, on_partial):
+        turns.append(text)
+        return {"text": text}
+
+    return run, turns
+
+
+def test_desativado_cada_fala_e_um_turno():
+    coalescer = UtteranceCoalescer(enabled=False)
+    run, turns = _runner()
+
+    async def scenario():
+        return await asyncio.gather(coalescer.submit("s1", "preciso de cinco", run),
+                                    coalescer.submit("s1", "seringas", run))
+
+    asyncio.run(scenario())
+
+    assert turns == ["preciso de cinco", "seringas"]
+
+
+def test_fragmentos_dentro_da_janela_viram_um_turno():
+    coalescer = UtteranceCoalescer(enabled=True, debounce_seconds=0.05, max_wait_seconds=1)
+    run, turns = _runner()
+
+    async def scenario():
+        first = asyncio.create_task(coalescer.submit("s1", "preciso de cinco", run))
+        await asyncio.sleep(0.02)
+        second = asyncio.create_task(coalescer.submit("s1", "seringas de dez ml", run))
+        other = asyncio.create_task(coalescer.submit("s2", "bom dia", run))
+        return await asyncio.gather(first, second, other)
+
+    first, second, other = asyncio.run(scenario())
+
+    assert first == second == {"text": "preciso de cinco seringas de dez ml"}
+    assert other == {"text": "bom dia"}
+    assert sorted(turns) == ["bom dia", "preciso de cinco seringas de dez ml"]
+
+
+def test_janela_limitada_pela_espera_maxima():
+    coalescer = UtteranceCoalescer(enabled=True, debounce_seconds=0.2, max_wait_seconds=0.3)
+    run, turns = _runner()
+
+    async def scenario():
+        tasks = []
+        for i in range(5):
+            tasks.append(asyncio.create_task(coalescer.submit("s1", f"parte {i}", run)))
+            await asyncio.sleep(0.12)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+
+    assert len(turns) == 2
+    assert turns[0].startswith("parte 0 parte 1 parte 2")
+
+
+def test_comando_completo_nao_espera_a_janela():
+    coalescer = UtteranceCoalescer(enabled=True, debounce_seconds=5, max_wait_seconds=10)
+    run, turns = _runner()
+
+    async def scenario():
+        started = time.monotonic()
+        result = await coalescer.submit("s1", "sim, confirmo", run, is_complete=lambda text: text.startswith("sim"))
+        return result, time.monotonic() - started
+
+    result, elapsed = asyncio.run(scenario())
+
+    assert result == {"text": "sim, confirmo"}
+    assert elapsed < 1
+    assert not coalescer._tasks
+
+
+def test_falha_do_turno_chega_a_todas_as_requisicoes_do_grupo():
+    coalescer = UtteranceCoalescer(enabled=True, debounce_seconds=0.02)
+
+    async def run(text, on_partial):
+        raise RuntimeError("LLM fora")
+
+    async def scenario():
+        return await asyncio.gather(
+            coalescer.submit("s1", "preciso de", run),
+            coalescer.submit("s1", "luvas", run),
+            return_exceptions=True
+        )
+
+    results = asyncio.run(scenario())
+
+    assert [type(r) for r in results] == [RuntimeError, RuntimeError]